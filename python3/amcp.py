@@ -28,25 +28,34 @@ __license__ = "GPL 3.0"
 __status__ = "Developement"
 __version__ = "0.1"
 
+import time
+startup_time = time.perf_counter()      # the imports below are part of the start up time
+
 from platform import platform
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QApplication, QFileDialog
 import pyqtgraph as pg
+import numpy as np
 import logging
 import sys
 import gui.amcpg as amcp_gui
-import serial
-import serial.tools.list_ports
 import subprocess
+import bisect
 import json
 import os
 
 #import VNA wrapper
-from methods.phaseshift_method import PhaseShiftMethod
-from methods.threedb_method import ThreedbMethod
-from devices.minivna_tiny.vnaj_wrapper import vnajWrapper
-from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+from methods.screening import CrystalScreening
+from gui.measurement_worker import MeasurementJob, AnalysisJob, TrackingJob, ProductionLine, ProductionBench, \
+    StartupJob, WorkerSignals
+from gui.results_model import ResultsTableModel
+from support.resonance_tracking import ResonanceTracker
 import support.data_management as dm
+from support.log_sink import LogSink
+from support.archive import ResultArchive, toRecord
+from support.result_store import ResultStore
+from support import model_export
+from support import timing
 
 class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
     logger = logging.getLogger(__name__)
@@ -59,7 +68,6 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
     L1 = 0.0
     R1 = 0.0
     ESR = 0.0
-    devs = []
     vna_type = ''
     minivna_port = None
     minivna_baud = 9600
@@ -69,24 +77,73 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
     graph = None
     method = 0      # 0: phaseshift method 1: -3dB Method
 
+    log_file = 'amcp.log'
+    log_history = 1000      # number of lines kept in the log windows
+    log_interval = 100      # log windows are updated every log_interval ms
+
+    tracking_history = 10000    # number of tracking samples kept in memory
+    tracking_bandwidths = 10    # width of the tracking window in multiples of the resonance bandwidth
+
+    sweep_points = 401      # points of a single nanoVNA sweep, scanned in segments of 101 points
+
     export_loc = '../vnaJ/export'
     export_data = 'scan_data'
     test_data = 'example_data'
 
     def __init__(self, parent=None):
         super(AmcpGui, self).__init__(parent)
+        self.startup_timing = [('imports', time.perf_counter() - startup_time)]
+        start = time.perf_counter()
         self.setupUi(self)
 
+        # log windows are fed in batches by a timer
+        self.log_sink = LogSink(history=self.log_history, file=self.log_file)
+        self.logfile.setMaximumBlockCount(self.log_history)
+        self.logfile_small.document().setMaximumBlockCount(self.log_history)
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(self.log_interval)
+
         # graph initialisation
         self.pen2 = pg.mkPen(color=(0, 0, 200), width=2)
         self.pen1 = pg.mkPen(color=(200, 0, 0), width=2)
         self.graphWidget.setBackground('w')
         self.graphWidget.showGrid(x=True, y=True, alpha=1)
+        self.graphWidget.setLogMode(False, False)
+
+        # the curves are created once and only get new data, only the visible part is drawn and large sweeps are
+        # reduced to their min/max envelope
+        plot_item = self.graphWidget.getPlotItem()
+        plot_item.setClipToView(True)
+        plot_item.setDownsampling(auto=True, mode='peak')
+        self.power_curve = self.graphWidget.plot(pen=self.pen1)
+        self.phase_curve = self.graphWidget.plot(pen=self.pen2)
+
+        # live plotting: incoming data is only drawn by a timer capped at live_fps
+        self.live_fps = 25
+        self.live_data = None
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.setInterval(int(1000 / self.live_fps))
+        self.live_timer.timeout.connect(self.draw_live)
+
+        # the timing breakdown and the serial link metrics are refreshed by a timer while the timing tab is shown
+        self.timing_timer = QtCore.QTimer(self)
+        self.timing_timer.setInterval(1000)
+        self.timing_timer.timeout.connect(self.update_timing)
+        self.timing_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        self.link_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        self.tabWidget.currentChanged.connect(self.on_tab_changed)
 
         # OS specific setup
         self.os_specific_init()
 
-        # COM ports
+        # COM ports are watched in the background, the port list is updated on every change and known nanoVNAs are
+        # connected again when they are plugged in
+        self.known_vnas = set()     # serial numbers of the nanoVNAs connected before
+        self.port_signals = WorkerSignals()
+        self.port_signals.port_added.connect(self.on_port_added)
+        self.port_signals.port_removed.connect(self.on_port_removed)
+        self.port_monitor = None    # started by deferred_init(), pyserial is not needed to show the window
         self.update_comports()
 
         # select VNA
@@ -94,20 +151,74 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
 
         # measurement methods
         self.export_file = '{}/{}.csv'.format(self.export_loc, self.export_data)
-        self.data = self.loadData(self.export_file)
-        self.psm = PhaseShiftMethod()
-        self.db3 = ThreedbMethod()
+        self.data = None    # the last export is only loaded when it is recomputed
+        self.screener = CrystalScreening()
+        self.screening_result = None
+
+        # background jobs: one acquisition at a time, analyses may overlap with the next acquisition
+        self.acquisition_pool = QtCore.QThreadPool(self)
+        self.acquisition_pool.setMaxThreadCount(1)
+        self.analysis_pool = QtCore.QThreadPool(self)
+        self.measurement = None
+        self.jobs = set()
+
+        # production mode
+        self.production = None
+        # all results of the session, the table only renders the visible rows with a fixed row height
+        self.results_model = ResultsTableModel(parent=self)
+        self.results_table.setModel(self.results_model)
+        self.results_table.setSortingEnabled(True)
+        self.results_table.sortByColumn(-1, QtCore.Qt.AscendingOrder)
+        self.results_table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        self.results_table.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 4)
+        self.next_part_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_F5), self)
+        self.next_part_shortcut.activated.connect(self.trigger_part)
 
         # menu
         self.actionClose.triggered.connect(self.close)
         self.actionSave.triggered.connect(self.save_setup)
         self.actionLoad.triggered.connect(self.load_setup)
+        self.actionLoad_results.triggered.connect(self.load_results)
         self.actionas_SPICE_model.triggered.connect(self.save_spice_model)
         self.actionas_Spectre_model.triggered.connect(self.save_spectre_model)
+        self.actionresults_as_SPICE_library.triggered.connect(lambda: self.save_library(model='spice'))
+        self.actionresults_as_Spectre_library.triggered.connect(lambda: self.save_library(model='spectre'))
         self.actionDocumentation.triggered.connect(self.open_documentation)
         self.actionAbout.triggered.connect(self.load_about)
         self.actionHelp.triggered.connect(self.help)
 
+        # everything not needed to show the window is done in the background once the event loop runs
+        self.startup_timing.append(('user interface', time.perf_counter() - start))
+        QtCore.QTimer.singleShot(0, self.deferred_init)
+
+    def deferred_init(self):
+        self.startup_timing.append(('window shown', time.perf_counter() - startup_time))
+        from devices.port_monitor import PortMonitor
+        self.port_monitor = PortMonitor(on_add=self.port_signals.port_added.emit,
+                                        on_remove=self.port_signals.port_removed.emit)
+        self.port_monitor.start()
+        job = StartupJob(export_file=self.export_file)
+        job.signals.data.connect(self.on_last_session)
+        job.signals.error.connect(self.update_log)
+        job.signals.finished.connect(lambda: self.on_startup_finished(job))
+        self.jobs.add(job)
+        self.analysis_pool.start(job)
+
+    def on_last_session(self, data):
+        # a measurement done in the meantime is not replaced
+        if self.data is None:
+            self.data = data
+            self.plot_spectrum(frequency=data['Frequency(Hz)'],
+                               power=data['Transmission Loss(dB)'],
+                               phase=data['Phase(deg)'])
+
+    def on_startup_finished(self, job):
+        self.jobs.discard(job)
+        self.startup_timing += [(name, t) for name, t in job.timing.items()]
+        report = ', '.join('{} {:.0f} ms'.format(name, t * 1e3) for name, t in self.startup_timing)
+        self.logger.info('startup: {}'.format(report))
+        self.update_log('startup: {}'.format(report))
+
     def os_specific_init(self):
         os = platform()
         if 'windows' in os.lower():
@@ -116,27 +227,42 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
             self.java_loc.setText('../oracle_java/jre1.8.0_221/bin/java')
 
     def refresh_comports(self):
-        devs = sorted(set(['-']+[i[0] for i in list(serial.tools.list_ports.comports())]))
-        tmp = [item for item in set(self.devs) if not item in devs]  # list of changed ports
-        self.logger.info('COM port list changes: {}'.format(tmp))
-        for dev in tmp:
-            if dev in self.devs:
-                self.update_log(text='COM port removed: {}'.format(dev))
-
-        tmp = [item for item in devs if not item in set(self.devs)]  # list of changed ports
-        self.logger.info('COM port list changes: {}'.format(tmp))
-        for dev in tmp:
-            if dev in devs:
-                self.update_log(text='New COM port found: {}'.format(dev))
-
-        if not devs:
-            self.devs = ['-']
-        else:
-            self.devs = devs
-
-        self.sel_minivna_port.clear()
-        self.sel_minivna_port.addItems(self.devs)
-        self.update()
+        if self.port_monitor:
+            self.port_monitor.scan()
+
+    def on_port_added(self, port):
+        ports = [self.sel_minivna_port.itemText(i) for i in range(self.sel_minivna_port.count())]
+        if port.device not in ports:
+            self.sel_minivna_port.insertItem(bisect.bisect(ports, port.device), port.device)
+        self.update_log(text='New COM port found: {}'.format(port.device))
+        self.auto_connect(port)
+
+    def on_port_removed(self, port):
+        i = self.sel_minivna_port.findText(port.device)
+        if i >= 0:
+            self.sel_minivna_port.removeItem(i)
+        self.update_log(text='COM port removed: {}'.format(port.device))
+
+        session = getattr(self.vna, 'session', None)
+        if session is not None and port.device == session.dev:
+            session.disconnect()
+            self.update_log('lost connection to NanoVNA {}'.format(port.serial_number or port.device))
+
+    def auto_connect(self, port):
+        from devices.nanovna.nanovna import VID, PID
+        if (port.vid, port.pid) != (VID, PID) or port.serial_number not in self.known_vnas:
+            return
+
+        session = getattr(self.vna, 'session', None)
+        if session is not None:
+            # the session finds its device by the serial number, also if it came back on another path
+            if session.serial_number == port.serial_number and not session.isAlive():
+                session.connect()
+                self.update_log('reconnected to NanoVNA {} at {}'.format(port.serial_number, session.dev))
+        elif self.vna is None and self.select_vna.currentText() == 'NanoVNA':
+            from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+            self.vna = nanoVnaWrapper(dev=port.device)
+            self.update_log('Connected to NanoVNA {} at {}'.format(port.serial_number, port.device))
 
     def update_comports(self):
         self.minivna_port = self.sel_minivna_port.currentText().split('/')[-1]
@@ -147,32 +273,36 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
         self.vna_type = self.select_vna.currentText()
 
     def recompute(self):
-        # calculate results from data
+        # calculate results from data in the analysis pool
         self.method = self.sel_method.currentText()
+        if self.data is None:
+            e = self.loadData(self.export_file)
+            if e:
+                self.update_log(e)
+                return
 
         try:
-            if self.method == 'Phase-Shift Method':
-                self.psm.updateData(data=self.data)
-                self.psm.calcParameters(r_setup=float(self.r_setup.text()),
-                                        cl=float(self.ext_cl.text()))
-                self.C0, self.C1, self.L1, self.R1, self.Q, self.fs, self.fp, self.ESR = self.psm.getResults()
-            elif self.method == '-3dB Method':
-                self.db3.updateData(data=self.data)
-                self.db3.calcParameters(r_setup=float(self.r_setup.text()),
-                                        cl=float(self.ext_cl.text()))
-                self.C0, self.C1, self.L1, self.R1, self.Q, self.fs, self.fp, self.ESR = self.db3.getResults()
-            else:
-                self.logger.debug('error: invalid calculation method used!')
-
-            self.update_results()
+            job = AnalysisJob(self.data, self.method, r_setup=float(self.r_setup.text()),
+                              cl=float(self.ext_cl.text()))
         except Exception as e:
-            #self.C0, self.C1, self.L1, self.R1, self.Q, self.fs, self.fp = [0, 0, 0, 0, 0, 0, 0]
-            self.logger.debug('error: could not calculate parameters:\n'.format(e))
             self.update_log('could not calculate parameters')
             self.update_log('{}'.format(e))
+            return
+        job.signals.result.connect(self.on_results)
+        job.signals.error.connect(self.update_log)
+        job.signals.finished.connect(lambda: self.jobs.discard(job))
+        self.jobs.add(job)
+        self.analysis_pool.start(job)
+
+    def on_results(self, results):
+        self.C0, self.C1, self.L1, self.R1, self.Q, self.fs, self.fp, self.ESR = results
+        self.update_results()
+        self.results_model.appendRecord(toRecord(results, part_id=self.part_id.text().strip(), time=time.time()))
+        self.progressBar.setValue(100)
 
     def connect_vna(self):
         if self.vna_type == 'MiniVNA':
+            from devices.minivna_tiny.vnaj_wrapper import vnajWrapper
             self.logger.info('connecting to miniVNA')
             self.vna = vnajWrapper(java_loc=self.java_loc.text(),
                                    vnaJ_loc=self.vnajhl_loc.text(),
@@ -185,12 +315,17 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
             self.update_log('Connected to miniVNA')
 
         elif self.vna_type == 'NanoVNA':
-            self.vna = nanoVnaWrapper()
+            from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+            self.vna = nanoVnaWrapper(dev=self.nanovna_port)
+            if self.vna.session.serial_number:
+                self.known_vnas.add(self.vna.session.serial_number)
             self.logger.info('Connected to NanoVNA')
             self.update_log('Connected to NanoVNA')
 
     def disconnect_vna(self):
         try:
+            if hasattr(self.vna, 'close'):
+                self.vna.close()
             del self.vna
             self.update_log('Disconnecting from {}'.format(self.vna_type))
         except Exception as e:
@@ -199,6 +334,9 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
 
     def run_measurement(self):
         self.logger.debug('running measurement')
+        if self.measurement is not None:
+            self.update_log('measurement already running')
+            return
 
         # update progressbar 0%
         self.progressBar.setValue(0)
@@ -211,55 +349,305 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
         self.update_log('f_min={}'.format(fmin))
         self.update_log('f_max={}'.format(fmax))
 
-        # update progressbar 100%
-        self.progressBar.setValue(10)
-
         # make sure the com ports are updated
         self.update_comports()
 
-        # run measurement
-        if self.select_vna.currentText() == 'MiniVNA':
+        # the acquisition runs in its own thread, the gui is only updated through the job's signals
+        job = MeasurementJob(self.vna, self.select_vna.currentText(), fmin, fmax,
+                             averaging=self.averaging.text(),
+                             points=self.sweep_points,
+                             screener=self.screener if self.screening.isChecked() else None,
+                             export_file=self.export_file,
+                             test_file='{}/{}.csv'.format(self.export_loc, self.test_data))
+        job.signals.progress.connect(self.progressBar.setValue)
+        job.signals.log.connect(self.update_log)
+        job.signals.error.connect(self.update_log)
+        job.signals.partial.connect(self.on_partial_data)
+        job.signals.estimate.connect(self.on_estimate)
+        job.signals.screened.connect(self.on_screened)
+        job.signals.data.connect(self.on_data)
+        job.signals.finished.connect(self.on_measurement_finished)
+        self.measurement = job
+        self.btn_run_measurement.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
+        self.acquisition_pool.start(job)
+
+    def cancel_measurement(self):
+        if self.measurement is not None:
+            self.update_log('cancelling measurement')
+            self.measurement.cancel()
+
+    def toggle_tracking(self, checked):
+        if not checked:
+            self.cancel_measurement()
+            return
+        if self.measurement is not None:
+            self.update_log('measurement already running')
+            self.reset_track_button()
+            return
+
+        # start at the last measured resonance, or in the middle of the span
+        fmin = float(self.f_min.text())
+        fmax = float(self.f_max.text())
+        fs = self.fs if fmin < self.fs < fmax else (fmin + fmax) / 2
+        span = self.tracking_bandwidths * self.fs / self.Q if self.fs and self.Q else fmax - fmin
+        log_file = '{}/tracking_{}.bin'.format(self.export_loc, time.strftime('%Y%m%d_%H%M%S'))
+        try:
+            tracker = ResonanceTracker(self.vna, fs=fs, span=span, history=self.tracking_history, log_file=log_file,
+                                       r_setup=float(self.r_setup.text()))
+        except OSError as e:
+            self.update_log('could not start tracking:\n{}'.format(e))
+            self.reset_track_button()
+            return
+        self.update_log('tracking fs around {:.0f} Hz with {:.0f} Hz span, logging to {}'.format(fs, span, log_file))
+
+        job = TrackingJob(tracker)
+        job.signals.partial.connect(self.on_partial_data)
+        job.signals.result.connect(self.on_tracking_sample)
+        job.signals.error.connect(self.update_log)
+        job.signals.finished.connect(self.on_measurement_finished)
+        self.measurement = job
+        self.btn_run_measurement.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
+        self.acquisition_pool.start(job)
+
+    def reset_track_button(self):
+        # without toggling tracking off, which would cancel the running measurement
+        self.btn_track.blockSignals(True)
+        self.btn_track.setChecked(False)
+        self.btn_track.blockSignals(False)
+
+    def on_tracking_sample(self, record):
+        self.fs = record['fs']
+        self.R1 = record['R1']
+        self.fs_res.setText('%.3f' % (self.fs/1e3))
+        self.R1_res.setText('%.1f' % self.R1)
+
+    # production mode
+
+    def add_part(self):
+        part_id = self.part_id.text().strip()
+        if not part_id:
+            return
+        self.part_queue.addItem(part_id)
+        self.part_id.clear()
+        if self.production:
+            self.production.submit(part_id)
+
+    def toggle_production(self, checked):
+        if not checked:
+            if self.production:
+                self.update_log('stopping production after the current part')
+                self.production.stop()
+            return
+        vnas = self.production_vnas() if self.measurement is None else []
+        if not vnas:
+            self.update_log('connect a VNA and wait for the running measurement to start production')
+            self.btn_production.setChecked(False)
+            return
+
+        folder = '{}/production/{}'.format(self.export_loc, time.strftime('%Y%m%d_%H%M%S'))
+        options = dict(archive=ResultArchive(folder),
+                       method=self.sel_method.currentText(),
+                       averaging=self.averaging.text(),
+                       points=self.sweep_points,
+                       r_setup=float(self.r_setup.text()),
+                       cl=float(self.ext_cl.text()),
+                       screener=self.screener if self.screening.isChecked() or self.auto_trigger.isChecked()
+                       else None,
+                       auto_trigger=self.auto_trigger.isChecked(),
+                       export_file=self.export_file)
+        if len(vnas) > 1:
+            line = ProductionBench(vnas, self.f_min.text(), self.f_max.text(), **options)
+            self.update_log('production on {}'.format(', '.join(name for name, _, _ in vnas)))
+        else:
+            _, vna, vna_type = vnas[0]
+            line = ProductionLine(vna, vna_type, self.f_min.text(), self.f_max.text(), **options)
+        line.signals.log.connect(self.update_log)
+        line.signals.error.connect(self.update_log)
+        line.signals.partial.connect(self.on_partial_data)
+        line.signals.estimate.connect(self.on_estimate)
+        line.signals.result.connect(self.on_part_finished)
+        line.signals.finished.connect(self.on_production_finished)
+        for row in range(self.part_queue.count()):
+            line.submit(self.part_queue.item(row).text())
+
+        self.production = line
+        self.btn_run_measurement.setEnabled(False)
+        self.btn_track.setEnabled(False)
+        self.btn_next_part.setEnabled(not self.auto_trigger.isChecked())
+        self.btn_production.setText('Stop Production')
+        self.update_log('production started, archiving to {}'.format(folder))
+        line.start()
+
+    def production_vnas(self):
+        """
+        :return: list of (name, vna, vna type) used for production, the connected VNA or with "Use all VNAs" every
+                 attached nanoVNA and the connected VNA
+        """
+        vnas = {}
+        if self.vna is not None:
+            session = getattr(self.vna, 'session', None)
+            name = session.dev if session is not None else self.minivna_port
+            vnas[name] = (name, self.vna, self.select_vna.currentText())
+        if self.all_vnas.isChecked():
+            from devices.device_pool import DevicePool
+            pool = DevicePool(nanovna=True)
             try:
-                e = self.vna.run_vnaJ(fstart=int(float(self.f_min.text())),
-                                      fstop=int(float(self.f_max.text())),
-                                      average=self.averaging.text(),
-                                      exports='csv')
+                pool.discover()
+            except Exception as e:
+                self.update_log('could not connect all VNAs:\n{}'.format(e))
+            for name, vna in pool.devices.items():
+                # the connected nanoVNA shares its session with the wrapper of the pool
+                vnas.setdefault(name, (name, vna, pool.types[name]))
+        return list(vnas.values())
+
+    def trigger_part(self):
+        if self.production and not self.production.auto_trigger:
+            self.production.trigger()
+
+    def on_part_finished(self, item):
+        if item.status == 'cancelled':
+            return
+        items = self.part_queue.findItems(item.part_id, QtCore.Qt.MatchExactly)
+        if items:
+            self.part_queue.takeItem(self.part_queue.row(items[0]))
+        self.results_model.appendRecord(item.results)
+        self.results_table.scrollToBottom()
+        if item.data is not None:
+            self.plot_spectrum(frequency=item.data['Frequency(Hz)'],
+                               power=item.data['Transmission Loss(dB)'],
+                               phase=item.data['Phase(deg)'])
+
+        stages = ', '.join('{} {:.2f} s'.format(name, t) for name, t in self.production.stageTimes().items())
+        self.throughput.setText('{:.1f} crystals/h  |  {}'.format(self.production.throughput(), stages))
+        self.update_log('part {}: {}'.format(item.part_id, item.status))
+
+    def filter_results(self, text):
+        self.results_model.setFilterText(text)
+
+    def load_results(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        fileName, _ = QFileDialog.getOpenFileName(self, "QFileDialog.getOpenFileName()",
+                                                  '{}/production'.format(self.export_loc),
+                                                  "Results (*.bin);;All Files (*)", options=options)
+        if not fileName:
+            return
+        try:
+            # the archive is mapped, the results of this session are kept behind it
+            store = ResultStore.open(fileName)
+            store.extend(self.results_model.store.records())
+        except Exception as e:
+            self.update_log('could not load results:\n{}'.format(e))
+            return
+        self.results_model.setStore(store)
+        self.update_log('loaded {} results from {}'.format(len(store), fileName))
+
+    def on_tab_changed(self, index):
+        if self.tabWidget.widget(index) is self.tab_timing:
+            self.update_timing()
+            self.timing_timer.start()
+        else:
+            self.timing_timer.stop()
 
-                # update progressbar 50%
-                self.progressBar.setValue(50)
+    def toggle_timing(self, checked):
+        timing.enable(checked)
+        self.update_timing()
 
-                self.loadData(file=self.export_file)
-                self.plot_spectrum(frequency=self.data['Frequency(Hz)'],
-                                   power=self.data['Transmission Loss(dB)'],
-                                   phase=self.data['Phase(deg)'])
+    def reset_timing(self):
+        timing.reset()
+        session = getattr(self.vna, 'session', None)
+        if session is not None:
+            session.metrics.reset()
+        self.update_timing()
 
-            except Exception as e:
-                self.logger.debug('error: measurement not completed:\n{}'.format(e))
-                self.update_log('could not run vnaJ, loading example data')
-                self.update_log('{}'.format(e))
-                self.loadData('{}/{}.csv'.format(self.export_loc, self.test_data))
-                self.plot_spectrum(frequency=self.data['Frequency(Hz)'],
-                                   power=self.data['Transmission Loss(dB)'],
-                                   phase=self.data['Phase(deg)'])
-
-        elif self.select_vna.currentText() == 'NanoVNA':
-            self.vna.setFrequencies(start=float(self.f_min.text()), stop=float(self.f_max.text()))
-            self.data = self.vna.getTrData(averaging=int(self.averaging.text()))
-
-            self.plot_spectrum(frequency=self.data['Frequency(Hz)'],
-                               power=self.data['Transmission Loss(dB)'],
-                               phase=self.data['Phase(deg)'])
-
-        # update progressbar 90%
+    def export_timing(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        fileName, _ = QFileDialog.getSaveFileName(self, "QFileDialog.getSaveFileName()", self.export_loc,
+                                                  "JSON (*.json);;Prometheus (*.prom);;All Files (*)",
+                                                  options=options)
+        if not fileName:
+            return
+        try:
+            timing.export(fileName)
+        except Exception as e:
+            self.update_log('could not export timing:\n{}'.format(e))
+            return
+        self.update_log('timing exported to {}'.format(fileName))
+
+    def update_timing(self):
+        rows = timing.breakdown()
+        self.timing_table.setRowCount(len(rows))
+        for i, (stage, count, total, mean, p95, maximum) in enumerate(rows):
+            for j, text in enumerate((stage, str(count), '%.3f' % total, '%.1f' % (mean * 1e3),
+                                      '%.1f' % (p95 * 1e3), '%.1f' % (maximum * 1e3))):
+                self.timing_table.setItem(i, j, QtWidgets.QTableWidgetItem(text))
+
+        session = getattr(self.vna, 'session', None)
+        rows = session.metrics.summary() if session is not None else []
+        self.link_table.setRowCount(len(rows))
+        for i, (verb, commands, sent, received, p50, p95, throughput, stalls) in enumerate(rows):
+            for j, text in enumerate((verb, str(commands), str(sent), str(received), '%.1f' % (p50 * 1e3),
+                                      '%.1f' % (p95 * 1e3), '%.1f' % (throughput / 1e3), str(stalls))):
+                self.link_table.setItem(i, j, QtWidgets.QTableWidgetItem(text))
+
+    def on_production_finished(self):
+        self.production.archive.close()
+        self.production = None
+        self.btn_run_measurement.setEnabled(True)
+        self.btn_track.setEnabled(True)
+        self.btn_next_part.setEnabled(False)
+        self.btn_production.setText('Start Production')
+        self.btn_production.blockSignals(True)
+        self.btn_production.setChecked(False)
+        self.btn_production.blockSignals(False)
+        self.update_log('production stopped')
+
+    def on_screened(self, result):
+        self.screening_result = result
+
+    def on_partial_data(self, data):
+        self.plot_live(frequency=data['Frequency(Hz)'],
+                       power=data['Transmission Loss(dB)'],
+                       phase=data['Phase(deg)'])
+
+    def on_estimate(self, estimate):
+        # provisional values while the sweep is acquired, replaced by the results of the analysis
+        fs, fp, Q = estimate
+        self.fs_res.setText('%.0f' % (fs/1e3) if fs else '-')
+        self.fp_res.setText('%.0f' % (fp/1e3) if fp else '-')
+        self.Q_res.setText('%.1f' % Q if Q else '-')
+
+    def on_data(self, data):
+        self.data = data
+        self.plot_spectrum(frequency=self.data['Frequency(Hz)'],
+                           power=self.data['Transmission Loss(dB)'],
+                           phase=self.data['Phase(deg)'])
         self.progressBar.setValue(90)
-
         self.recompute()
 
-        # update progressbar 100%
-        self.progressBar.setValue(100)
-
-        # update gui
-        self.update()
+    def on_measurement_finished(self):
+        # the next measurement may start while the analysis of this one is still running
+        self.measurement = None
+        self.btn_run_measurement.setEnabled(True)
+        self.btn_cancel.setEnabled(False)
+        self.btn_track.setChecked(False)
+
+    def closeEvent(self, event):
+        if self.port_monitor:
+            self.port_monitor.stop()
+        self.cancel_measurement()
+        if self.production:
+            self.production.stop()
+            self.production.join(5)
+            self.production.archive.close()
+        self.acquisition_pool.waitForDone(5000)
+        self.analysis_pool.waitForDone(5000)
+        self.flush_log()
+        self.log_sink.close()
+        super(AmcpGui, self).closeEvent(event)
 
     def run_estimation(self):
         self.logger.debug('running estimation')
@@ -270,12 +658,29 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
         self.f_max.setText(xlimits[1])
         self.update()
 
+    @timing.timed('gui.plot')
     def plot_spectrum(self, frequency, power, phase):
-        self.graphWidget.plot(frequency, power, pen=self.pen1, clear=True)
-        self.graphWidget.plot(frequency, phase, pen=self.pen2)
-        self.graphWidget.setBackground('w')
-        self.graphWidget.setLogMode(False, False)
-        self.update()
+        # final data replaces anything still waiting for the live plot
+        self.live_data = None
+        frequency = np.asarray(frequency, dtype=float)
+        self.power_curve.setData(frequency, np.asarray(power, dtype=float))
+        self.phase_curve.setData(frequency, np.asarray(phase, dtype=float))
+
+    def plot_live(self, frequency, power, phase):
+        """
+        Queue data for the live plot. Data arriving faster than live_fps only replaces the pending frame.
+        """
+        self.live_data = (frequency, power, phase)
+        if not self.live_timer.isActive():
+            self.draw_live()
+            self.live_timer.start()
+
+    def draw_live(self):
+        if self.live_data is None:
+            self.live_timer.stop()
+            return
+        frequency, power, phase = self.live_data
+        self.plot_spectrum(frequency, power, phase)
 
     def update_results(self):
         self.C0_res.setText('%.1f' % (self.C0*1e15))
@@ -292,10 +697,14 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
             self.esr_res.setText('%.1f' % self.ESR)
 
     def update_log(self, text='\n'):
-        self.logfile.appendPlainText(text)
-        self.logfile.update()
-        self.logfile_small.append('> '+text)
-        self.logfile_small.update()
+        # thread-safe, the widgets are updated by flush_log()
+        self.log_sink.write(text)
+
+    def flush_log(self):
+        messages = self.log_sink.flush()
+        if messages:
+            self.logfile.appendPlainText('\n'.join(messages))
+            self.logfile_small.append('\n'.join('> ' + text for text in messages))
 
     def run_vnaj(self):
         self.update_log('launching VnaJ')
@@ -346,7 +755,9 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
             'fstop': self.f_max.text(),
             'ext CL': self.ext_cl.text(),
             'R setup': self.r_setup.text(),
-            'method': self.sel_method.currentText()
+            'method': self.sel_method.currentText(),
+            'screening': self.screening.isChecked(),
+            'known nanovnas': sorted(self.known_vnas)
         }
 
         options = QFileDialog.Options()
@@ -381,62 +792,44 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
                 self.ext_cl.setText(data['ext CL'])
                 self.r_setup.setText(data['R setup'])
                 self.sel_method.setCurrentText(data['method'])
+                self.screening.setChecked(data.get('screening', True))
+                self.known_vnas.update(data.get('known nanovnas', []))
         except Exception as e:
             self.update_log('could not load file:\n{}'.format(e))
 
+    def _model_file(self, model, library=False):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        extension = model['library'] if library else model['extension']
+        fileName, _ = QFileDialog.getSaveFileName(self, "QFileDialog.getSaveFileName()", "",
+                                                  "{} Files (*.{});;All Files (*)".format(model['name'], extension),
+                                                  options=options)
+        if fileName and not fileName.endswith('.{}'.format(extension)):
+            fileName = '{}.{}'.format(fileName, extension)
+        return fileName
+
     def save_model(self, model='spice', C0=0, C1=0, R1=0, L1=0):
-        xtal_model = None
-        if model == 'spice':
-            self.update_log('exporting results as SPICE model')
-            xtal_model = '* XTAL Model\n' \
-                         '* Description: equivalent cirquit model of a crystal resonator\n' \
-                         '* Generated by AMCP\n' \
-                         '*\n' \
-                         '* Node Assignments:\n' \
-                         '*            input\n' \
-                         '*            |  output\n'\
-                         '*            |  |\n' \
-                         '.SUBCKT xtal xi xo\n' \
-                         'R1 net0 xi {}\n' \
-                         'C1 net1 net0 {}\n' \
-                         'C0 xo xi {}\n' \
-                         'L1 xo net1 {}\n' \
-                         '.ENDS'.format(R1, C1, C0, L1)
-            model = ['SPICE', 'cir']
-        elif model == 'spectre':
-            self.update_log('exporting results as SPECTRE model')
-            xtal_model = 'simulator lang=spectre\n' \
-                         '#\n' \
-                         '# XTAL Model\n' \
-                         '# Description: equivalent cirquit model of a crystal resonator\n' \
-                         '# Generated by AMCP\n' \
-                         '#\n' \
-                         '# Node Assignments:\n' \
-                         '#           input\n' \
-                         '#           |  output\n' \
-                         '#           |  |\n' \
-                         'subckt xtal xi xo\n' \
-                         'R1 (net0 xi) r={}\n' \
-                         'C1 (net1 net0) c={}\n' \
-                         'C0 (xo xi) c={}\n' \
-                         'L1 (xo net1) l={}\n' \
-                         'ends'.format(R1, C1, C0, L1)
-            model = ['Spectre', 'spectre']
-        else:
+        if model not in model_export.FORMATS:
             self.update_log('invalid export format [spice, spectre]')
-
-        if xtal_model:
-            options = QFileDialog.Options()
-            options |= QFileDialog.DontUseNativeDialog
-            fileName, _ = QFileDialog.getSaveFileName(self, "QFileDialog.getSaveFileName()", "",
-                                                      "{} Files (*.{});;All Files (*)".format(model[0],
-                                                                                              model[1]),
-                                                      options=options)
-            if '.{}'.format(model[1]) not in fileName and fileName:
-                fileName = '{}.{}'.format(fileName, model[1])
-
-                with open(fileName, 'w', newline='') as modelwriter:
-                    modelwriter.write(xtal_model)
+            return
+        self.update_log('exporting results as {} model'.format(model_export.FORMATS[model]['name']))
+        fileName = self._model_file(model_export.FORMATS[model])
+        if fileName:
+            with open(fileName, 'w', newline='') as modelwriter:
+                modelwriter.write(model_export.subcircuit(model, C0=C0, C1=C1, R1=R1, L1=L1))
+
+    def save_library(self, model='spice'):
+        # all results of the table, e.g. of a loaded lot, one subcircuit per passed part
+        records = self.results_model.store.records()
+        fileName = self._model_file(model_export.FORMATS[model], library=True)
+        if not fileName:
+            return
+        try:
+            count = model_export.exportLibrary([records], fileName, model)
+        except Exception as e:
+            self.update_log('could not export library:\n{}'.format(e))
+            return
+        self.update_log('{} models of {} results exported to {}'.format(count, len(records), fileName))
 
     def save_spice_model(self):
         self.save_model(model='spice', C0=self.C0, C1=self.C1, R1=self.R1, L1=self.L1)
@@ -454,10 +847,26 @@ class AmcpGui(QtWidgets.QMainWindow, amcp_gui.Ui_MainWindow, dm.DataManagement):
         self.update_log('tbd help')
 
 def main():
-    app = QApplication(sys.argv)
+    import argparse
+    p = argparse.ArgumentParser(description='Automated Crystal Parameter Measurement')
+    p.add_argument('--nanovna-port', default=None, help='serial port of the nanoVNA, first nanoVNA found if not given')
+    p.add_argument('--emulator', default=None, metavar='PROFILE',
+                   help='connect to an emulated nanoVNA with a timing profile of devices/nanovna/emulator.py')
+    args, qt_args = p.parse_known_args()
+
+    emulator = None
+    if args.emulator:
+        from devices.nanovna.emulator import NanoVNAEmulator
+        emulator = NanoVNAEmulator(profile=args.emulator)
+        args.nanovna_port = emulator.start()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     form = AmcpGui()
+    form.nanovna_port = args.nanovna_port
     form.show()
     app.exec_()
+    if emulator:
+        emulator.stop()
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
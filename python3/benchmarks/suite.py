@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Benchmark Suite
+
+Times the hot paths of acquisition, parsing and analysis on synthetic scans (see support/synthetic.py) from 101 to
+100k points, no VNA is needed. Run from the python3 folder:
+
+>> python -m benchmarks.suite run -o baseline.json
+>> python -m benchmarks.suite run -o current.json
+>> python -m benchmarks.suite compare baseline.json current.json
+
+run exits with 1 if a benchmark failed, e.g. because a method returned wrong results, compare also if a benchmark got
+slower than the threshold, so they can be used as a check before a release.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from support.synthetic import ScanGenerator
+
+POINTS = (101, 1001, 10001, 100001)
+
+# name, setup function; the setup function gets the number of points and returns the function to time
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def _scan():
+    # the same noisy scan of the ideal model for all benchmarks
+    return ScanGenerator(noise=1e-4, seed=0)
+
+
+@benchmark('data_management.loadData')
+def _loadData(points, folder):
+    import support.data_management as dm
+    file = _scan().writeCsv(os.path.join(folder, 'scan_{}.csv'.format(points)), points=points)
+    return lambda: dm.DataManagement().loadData(file=file)
+
+
+@benchmark('data_management.readTouchstone')
+def _readTouchstone(points, folder):
+    import support.data_management as dm
+    file = _scan().writeTouchstone(os.path.join(folder, 'scan_{}.s2p'.format(points)), points=points)
+    return lambda: dm.readTrData(file)
+
+
+@benchmark('data_management.writeTouchstone')
+def _writeTouchstone(points, folder):
+    import support.data_management as dm
+    scan = _scan()
+    frequency = scan.frequencies(points)
+    s21 = scan.s21(frequency)
+    file = os.path.join(folder, 'written_{}.s2p'.format(points))
+    return lambda: dm.writeTouchstone(file, frequency, 1 - s21, s21)
+
+
+@benchmark('nanovna.parse_complex')
+def _parseComplex(points, folder):
+    from devices.nanovna.nanovna import parse_complex
+    scan = _scan()
+    s = scan.s21(scan.frequencies(points))
+    text = ''.join('{:.9f} {:.9f}\r\n'.format(x.real, x.imag) for x in s)
+    return lambda: parse_complex(text)
+
+
+@benchmark('nanovna.parse_frequencies')
+def _parseFrequencies(points, folder):
+    from devices.nanovna.nanovna import parse_frequencies
+    text = ''.join('{:d}\r\n'.format(int(f)) for f in _scan().frequencies(points))
+    return lambda: parse_frequencies(text)
+
+
+@benchmark('nanovna.toTrData')
+def _toTrData(points, folder):
+    from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+    scan = _scan()
+    frequency = scan.frequencies(points)
+    s = scan.s21(frequency)
+    return lambda: nanoVnaWrapper._toTrData(frequency, s)
+
+
+@benchmark('nanovna.averaging')
+def _averaging(points, folder):
+    from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+    scan = _scan()
+    frequency = scan.frequencies(points)
+    # a wrapper without a device, each sweep is a new noisy synthetic scan
+    vna = nanoVnaWrapper.__new__(nanoVnaWrapper)
+    vna._getTrData = lambda: scan.scan(frequency)
+    return lambda: vna.getTrData(averaging=8)
+
+
+def _method(method, points):
+    # the grid over fs and fp has a step of several bandwidths below 10k points, where the methods return degenerate
+    # results. The span is narrowed to keep ten points within the bandwidth, a grid too short for fp is centered on fs.
+    scan = _scan()
+    bandwidth = (scan.R1 + 2 * scan.Rl) / (2 * np.pi * scan.L1)
+    span = (points - 1) * bandwidth / 10
+    frequency = None
+    if span < 1.5 * (scan.fp - scan.fs):
+        frequency = np.linspace(scan.fs - span / 2, scan.fs + span / 2, points)
+    data = scan.dataframe(frequency, points=points)
+    test = method()
+
+    def run():
+        test.updateData(data=data)
+        return test.calcParameters()
+
+    # only a result close to the model is worth timing
+    error = run()
+    results = test.getResults()
+    if error or abs(results.fs - scan.fs) > bandwidth or abs(results.R1 / scan.R1 - 1) > 0.05 \
+            or abs(results.Q * bandwidth / scan.fs - 1) > 0.2:
+        raise ValueError('{} on {} points: fs={}, R1={}, Q={} instead of fs={}, R1={}, Q={}'.format(
+            method.__name__, points, results.fs, results.R1, results.Q, scan.fs, scan.R1, scan.fs / bandwidth))
+    return run
+
+
+@benchmark('PhaseShiftMethod.calcParameters')
+def _phaseShift(points, folder):
+    from methods.phaseshift_method import PhaseShiftMethod
+    return _method(PhaseShiftMethod, points)
+
+
+@benchmark('ThreedbMethod.calcParameters')
+def _threedb(points, folder):
+    from methods.threedb_method import ThreedbMethod
+    return _method(ThreedbMethod, points)
+
+
+@benchmark('plot_spectrum')
+def _plot(points, folder):
+    # the curves of the main window, rendered offscreen
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import pyqtgraph as pg
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    widget = pg.PlotWidget()
+    widget.resize(800, 500)
+    plot_item = widget.getPlotItem()
+    plot_item.setClipToView(True)
+    plot_item.setDownsampling(auto=True, mode='peak')
+    power_curve = widget.plot(pen=pg.mkPen(color=(200, 0, 0), width=2))
+    phase_curve = widget.plot(pen=pg.mkPen(color=(0, 0, 200), width=2))
+    frequency, tr_loss, phase = _scan().scan(points=points)
+
+    def run():
+        power_curve.setData(frequency, tr_loss)
+        phase_curve.setData(frequency, phase)
+        widget.grab()
+        app.processEvents()
+    return run
+
+
+def timeit(function, repeat=5, min_time=0.05):
+    """
+    :param repeat: number of timed batches
+    :param min_time: minimal duration of a batch [s], the number of calls per batch is chosen to reach it
+    :return: dict with the minimum and median time per call [s] and the number of calls per batch
+    """
+    # the first call pays for imports and caches, the calibration batches are not timed either
+    function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1e6:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': statistics.median(times), 'number': number}
+
+
+def run(points=POINTS, select=None, repeat=5, min_time=0.05, output=None):
+    """
+    Run the benchmarks
+    :param select: run only benchmarks containing one of these strings in their name
+    :return: dict with the environment, the results and the errors of the failed benchmarks, as written to the output
+             file
+    """
+    report = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'results': {},
+              'failed': {}}
+    print('{:<45} {:>15} {:>15}'.format('benchmark', 'min', 'median'))
+    with tempfile.TemporaryDirectory() as folder:
+        for name, setup in BENCHMARKS:
+            if select and not any(s in name for s in select):
+                continue
+            for n in points:
+                key = '{}[{}]'.format(name, n)
+                try:
+                    result = timeit(setup(n, folder), repeat=repeat, min_time=min_time)
+                except ImportError as e:
+                    print('{:<45} skipped: {}'.format(key, e), file=sys.stderr)
+                    continue
+                except Exception as e:
+                    # e.g. a method returning wrong results, the other benchmarks still run
+                    report['failed'][key] = '{}: {}'.format(type(e).__name__, e)
+                    print('{:<45} failed: {}'.format(key, e), file=sys.stderr)
+                    continue
+                report['results'][key] = result
+                print('{:<45} {:>12.3f} ms {:>12.3f} ms'.format(key, result['min'] * 1e3, result['median'] * 1e3))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Compare the minimum times of two runs
+    :param baseline, current: reports returned by run() or read from its output files
+    :param threshold: relative slowdown flagged as regression
+    :return: list of the keys of the regressions, failed benchmarks included
+    """
+    regressions = []
+    print('{:<45} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for key, error in current.get('failed', {}).items():
+        print('{:<45} FAILED: {}'.format(key, error))
+        regressions.append(key)
+    for key, result in current['results'].items():
+        if key not in baseline['results']:
+            print('{:<45} {:>12} {:>9.3f} ms'.format(key, '-', result['min'] * 1e3))
+            continue
+        before = baseline['results'][key]['min']
+        ratio = result['min'] / before
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print('{:<45} {:>9.3f} ms {:>9.3f} ms {:>7.2f}x{}'.format(key, before * 1e3, result['min'] * 1e3, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='AMCP benchmark suite')
+    commands = p.add_subparsers(dest='command')
+    commands.required = True
+
+    cmd = commands.add_parser('run', help='run the benchmarks')
+    cmd.add_argument('-o', '--output', default=None, help='json file the results are written to')
+    cmd.add_argument('--points', type=int, nargs='+', default=list(POINTS), help='scan sizes')
+    cmd.add_argument('--select', nargs='+', default=None, help='run only benchmarks containing one of these names')
+    cmd.add_argument('--repeat', type=int, default=5, help='number of timed batches')
+    cmd.add_argument('--min-time', type=float, default=0.05, help='minimal duration of a batch [s]')
+    cmd.add_argument('--compare', default=None, metavar='BASELINE', help='compare against a stored run')
+    cmd.add_argument('--threshold', type=float, default=0.2, help='relative slowdown flagged as regression')
+
+    cmd = commands.add_parser('compare', help='compare two stored runs')
+    cmd.add_argument('baseline', help='json file of the baseline run')
+    cmd.add_argument('current', help='json file of the current run')
+    cmd.add_argument('--threshold', type=float, default=0.2, help='relative slowdown flagged as regression')
+
+    args = p.parse_args(argv)
+    if args.command == 'run':
+        current = run(points=args.points, select=args.select, repeat=args.repeat, min_time=args.min_time,
+                      output=args.output)
+        if not args.compare:
+            if current['failed']:
+                print('{} failed: {}'.format(len(current['failed']), ', '.join(current['failed'])), file=sys.stderr)
+                return 1
+            return 0
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, threshold=args.threshold)
+    if regressions:
+        print('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
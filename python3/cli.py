@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Command Line Interface
+
+Headless entry point for automated benches and re-analysis jobs:
+
+>> python cli.py measure --fstart 25.96e6 --fstop 25.98e6 --method 3db -o scan.csv
+>> python cli.py measure --fstart 25.96e6 --fstop 25.98e6 --method 3db --replay session.bin --replay-speed 0
+>> python cli.py analyze --method phaseshift scan1.csv scan2.csv
+>> python cli.py batch --fstart 25.96e6 --fstop 25.98e6 --count 10 -o results.csv
+>> python cli.py reanalyze scans/ -o reanalysis --method 3db --workers 8
+>> python cli.py cluster submit /mnt/job /mnt/scans --method 3db && python cli.py cluster work /mnt/job
+>> python cli.py export reanalysis/results.bin --format spectre -o lot42.scs
+>> python cli.py synth --points 20001 --noise 1e-4 -o synthetic.csv
+>> python cli.py importtime
+
+Qt and pyqtgraph are never imported. numpy, pandas, serial and the device drivers are only imported by the commands
+needing them, so the interface starts without loading any of them.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import argparse
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+METHODS = {'phaseshift': 'Phase-Shift Method',
+           '3db': '-3dB Method'}
+
+RESULTS = ('C0', 'C1', 'L1', 'R1', 'Q', 'fs', 'fp', 'ESR')
+
+# modules which must not be loaded by starting the command line interface
+HEAVY_MODULES = ('PyQt5', 'pyqtgraph', 'pandas', 'serial', 'matplotlib', 'numpy')
+
+
+def _analyse(data, args):
+    from methods.analysis import analyse
+    return analyse(data, METHODS[args.method], r_setup=args.r_setup, cl=args.cl)
+
+
+def _format(results):
+    return ' '.join('{}={:.6g}'.format(name, value) for name, value in zip(RESULTS, results))
+
+
+def _open_vna(args):
+    if args.vna == 'minivna':
+        from devices.minivna_tiny.vnaj_wrapper import vnajWrapper
+        return vnajWrapper(java_loc=args.java, vnaJ_loc=args.vnaj, home=args.vnaj_home, export_loc=args.export_loc,
+                           PORT=args.port, cal_file=args.cal_file)
+    from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+    return nanoVnaWrapper(dev=args.port, pipeline=args.pipeline, record=args.record, replay=args.replay,
+                          replay_speed=args.replay_speed or None)
+
+
+def measure(args):
+    if args.output and args.output.lower().endswith('.s1p'):
+        # the measurement is a transmission sweep, there is no S11 for a one-port file
+        print('error: the measured data can only be written to a .s2p or a csv file', file=sys.stderr)
+        return 2
+    vna = _open_vna(args)
+    options = {}
+    if args.vna == 'nanovna':
+        options['points'] = args.points
+        if args.stop_early:
+            from methods.online_estimator import OnlineResonanceEstimator
+
+            def provisional(fs, fp, Q):
+                logger.info('provisional fs = {}, fp = {}, Q = {}'.format(fs, fp, Q))
+            options['estimator'] = OnlineResonanceEstimator(callback=provisional)
+    try:
+        data = vna.measure(args.fstart, args.fstop, averaging=args.averaging, **options)
+    finally:
+        if hasattr(vna, 'close'):
+            vna.close()
+
+    if args.output:
+        if args.output.lower().endswith('.s2p'):
+            import support.data_management as dm
+            saver = dm.DataManagement()
+            saver.data = data
+            if saver.saveData(args.output):
+                raise IOError('could not write {}'.format(args.output))
+        else:
+            data.to_csv(args.output, index=False)
+        logger.info('data written to {}'.format(args.output))
+    if args.method:
+        print(_format(_analyse(data, args)))
+    return 0
+
+
+def analyze(args):
+    import support.data_management as dm
+
+    failed = 0
+    for file in args.files:
+        loader = dm.DataManagement()
+        e = loader.loadData(file=file)
+        try:
+            if e:
+                raise IOError(e)
+            print('{}: {}'.format(file, _format(_analyse(loader.data, args))))
+        except Exception as e:
+            print('{}: error: {}'.format(file, e), file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+def batch(args):
+    import csv
+    from devices.device_pool import DevicePool
+
+    pool = DevicePool(minivna_ports=args.minivna, nanovna=not args.no_nanovna,
+                      vnaj_options={'java_loc': args.java, 'vnaJ_loc': args.vnaj, 'home': args.vnaj_home,
+                                    'export_loc': args.export_loc, 'cal_file': args.cal_file})
+    devices = pool.discover()
+    if not devices:
+        print('error: no VNA found', file=sys.stderr)
+        return 1
+    logger.info('measuring on {}'.format(', '.join(devices)))
+
+    failed = 0
+    outfile = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(outfile)
+        writer.writerow(('device', 'n', 'error') + RESULTS)
+        for name, n, data, results, e in pool.measure(args.fstart, args.fstop, averaging=args.averaging,
+                                                      count=args.count, analyze=lambda d: _analyse(d, args)):
+            if e:
+                failed += 1
+                writer.writerow((name, n, e) + ('',) * len(RESULTS))
+            else:
+                writer.writerow((name, n, '') + tuple(results))
+            outfile.flush()
+    finally:
+        if args.output:
+            outfile.close()
+    return 1 if failed else 0
+
+
+def reanalyze(args):
+    """
+    Re-analysis of archived scans with a process pool, see support/reanalysis.py
+    """
+    from support.reanalysis import Reanalysis
+
+    job = Reanalysis(args.sources, args.output, METHODS[args.method], r_setup=args.r_setup, cl=args.cl,
+                     workers=args.workers, shard=args.shard)
+
+    def progress(done, total):
+        logger.info('{} of {} scans analysed'.format(done, total))
+
+    stats = job.run(resume=not args.restart, progress=progress)
+    print('{analysed} scans analysed ({failed} failed, {skipped} skipped) in {time:.1f} s, '
+          '{throughput:.1f} scans/s'.format(**stats))
+    return 1 if stats['failed'] else 0
+
+
+def cluster(args):
+    """
+    Re-analysis by workers on several machines sharing a job folder, see support/distributed.py
+    """
+    from support import distributed
+
+    if args.action == 'submit':
+        if args.retry_failed:
+            queue = distributed.openQueue(args.root)
+            logger.info('{} failed tasks returned to the queue'.format(queue.retryFailed()))
+            queue.close()
+        if args.sources:
+            distributed.submit(args.root, args.sources, METHODS.get(args.method), r_setup=args.r_setup, cl=args.cl,
+                               shard=args.shard, lease=args.lease, retries=args.retries)
+    elif args.action == 'work':
+        worker = distributed.Worker(args.root, workers=args.workers, lease=args.lease, poll=args.poll)
+
+        def progress(counts):
+            logger.info('{done} done, {leased} leased, {pending} pending, {failed} failed'.format(**counts))
+
+        try:
+            stats = worker.run(progress=progress)
+        finally:
+            worker.close()
+        print('{tasks} tasks with {scans} scans analysed in {time:.1f} s, {throughput:.1f} scans/s'.format(**stats))
+        return 0
+    elif args.action == 'merge':
+        index = distributed.merge(args.root)
+        print('{} results merged, {}'.format(index['results'], ', '.join(
+            '{} {}'.format(n, status) for status, n in sorted(index['status'].items()))))
+        if index['missing']:
+            logger.warning('shards of tasks {} are missing'.format(index['missing']))
+            return 1
+
+    queue = distributed.openQueue(args.root)
+    counts = queue.counts()
+    for task_id, _, _, owner, attempts, error in queue.tasks('failed'):
+        print('task {} failed after {} attempts on {}: {}'.format(task_id, attempts, owner or '-', error))
+    queue.close()
+    print('tasks: {done} done, {leased} leased, {pending} pending, {failed} failed'.format(**counts))
+    return 1 if counts['failed'] else 0
+
+
+def export(args):
+    """
+    SPICE or Spectre library of archived results, see support/model_export.py
+    """
+    from support.model_export import exportLibrary
+
+    status = None if args.all else ('passed',)
+    count = exportLibrary(args.results, args.output, model=args.format, status=status)
+    print('{} models written to {}'.format(count, args.output))
+    return 0
+
+
+def synth(args):
+    """
+    Synthetic scan of a crystal, see support/synthetic.py
+    """
+    import numpy as np
+    from support.synthetic import ScanGenerator
+
+    scan = ScanGenerator(C0=args.C0, C1=args.C1, L1=args.L1, R1=args.R1, Rl=args.r_setup, noise=args.noise,
+                         seed=args.seed)
+    frequency = None
+    if args.fstart is not None and args.fstop is not None:
+        frequency = np.linspace(args.fstart, args.fstop, args.points)
+    if args.output.endswith('.npz'):
+        scan.writeBinary(args.output, frequency, points=args.points)
+    elif args.output.lower().endswith('.s2p'):
+        scan.writeTouchstone(args.output, frequency, points=args.points)
+    else:
+        scan.writeCsv(args.output, frequency, points=args.points)
+    logger.info('fs={:.6g} fp={:.6g} written to {}'.format(scan.fs, scan.fp, args.output))
+    return 0
+
+
+def importtime(args):
+    """
+    Import time of the command line interface and of the modules used by its commands, each measured in a fresh
+    interpreter
+    """
+    import subprocess
+    import time
+
+    def cold(code):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=HERE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        wall = time.perf_counter() - start
+        cumulative = {}
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+                _, total, name = line[len('import time:'):].split('|')
+                cumulative[name.strip()] = int(total)
+        return wall, cumulative, result.stdout
+
+    wall, cumulative, loaded = cold('import sys, cli; cli.parser(); '
+                                    'print(" ".join(m for m in cli.HEAVY_MODULES if m in sys.modules))')
+    print('{:<40} {:>10} {:>10}'.format('module', 'import', 'wall'))
+    print('{:<40} {:>7.1f} ms {:>7.1f} ms'.format('cli', cumulative.get('cli', 0) / 1e3, wall * 1e3))
+    for module in args.modules:
+        wall, cumulative, _ = cold('import {}'.format(module))
+        print('{:<40} {:>7.1f} ms {:>7.1f} ms'.format(module, cumulative.get(module, 0) / 1e3, wall * 1e3))
+
+    loaded = loaded.split()
+    if loaded:
+        print('error: starting the cli loads {}'.format(', '.join(loaded)), file=sys.stderr)
+        return 1
+    return 0
+
+
+def _add_method(parser, required=True):
+    parser.add_argument('--method', choices=sorted(METHODS), required=required, default=None,
+                        help='calculation method')
+    parser.add_argument('--r-setup', type=float, default=12.5, help='source and load resistance of the fixture [Ohm]')
+    parser.add_argument('--cl', type=float, default=0, help='external load capacitance [pF]')
+
+
+def _add_sweep(parser):
+    parser.add_argument('--fstart', type=float, required=True, help='start frequency [Hz]')
+    parser.add_argument('--fstop', type=float, required=True, help='stop frequency [Hz]')
+    parser.add_argument('--averaging', type=int, default=1, help='number of averaged sweeps')
+    parser.add_argument('--java', default='../oracle_java/jre1.8.0_221/bin/java', help='java executable for vnaJ')
+    parser.add_argument('--vnaj', default='../vnaJ/vnaJ-hl.3.3.3.jar', help='vnaJ-hl jar')
+    parser.add_argument('--vnaj-home', default='../vnaJ', help='vnaJ home directory')
+    parser.add_argument('--export-loc', default='../vnaJ/export', help='vnaJ export directory')
+    parser.add_argument('--cal-file', default='../vnaJ/vnaJ.3.3/calibration/TRAN_miniVNA_26M.cal',
+                        help='vnaJ calibration file')
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='amcp', description='Automated Crystal Parameter Measurement')
+    p.add_argument('-v', '--verbose', action='store_true', help='debug output')
+    p.add_argument('--timing', default=None, metavar='FILE',
+                   help='time the stages and write them to FILE (json, Prometheus text format for .prom)')
+    commands = p.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('measure', help='measure one crystal')
+    _add_sweep(cmd)
+    cmd.add_argument('--vna', choices=('nanovna', 'minivna'), default='nanovna', help='VNA type')
+    cmd.add_argument('--port', default=None, help='serial port of the VNA, first nanoVNA found if not given')
+    cmd.add_argument('--points', type=int, default=101,
+                     help='points of a single nanoVNA sweep, scanned in segments of 101, averaged sweeps have 101')
+    cmd.add_argument('--stop-early', action='store_true',
+                     help='log provisional fs, fp and Q after every segment of a single nanoVNA sweep and stop it '
+                          'once the resonances are bracketed')
+    cmd.add_argument('-o', '--output', default=None,
+                     help='csv file the measured data is written to, Touchstone file if ending in .s2p, holding '
+                          'S21 and S12 = S21, S11 and S22 are not measured and written as 0')
+    cmd.add_argument('--pipeline', action='store_true',
+                     help='queue the commands of the next segment while the current one is read, not with --record '
+                          'or --replay')
+    cmd.add_argument('--record', default=None, metavar='FILE', help='log the serial session of the nanoVNA to FILE')
+    cmd.add_argument('--replay', default=None, metavar='FILE',
+                     help='replay a recorded serial session instead of a nanoVNA')
+    cmd.add_argument('--replay-speed', type=float, default=1.0,
+                     help='factor on the recorded timing, 0 replays without waiting')
+    _add_method(cmd, required=False)
+    cmd.set_defaults(function=measure)
+
+    cmd = commands.add_parser('analyze', help='calculate the crystal parameters of measured data')
+    cmd.add_argument('files', nargs='+', help='csv or Touchstone files of measured data')
+    _add_method(cmd)
+    cmd.set_defaults(function=analyze)
+
+    cmd = commands.add_parser('batch', help='repeated measurements on all attached VNAs')
+    _add_sweep(cmd)
+    cmd.add_argument('--count', type=int, default=1, help='number of measurements per VNA')
+    cmd.add_argument('--minivna', action='append', default=[], metavar='PORT', help='serial port of a miniVNA')
+    cmd.add_argument('--no-nanovna', action='store_true', help='do not use the attached nanoVNAs')
+    cmd.add_argument('-o', '--output', default=None, help='csv file the results are written to')
+    _add_method(cmd)
+    cmd.set_defaults(function=batch)
+
+    cmd = commands.add_parser('reanalyze', help='analyse archived scans again with a process pool')
+    cmd.add_argument('sources', nargs='+', help='scan files (csv, npz) or folders searched recursively')
+    cmd.add_argument('-o', '--output', required=True, help='folder the results and the checkpoint are written to')
+    cmd.add_argument('--workers', type=int, default=None, help='number of processes, one per core by default')
+    cmd.add_argument('--shard', type=int, default=32, help='number of scans per task')
+    cmd.add_argument('--restart', action='store_true', help='ignore the checkpoint of a previous run')
+    _add_method(cmd)
+    cmd.set_defaults(function=reanalyze)
+
+    cmd = commands.add_parser('cluster', help='analyse archived scans on several machines sharing a job folder')
+    actions = cmd.add_subparsers(dest='action', metavar='action')
+    actions.required = True
+    action = actions.add_parser('submit', help='create a job or add scans to it')
+    action.add_argument('root', help='job folder shared by all machines')
+    action.add_argument('sources', nargs='*', help='scan files (csv, npz) or folders searched recursively')
+    action.add_argument('--shard', type=int, default=32, help='number of scans per task')
+    action.add_argument('--lease', type=float, default=300.0, help='time a task stays leased without renewal [s]')
+    action.add_argument('--retries', type=int, default=3, help='number of attempts before a task is failed')
+    action.add_argument('--retry-failed', action='store_true', help='return the failed tasks to the queue')
+    action.add_argument('--method', choices=sorted(METHODS), default=None, help='calculation method of a new job')
+    action.add_argument('--r-setup', type=float, default=None,
+                        help='source and load resistance of the fixture [Ohm], 12.5 for a new job')
+    action.add_argument('--cl', type=float, default=None, help='external load capacitance [pF], 0 for a new job')
+    action = actions.add_parser('work', help='work on the tasks of a job until all are done')
+    action.add_argument('root', help='job folder shared by all machines')
+    action.add_argument('--workers', type=int, default=None, help='number of processes, one per core by default')
+    action.add_argument('--lease', type=float, default=None, help='lease time overriding the job [s]')
+    action.add_argument('--poll', type=float, default=5.0, help='time between two looks for tasks of other workers [s]')
+    action = actions.add_parser('merge', help='merge the results of the done tasks')
+    action.add_argument('root', help='job folder shared by all machines')
+    action = actions.add_parser('status', help='show the tasks of a job')
+    action.add_argument('root', help='job folder shared by all machines')
+    cmd.set_defaults(function=cluster)
+
+    cmd = commands.add_parser('export', help='write the models of archived results to a SPICE or Spectre library')
+    cmd.add_argument('results', nargs='+', help='results files (results.bin of an archive or a re-analysis)')
+    cmd.add_argument('-o', '--output', required=True, help='library file')
+    cmd.add_argument('--format', choices=('spice', 'spectre'), default='spice', help='simulator of the library')
+    cmd.add_argument('--all', action='store_true', help='export the failed parts too, only the passed by default')
+    cmd.set_defaults(function=export)
+
+    cmd = commands.add_parser('synth', help='write a synthetic scan of a crystal')
+    cmd.add_argument('--C0', type=float, default=550e-15, help='package capacitance [F]')
+    cmd.add_argument('--C1', type=float, default=1.52e-15, help='motional capacitance [F]')
+    cmd.add_argument('--L1', type=float, default=24.71e-3, help='motional inductance [H]')
+    cmd.add_argument('--R1', type=float, default=20.0, help='motional resistance [Ohm]')
+    cmd.add_argument('--r-setup', type=float, default=12.5, help='source and load resistance of the fixture [Ohm]')
+    cmd.add_argument('--noise', type=float, default=0.0, help='standard deviation of the noise on S21')
+    cmd.add_argument('--seed', type=int, default=None, help='seed of the noise')
+    cmd.add_argument('--fstart', type=float, default=None, help='start frequency [Hz], around fs and fp if not given')
+    cmd.add_argument('--fstop', type=float, default=None, help='stop frequency [Hz]')
+    cmd.add_argument('--points', type=int, default=1001, help='number of points')
+    cmd.add_argument('-o', '--output', required=True, help='vnaJ csv file, binary scan file if ending in .npz, Touchstone file if ending in .s2p')
+    cmd.set_defaults(function=synth)
+
+    cmd = commands.add_parser('importtime', help='measure the start up time')
+    cmd.add_argument('modules', nargs='*', default=['support.data_management', 'methods.analysis',
+                                                     'devices.nanovna.nanovna_wrapper', 'pandas'],
+                     help='further modules to measure')
+    cmd.set_defaults(function=importtime)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    if not args.timing:
+        return args.function(args)
+
+    from support import timing
+    timing.enable()
+    try:
+        return args.function(args)
+    finally:
+        timing.export(args.timing)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Device Pool
+
+The device pool collects all VNAs attached to the host (every nanoVNA found by VID/PID and every configured miniVNA
+port) and runs independent measurements on each of them in a worker thread of its own. The results of all instruments
+are merged into one stream in the order they complete.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class DevicePool:
+    """
+    Pool of measurement devices, each device is run by its own worker.
+    """
+
+    def __init__(self, minivna_ports=(), nanovna=True, vnaj_options=None):
+        """
+        :param minivna_ports: serial ports of the miniVNAs to use
+        :param nanovna: use all attached nanoVNAs
+        :param vnaj_options: keyword arguments passed to vnajWrapper (java_loc, vnaJ_loc, cal_file, ...)
+        """
+        self.minivna_ports = list(minivna_ports)
+        self.nanovna = nanovna
+        self.vnaj_options = vnaj_options or {}
+        self.devices = {}
+        self.types = {}             # device name: 'NanoVNA' or 'MiniVNA'
+
+    def discover(self):
+        """
+        Enumerate and connect all devices
+        :return: list of device names
+        """
+        if self.nanovna:
+            from devices.nanovna.nanovna import getports
+            from devices.nanovna.nanovna_wrapper import nanoVnaWrapper
+            for port in getports():
+                if port not in self.devices:
+                    self.devices[port] = nanoVnaWrapper(dev=port)
+                    self.types[port] = 'NanoVNA'
+                    logger.info('added nanoVNA at {}'.format(port))
+
+        if self.minivna_ports:
+            from devices.minivna_tiny.vnaj_wrapper import vnajWrapper
+            for port in self.minivna_ports:
+                if port not in self.devices:
+                    # every instrument exports into a file of its own
+                    self.devices[port] = vnajWrapper(PORT=port, data='scan_data_{}'.format(port.split('/')[-1]),
+                                                     **self.vnaj_options)
+                    self.types[port] = 'MiniVNA'
+                    logger.info('added miniVNA at {}'.format(port))
+
+        return list(self.devices)
+
+    def _worker(self, name, device, jobs, results, fstart, fstop, averaging, analyze, stop):
+        for n in range(jobs):
+            if stop.is_set():
+                break
+            try:
+                data = device.measure(fstart, fstop, averaging=averaging)
+                results.put((name, n, data, analyze(data) if analyze else None, None))
+            except Exception as e:
+                logger.debug('measurement on {} failed: {}'.format(name, e))
+                results.put((name, n, None, None, e))
+        results.put(_DONE)
+
+    def measure(self, fstart, fstop, averaging=1, count=1, analyze=None):
+        """
+        Run measurements on all devices in parallel. This is a generator yielding the results as they come in.
+        :param count: number of measurements per device
+        :param analyze: optional function run in the worker on the measured data, e.g. a method calculation
+        :return: generator of (device name, measurement number, data, analysis result, exception or None)
+        """
+        if not self.devices:
+            self.discover()
+
+        results = queue.Queue()
+        stop = threading.Event()
+        workers = [threading.Thread(target=self._worker, name='vna-{}'.format(name),
+                                    args=(name, device, count, results, fstart, fstop, averaging, analyze, stop),
+                                    daemon=True)
+                   for name, device in self.devices.items()]
+        for worker in workers:
+            worker.start()
+
+        running = len(workers)
+        try:
+            while running:
+                item = results.get()
+                if item is _DONE:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            # stops the workers after their current measurement if the consumer quits early
+            stop.set()
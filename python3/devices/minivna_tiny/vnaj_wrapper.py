@@ -21,6 +21,8 @@ __version__ = "0.1"
 
 import logging
 import subprocess
+import support.data_management as dm
+from support import timing
 
 logger = logging.getLogger(__name__)
 
@@ -53,15 +55,16 @@ class vnajWrapper():
         self.data = data
         self.calibration = cal_file
 
+    @timing.timed('vnaj.run')
     def run_vnaJ(self, lang='en', region='US', fstart=None, fstop=None, average=1, scanmode='TRAN',
-                 exports='csv'):
+                 exports='csv', steps=None, cancel=None):
 
         # run vnaJ-hl using the setup previously done
         try:
             cmd = [self.java_loc,
                    '-Dfstart={}'.format(fstart),
                    '-Dfstop={}'.format(fstop),
-                   '-Dfsteps={}'.format(self.steps),
+                   '-Dfsteps={}'.format(steps or self.steps),
                    '-Dcalfile={}'.format(self.calibration),
                    '-DdriverPort={}'.format(self.PORT),
                    '-Daverage={}'.format(average),
@@ -76,7 +79,10 @@ class vnajWrapper():
                    '-jar', self.vnaj_loc]
 
             logging.info('running measurements ... {}'.format(cmd))
-            tmp = subprocess.check_output(cmd)
+            if cancel is None:
+                tmp = subprocess.check_output(cmd)
+            else:
+                tmp = self._run_cancellable(cmd, cancel)
             logging.info('measurements successful')
             logging.debug(tmp)
             return 0
@@ -84,6 +90,37 @@ class vnajWrapper():
             logging.debug('Could not run vnaj-hl! error: {}'.format(e))
             return e
 
+    @staticmethod
+    def _run_cancellable(cmd, cancel):
+        # same as subprocess.check_output, but vnaJ-hl is killed as soon as the cancel event is set
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        while True:
+            try:
+                out, _ = process.communicate(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel.is_set():
+                    process.kill()
+                    process.communicate()
+                    raise InterruptedError('measurement cancelled')
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd, output=out)
+        return out
+
+    def measure(self, fstart, fstop, averaging=1):
+        """
+        Run a complete measurement and load the exported data
+        :return: pandas dataframe
+        """
+        e = self.run_vnaJ(fstart=int(fstart), fstop=int(fstop), average=averaging, exports='csv')
+        if e:
+            raise e
+        data = dm.DataManagement()
+        e = data.loadData(file='{}/{}.csv'.format(self.export_loc, self.data))
+        if e:
+            raise IOError(e)
+        return data.data
+
 
 if __name__ == "__main__":
     import logging
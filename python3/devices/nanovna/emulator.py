@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - nanoVNA emulator
+
+Emulation of the nanoVNA firmware shell on a pseudo-terminal, for testing and profiling without hardware (posix
+only). The emulator answers sweep, scan, data, frequencies, pause, resume, info and version like the firmware, echoes
+the commands and ends every reply with the "ch> " prompt. The measured data is the S11/S21 of a crystal in the test
+fixture calculated by support/synthetic.py.
+
+The timing follows a profile: the time per sweep point, the latency of every reply and the baud rate limiting the
+transfer of the replies. A changed sweep range only shows up in the data after one sweep, like on the device.
+
+>> python -m devices.nanovna.emulator --profile nanovna
+>> python cli.py measure --port /dev/pts/3 --fstart 25.96e6 --fstop 25.98e6 --method 3db
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import os
+import select
+import threading
+import time
+import numpy as np
+from support.synthetic import ScanGenerator
+
+logger = logging.getLogger(__name__)
+
+POINTS = 101        # sweep points of the firmware
+
+# point_time: sweep time per point [s], latency: delay of every reply [s], baud: transfer rate of the replies, None for
+# USB full speed without limit
+PROFILES = {'instant': {'point_time': 0.0, 'latency': 0.0, 'baud': None},
+            'nanovna': {'point_time': 2.5e-3, 'latency': 1e-3, 'baud': None},
+            'serial': {'point_time': 2.5e-3, 'latency': 16e-3, 'baud': 115200}}
+
+
+class NanoVNAEmulator:
+    """
+    nanoVNA on a pseudo-terminal, connect to NanoVNAEmulator.dev like to a real device
+    """
+
+    def __init__(self, generator=None, profile='nanovna', **timing):
+        """
+        :param generator: ScanGenerator of the crystal, the ideal model with a little noise if None
+        :param profile: name of the timing profile in PROFILES
+        :param timing: point_time, latency or baud overriding the profile
+        """
+        self.generator = generator or ScanGenerator(noise=1e-4)
+        self.timing = dict(PROFILES[profile], **timing)
+        self.dev = None
+        self.commands = 0           # number of commands served
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._frequencies = np.linspace(50e3, 900e6, POINTS)
+        self._ready = 0.0           # time the first sweep of the current range is complete
+        self._paused = False
+        self._data = None           # (s11, s21) of the last scan while paused
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        :return: path of the pseudo-terminal
+        """
+        import tty
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.dev = os.ttyname(self._slave)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='nanovna-emulator', daemon=True)
+        self._thread.start()
+        logger.info('nanoVNA emulator at {} ({})'.format(self.dev, self.timing))
+        return self.dev
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def _serve(self):
+        self._write('ch> ')
+        buffer = b''
+        while not self._stop.is_set():
+            if not select.select([self._master], [], [], 0.1)[0]:
+                continue
+            try:
+                buffer += os.read(self._master, 1024)
+            except OSError:
+                break
+            while b'\r' in buffer:
+                line, _, buffer = buffer.partition(b'\r')
+                line = line.strip(b'\n').decode('ascii', 'replace')
+                reply = self.execute(line)
+                self.commands += 1
+                if self.timing['latency']:
+                    time.sleep(self.timing['latency'])
+                self._write('{}\r\n{}ch> '.format(line, reply))
+
+    def _write(self, text):
+        data = text.encode()
+        baud = self.timing['baud']
+        if not baud:
+            os.write(self._master, data)
+            return
+        # 10 bits per byte, written in chunks to keep the rate steady
+        chunk = max(1, baud // 1000)
+        for i in range(0, len(data), chunk):
+            start = time.perf_counter()
+            os.write(self._master, data[i:i + chunk])
+            remaining = len(data[i:i + chunk]) * 10 / baud - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _sweepTime(self, points):
+        return points * self.timing['point_time']
+
+    def _setRange(self, start, stop, points=POINTS):
+        self._frequencies = np.linspace(start, stop, points)
+        self._ready = time.perf_counter() + self._sweepTime(points)
+
+    def _measure(self):
+        s21 = self.generator.s21(self._frequencies)
+        # series element between the two ports: S11 = Z / (Z + 2Rl) = 1 - S21
+        return 1 - s21, s21
+
+    def execute(self, line):
+        """
+        Run one command of the firmware shell
+        :return: reply without echo and prompt
+        """
+        args = line.split()
+        if not args:
+            return ''
+        command, args = args[0], args[1:]
+        try:
+            function = getattr(self, '_cmd_' + command)
+        except AttributeError:
+            return '{}?\r\n'.format(command)
+        try:
+            return function(*args)
+        except (TypeError, ValueError):
+            return 'usage: {}\r\n'.format(function.__doc__.strip())
+
+    def _cmd_version(self):
+        """version"""
+        return 'emulator-{}\r\n'.format(__version__)
+
+    def _cmd_info(self):
+        """info"""
+        return 'Board: NanoVNA emulator\r\nCrystal: C0={C0:g} C1={C1:g} L1={L1:g} R1={R1:g}\r\n'.format(
+            **vars(self.generator))
+
+    def _cmd_frequencies(self):
+        """frequencies"""
+        return ''.join('{:d}\r\n'.format(int(f)) for f in self._frequencies)
+
+    def _cmd_sweep(self, *args):
+        """sweep {start(Hz)} [stop(Hz)] | sweep {start|stop|center|span|cw} {freq(Hz)}"""
+        start, stop = self._frequencies[0], self._frequencies[-1]
+        if not args:
+            return '{:d} {:d} {:d}\r\n'.format(int(start), int(stop), len(self._frequencies))
+        if args[0] in ('start', 'stop', 'center', 'span', 'cw'):
+            value = float(args[1])
+            center, span = (start + stop) / 2, stop - start
+            start, stop = {'start': (value, stop),
+                           'stop': (start, value),
+                           'center': (value - span / 2, value + span / 2),
+                           'span': (center - value / 2, center + value / 2),
+                           'cw': (value, value)}[args[0]]
+        else:
+            start = float(args[0])
+            stop = float(args[1]) if len(args) > 1 else stop
+        self._setRange(start, stop)
+        return ''
+
+    def _cmd_scan(self, start, stop, points=POINTS, outmask=0):
+        """scan {start(Hz)} {stop(Hz)} [points] [outmask]"""
+        points, outmask = int(points), int(outmask)
+        if not 0 < points <= POINTS:
+            return 'sweep points exceeds range {}\r\n'.format(POINTS)
+        self._setRange(float(start), float(stop), points)
+        # the scan runs in the foreground and leaves the device paused
+        time.sleep(self._sweepTime(points))
+        self._paused = True
+        self._data = self._measure()
+        if not outmask:
+            return ''
+        lines = []
+        for i, f in enumerate(self._frequencies):
+            values = []
+            if outmask & 1:
+                values.append('{:d}'.format(int(f)))
+            for bit, array in ((2, self._data[0]), (4, self._data[1])):
+                if outmask & bit:
+                    values.append('{:f} {:f}'.format(array[i].real, array[i].imag))
+            lines.append(' '.join(values) + '\r\n')
+        return ''.join(lines)
+
+    def _cmd_data(self, array=0):
+        """data [array]"""
+        array = int(array)
+        if array > 1:
+            return ''.join('0.000000 0.000000\r\n' for _ in self._frequencies)
+        if self._paused and self._data is not None:
+            values = self._data[array]
+        else:
+            # the data of a new sweep range is only complete after one sweep
+            wait = self._ready - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            values = self._measure()[array]
+        return ''.join('{:f} {:f}\r\n'.format(x.real, x.imag) for x in values)
+
+    def _cmd_pause(self):
+        """pause"""
+        if not self._paused:
+            self._data = self._measure()
+        self._paused = True
+        return ''
+
+    def _cmd_resume(self):
+        """resume"""
+        self._paused = False
+        self._ready = time.perf_counter() + self._sweepTime(len(self._frequencies))
+        return ''
+
+    def _accept(self, *args):
+        # settings without effect on the emulated measurement
+        return ''
+
+    _cmd_freq = _cmd_power = _cmd_port = _cmd_gain = _cmd_offset = _cmd_bandwidth = _accept
+
+
+def main(argv=None):
+    import argparse
+    p = argparse.ArgumentParser(description='nanoVNA emulator on a pseudo-terminal')
+    p.add_argument('--profile', choices=sorted(PROFILES), default='nanovna', help='timing profile')
+    p.add_argument('--point-time', type=float, default=None, help='sweep time per point [s]')
+    p.add_argument('--latency', type=float, default=None, help='delay of every reply [s]')
+    p.add_argument('--baud', type=int, default=None, help='transfer rate of the replies')
+    p.add_argument('--noise', type=float, default=1e-4, help='standard deviation of the noise on S21')
+    args = p.parse_args(argv)
+
+    timing = {name: value for name, value in (('point_time', args.point_time), ('latency', args.latency),
+                                              ('baud', args.baud)) if value is not None}
+    with NanoVNAEmulator(ScanGenerator(noise=args.noise), profile=args.profile, **timing) as emulator:
+        print(emulator.dev, flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - nanoVNA link metrics
+
+Counters and latency histograms of the serial link to a nanoVNA per command verb (data, scan, frequencies, dump, ...):
+
+- latency: time from writing a command to its echo. The firmware only echoes a command once the previous one has
+  finished, so the sweep of a scan shows up in the latency of the following command.
+- transfer: time from the echo to the prompt ending the reply, the bytes received in it give the throughput.
+- stalls: gaps of more than stall_time between two bytes of a reply.
+
+The metrics are kept by the NanoVNASession, so they survive a reconnect.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import threading
+from support.timing import Histogram
+
+
+class VerbMetrics:
+    """
+    Metrics of one command verb
+    """
+    __slots__ = ('commands', 'replies', 'sent', 'received', 'latency', 'transfer', 'transfer_bytes', 'stalls',
+                 'longest_stall')
+
+    def __init__(self):
+        self.commands = 0
+        self.replies = 0
+        self.sent = 0               # bytes written
+        self.received = 0           # bytes read, echo and replies
+        self.latency = Histogram()
+        self.transfer = Histogram()
+        self.transfer_bytes = 0     # bytes read during the transfers
+        self.stalls = 0
+        self.longest_stall = 0.0
+
+    @property
+    def throughput(self):
+        """
+        :return: bytes per second of the replies
+        """
+        return self.transfer_bytes / self.transfer.total if self.transfer.total else 0.0
+
+    def toDict(self):
+        return {'commands': self.commands, 'replies': self.replies, 'sent': self.sent, 'received': self.received,
+                'latency': self.latency.toDict(), 'transfer': self.transfer.toDict(), 'throughput': self.throughput,
+                'stalls': self.stalls, 'longest_stall': self.longest_stall}
+
+
+class LinkMetrics:
+    """
+    Metrics of a serial link by verb, thread-safe
+    """
+
+    def __init__(self, stall_time=0.05):
+        """
+        :param stall_time: gap between two bytes of a reply counted as stall [s]
+        """
+        self.stall_time = stall_time
+        self._verbs = {}
+        self._lock = threading.Lock()
+
+    def _verb(self, verb):
+        metrics = self._verbs.get(verb)
+        if metrics is None:
+            metrics = self._verbs[verb] = VerbMetrics()
+        return metrics
+
+    def command(self, verb, sent, received, latency):
+        """
+        A command was written and its echo read
+        """
+        with self._lock:
+            metrics = self._verb(verb)
+            metrics.commands += 1
+            metrics.sent += sent
+            metrics.received += received
+            metrics.latency.add(latency)
+
+    def reply(self, verb, received, duration, longest_gap):
+        """
+        A reply was read up to the prompt
+        :param longest_gap: longest time between two bytes of the reply [s]
+        """
+        with self._lock:
+            metrics = self._verb(verb)
+            metrics.replies += 1
+            metrics.received += received
+            metrics.transfer.add(duration)
+            metrics.transfer_bytes += received
+            if longest_gap > self.stall_time:
+                metrics.stalls += 1
+            metrics.longest_stall = max(metrics.longest_stall, longest_gap)
+
+    def reset(self):
+        with self._lock:
+            self._verbs.clear()
+
+    def verbs(self):
+        """
+        :return: dict of verb: metrics as dict
+        """
+        with self._lock:
+            return {verb: metrics.toDict() for verb, metrics in sorted(self._verbs.items())}
+
+    def summary(self):
+        """
+        :return: list of (verb, commands, sent, received, latency p50 [s], latency p95 [s], throughput [B/s], stalls)
+        """
+        with self._lock:
+            return [(verb, m.commands, m.sent, m.received, m.latency.quantile(0.5), m.latency.quantile(0.95),
+                     m.throughput, m.stalls) for verb, m in sorted(self._verbs.items())]
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import serial
 import numpy as np
-import pylab as pl
 import struct
+import time
 from serial.tools import list_ports
+from support import timing
+from devices.nanovna.link_metrics import LinkMetrics
 
 VID = 0x0483  # 1155
 PID = 0x5740  # 22336
@@ -11,20 +13,45 @@ PID = 0x5740  # 22336
 
 # Get nanovna device automatically
 def getport() -> str:
-    device_list = list_ports.comports()
-    for device in device_list:
-        if device.vid == VID and device.pid == PID:
-            return device.device
+    device_list = getports()
+    if device_list:
+        return device_list[0]
     raise OSError("device not found")
 
 
+# Get all attached nanovna devices
+def getports() -> list:
+    return [device.device for device in list_ports.comports() if device.vid == VID and device.pid == PID]
+
+
 REF_LEVEL = (1 << 9)
 
 
+def parse_complex(text):
+    # reply of "data": one "real imag" pair per line
+    x = np.array(text.split(), dtype=float)
+    return x[0::2] + x[1::2] * 1j
+
+
+def parse_frequencies(text):
+    # reply of "frequencies": one frequency per line
+    return np.array(text.split(), dtype=float)
+
+
 class NanoVNA:
-    def __init__(self, dev=None):
-        self.dev = dev or getport()
+    def __init__(self, dev=None, transport=None, record=None, replay=None, replay_speed=1.0, metrics=None):
+        # record: file the serial session is logged to, replay: recording played back instead of a device,
+        # replay_speed: factor on the recorded timing, None to replay without waiting (see serial_log.py)
+        # metrics: LinkMetrics the serial link is counted in, e.g. one kept across reconnects
+        self.transport = transport  # optional TransportThread from nanovna_async, owning the port
+        self.dev = replay or dev or (transport.dev if transport else getport())
         self.serial = None
+        self.record = record
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.metrics = metrics or LinkMetrics()
+        self._verb = None           # verb of the last command, the reply read by fetch_data() belongs to it
+        self._replies = []          # futures of the commands queued on the transport since the last fetch_data()
         self._frequencies = None
         self.points = 101
 
@@ -37,19 +64,42 @@ class NanoVNA:
             self.points = points
         self._frequencies = np.linspace(start, stop, self.points)
 
+    def is_open(self):
+        if self.transport:
+            return self.transport.is_open
+        return self.serial is not None and self.serial.is_open
+
     def open(self):
+        if self.transport:
+            return
         if self.serial is None:
+            if self.replay:
+                from devices.nanovna.serial_log import SerialReplay
+                self.serial = SerialReplay(self.replay, speed=self.replay_speed)
+                return
             self.serial = serial.Serial(self.dev)
+            if self.record:
+                from devices.nanovna.serial_log import SerialRecorder
+                self.serial = SerialRecorder(self.serial, self.record)
 
     def close(self):
         if self.serial:
             self.serial.close()
         self.serial = None
 
+    @timing.timed('nanovna.send_command')
     def send_command(self, cmd):
+        if self.transport:
+            # queued without waiting, the replies are picked up by fetch_data()
+            self._replies.append(self.transport.submit(cmd))
+            return
         self.open()
-        self.serial.write(cmd.encode())
-        self.serial.readline()  # discard empty line
+        self._verb = cmd.split(' ', 1)[0].strip()
+        start = time.perf_counter()
+        data = cmd.encode()
+        self.serial.write(data)
+        echo = self.serial.readline()  # discard empty line
+        self.metrics.command(self._verb, len(data), len(echo), time.perf_counter() - start)
 
     def set_sweep(self, start, stop):
         if start is not None:
@@ -80,11 +130,24 @@ class NanoVNA:
     def set_filter(self, filter):
         self.filter = filter
 
+    @timing.timed('nanovna.fetch_data')
     def fetch_data(self):
+        if self.transport:
+            # the commands queued before, e.g. by set_sweep(), raise their errors and timeouts here
+            replies, self._replies = self._replies, []
+            return [reply.result() for reply in replies][-1]
         result = ''
         line = ''
+        received = 0
+        start = last = time.perf_counter()
+        gap = 0.0
         while True:
             c = self.serial.read().decode('utf-8')
+            now = time.perf_counter()
+            if received:
+                gap = max(gap, now - last)
+            last = now
+            received += 1
             if c == chr(13):
                 next  # ignore CR
             line += c
@@ -95,6 +158,7 @@ class NanoVNA:
             if line.endswith('ch>'):
                 # stop on prompt
                 break
+        self.metrics.reply(self._verb, received, last - start, gap)
         return result
 
     def fetch_buffer(self, freq=None, buffer=0):
@@ -120,12 +184,7 @@ class NanoVNA:
 
     def fetch_array(self, sel):
         self.send_command("data %d\r" % sel)
-        data = self.fetch_data()
-        x = []
-        for line in data.split('\n'):
-            if line:
-                x.extend([float(d) for d in line.strip().split(' ')])
-        return np.array(x[0::2]) + np.array(x[1::2]) * 1j
+        return parse_complex(self.fetch_data())
 
     def fetch_gamma(self, freq=None):
         if freq:
@@ -164,22 +223,13 @@ class NanoVNA:
 
     def data(self, array=0):
         self.send_command("data %d\r" % array)
-        data = self.fetch_data()
-        x = []
-        for line in data.split('\n'):
-            if line:
-                d = line.strip().split(' ')
-                x.append(float(d[0]) + float(d[1]) * 1.j)
-        return np.array(x)
+        reply = self.fetch_data()
+        with timing.span('nanovna.parse'):
+            return parse_complex(reply)
 
     def fetch_frequencies(self):
         self.send_command("frequencies\r")
-        data = self.fetch_data()
-        x = []
-        for line in data.split('\n'):
-            if line:
-                x.append(float(line))
-        self._frequencies = np.array(x)
+        self._frequencies = parse_frequencies(self.fetch_data())
 
     def send_scan(self, start=1e6, stop=900e6, points=None):
         if points:
@@ -187,7 +237,12 @@ class NanoVNA:
         else:
             self.send_command("scan %d %d\r" % (start, stop))
 
-    def scan(self):
+    def scan(self, callback=None):
+        """
+        Scan self.frequencies in segments of 101 points.
+        :param callback: optional function called with (frequencies, array0, array1) of every segment as soon as it
+                         arrives. If it returns True the remaining segments are skipped.
+        """
         segment_length = 101
         array0 = []
         array1 = []
@@ -200,8 +255,12 @@ class NanoVNA:
             length = segment_length if len(freqs) >= segment_length else len(freqs)
             # print((seg_start, seg_stop, length))
             self.send_scan(seg_start, seg_stop, length)
-            array0.extend(self.data(0))
-            array1.extend(self.data(1))
+            seg0 = self.data(0)
+            seg1 = self.data(1)
+            array0.extend(seg0)
+            array1.extend(seg1)
+            if callback and callback(freqs[:length], seg0, seg1):
+                break
             freqs = freqs[segment_length:]
         self.resume()
         return (array0, array1)
@@ -217,16 +276,19 @@ class NanoVNA:
         return Image.frombuffer('RGBA', (320, 240), arr, 'raw', 'RGBA', 0, 1)
 
     def logmag(self, x):
+        import pylab as pl
         pl.grid(True)
         pl.xlim(self.frequencies[0], self.frequencies[-1])
         pl.plot(self.frequencies, 20 * np.log10(np.abs(x)))
 
     def linmag(self, x):
+        import pylab as pl
         pl.grid(True)
         pl.xlim(self.frequencies[0], self.frequencies[-1])
         pl.plot(self.frequencies, np.abs(x))
 
     def phase(self, x, unwrap=False):
+        import pylab as pl
         pl.grid(True)
         a = np.angle(x)
         if unwrap:
@@ -237,30 +299,35 @@ class NanoVNA:
         pl.plot(self.frequencies, np.rad2deg(a))
 
     def delay(self, x):
+        import pylab as pl
         pl.grid(True)
         delay = -np.unwrap(np.angle(x)) / (2 * np.pi * np.array(self.frequencies))
         pl.xlim(self.frequencies[0], self.frequencies[-1])
         pl.plot(self.frequencies, delay)
 
     def groupdelay(self, x):
+        import pylab as pl
         pl.grid(True)
         gd = np.convolve(np.unwrap(np.angle(x)), [1, -1], mode='same')
         pl.xlim(self.frequencies[0], self.frequencies[-1])
         pl.plot(self.frequencies, gd)
 
     def vswr(self, x):
+        import pylab as pl
         pl.grid(True)
         vswr = (1 + np.abs(x)) / (1 - np.abs(x))
         pl.xlim(self.frequencies[0], self.frequencies[-1])
         pl.plot(self.frequencies, vswr)
 
     def polar(self, x):
+        import pylab as pl
         ax = pl.subplot(111, projection='polar')
         ax.grid(True)
         ax.set_ylim((0, 1))
         ax.plot(np.angle(x), np.abs(x))
 
     def tdr(self, x):
+        import pylab as pl
         pl.grid(True)
         window = np.blackman(len(x))
         NFFT = 256
@@ -273,6 +340,7 @@ class NanoVNA:
         pl.ylabel("magnitude")
 
     def smithd3(self, x):
+        import pylab as pl
         import mpld3
         import twoport as tp
         fig, ax = pl.subplots()
@@ -294,6 +362,7 @@ class NanoVNA:
 
 
 def plot_sample0(samp):
+    import pylab as pl
     N = min(len(samp), 256)
     fs = 48000
     pl.subplot(211)
@@ -306,6 +375,7 @@ def plot_sample0(samp):
 
 
 def plot_sample(ref, samp):
+    import pylab as pl
     N = min(len(samp), 256)
     fs = 48000
     pl.subplot(211)
@@ -320,6 +390,7 @@ def plot_sample(ref, samp):
 
 
 if __name__ == '__main__':
+    import pylab as pl
     from optparse import OptionParser
 
     parser = OptionParser(usage="%prog: [options]")
@@ -412,17 +483,21 @@ if __name__ == '__main__':
     if plot or opt.save:
         p = int(opt.port) if opt.port else 0
         if opt.scan or opt.points > 101:
-            s = nv.scan()
-            s = s[p]
+            arrays = nv.scan()
         else:
             if opt.start or opt.stop:
                 nv.set_sweep(opt.start, opt.stop)
             nv.fetch_frequencies()
-            s = nv.data(p)
+            arrays = nv.data(0), nv.data(1)
             nv.fetch_frequencies()
+        s = arrays[p]
     if opt.save:
-        n = nv.skrf_network(s)
-        n.write_touchstone(opt.save)
+        from support.data_management import writeTouchstone
+        # S11 and S21 in a .s2p file, the data of the port in a .s1p file
+        if opt.save.lower().endswith('.s2p'):
+            writeTouchstone(opt.save, nv.frequencies[:len(arrays[1])], arrays[0], arrays[1])
+        else:
+            writeTouchstone(opt.save, nv.frequencies[:len(s)], s, ports=1)
     if opt.smith:
         nv.smith(s)
     if opt.polar:
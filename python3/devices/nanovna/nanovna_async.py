@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - asyncio transport for the nanoVNA
+
+Commands are written to the device as soon as they are submitted and the replies are framed by the "ch> " prompt of the
+nanoVNA shell. Since the device executes commands strictly in order, several commands can be in flight at the same
+time, e.g. the scan of the next segment is already running while the reply of the previous segment is parsed.
+
+AsyncTransport is used from within a running event loop. TransportThread runs an AsyncTransport in its own event loop
+thread and is used as the thin synchronous wrapper behind NanoVNA(transport=...).
+
+The link is counted in LinkMetrics like the synchronous driver. As the replies are read in chunks and commands queue
+up behind each other, the latency is the time from writing a command to the first chunk of its reply, including the
+time spent waiting for the commands ahead of it.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import numpy as np
+import serial
+from devices.nanovna.link_metrics import LinkMetrics
+from devices.nanovna.nanovna import getport, parse_complex, parse_frequencies
+from support import timing
+
+logger = logging.getLogger(__name__)
+
+PROMPT = b'ch> '
+
+
+class AsyncTransport:
+    """
+    Serial transport with an awaitable, pipelined command queue.
+    """
+
+    def __init__(self, dev=None, timeout=5.0, metrics=None):
+        """
+        :param dev: serial device, found automatically if None
+        :param timeout: default timeout of a command [s]
+        :param metrics: LinkMetrics the link is counted in, e.g. the one of a NanoVNASession
+        """
+        self.dev = dev
+        self.timeout = timeout
+        self.metrics = metrics or LinkMetrics()
+        self.serial = None
+        self._loop = None
+        self._reader = None
+        self._running = False
+        self._writer = None
+        self._buffer = b''
+        self._pending = collections.deque()     # [future, verb, bytes sent, time written] in the order sent
+        self._first = None                      # arrival of the first and last chunk of the current reply
+        self._last = None
+        self._gap = 0.0                         # longest time between two chunks of the current reply
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self._running
+
+    async def open(self):
+        if self.serial is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self.dev = self.dev or getport()
+        # writes are done in a single worker thread so they keep their order without blocking the loop
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.serial = await self._loop.run_in_executor(self._writer, lambda: serial.Serial(self.dev, timeout=0.1))
+        self._running = True
+        self._reader = threading.Thread(target=self._read, name='nanovna-reader', daemon=True)
+        self._reader.start()
+        logger.debug('opened {}'.format(self.dev))
+
+    async def close(self):
+        if self.serial is None:
+            return
+        self._running = False
+        await self._loop.run_in_executor(None, self._reader.join)
+        self.serial.close()
+        self._writer.shutdown()
+        self.serial = None
+        while self._pending:
+            future = self._pending.popleft()[0]
+            if not future.done():
+                future.set_exception(ConnectionError('transport closed'))
+
+    def _read(self):
+        # blocking reads are done in a thread and handed over to the event loop
+        while self._running:
+            try:
+                chunk = self.serial.read(self.serial.in_waiting or 1)
+            except serial.SerialException as e:
+                self._running = False
+                self._loop.call_soon_threadsafe(self._fail, e)
+                return
+            if chunk:
+                self._loop.call_soon_threadsafe(self._feed, chunk)
+
+    def _feed(self, chunk):
+        now = time.perf_counter()
+        if self._first is None:
+            self._first = now
+        else:
+            self._gap = max(self._gap, now - self._last)
+        self._last = now
+        self._buffer += chunk
+        while True:
+            end = self._buffer.find(PROMPT)
+            if end < 0:
+                return
+            frame = self._buffer[:end]
+            self._buffer = self._buffer[end + len(PROMPT):]
+            first, gap = self._first, self._gap
+            # the rest of the chunk belongs to the next reply
+            self._first = now if self._buffer else None
+            self._gap = 0.0
+            if not self._pending:
+                # prompt without a command, e.g. after connecting
+                continue
+            future, verb, sent, written = self._pending.popleft()
+            # the first line is the echo of the command
+            echo, _, reply = frame.decode('utf-8').partition('\n')
+            self.metrics.command(verb, sent, len(echo) + 1, max(first - written, 0.0))
+            self.metrics.reply(verb, len(frame) - len(echo) - 1 + len(PROMPT), now - first, gap)
+            if not future.done():
+                future.set_result(reply.replace('\r', ''))
+
+    def _fail(self, e):
+        while self._pending:
+            future = self._pending.popleft()[0]
+            if not future.done():
+                future.set_exception(e)
+
+    def submit(self, cmd):
+        """
+        Write a command without waiting for its reply
+        :param cmd: command string, the terminating "\\r" is optional
+        :return: asyncio.Future resolving to the reply (without echo and prompt)
+        """
+        if not cmd.endswith('\r'):
+            cmd += '\r'
+        future = self._loop.create_future()
+        data = cmd.encode()
+        self._pending.append([future, cmd.split(' ', 1)[0].strip(), len(data), time.perf_counter()])
+        self._loop.run_in_executor(self._writer, self._write, self._pending[-1], data)
+        return future
+
+    def _write(self, pending, data):
+        # the latency is counted from the time the command was actually written
+        self.serial.write(data)
+        pending[3] = time.perf_counter()
+
+    async def command(self, cmd, timeout=None):
+        """
+        Send a command and wait for its reply
+        :return: str: reply of the nanoVNA
+        """
+        # a timed out future stays queued so that its late reply is not taken for the reply of the next command
+        return await asyncio.wait_for(asyncio.shield(self.submit(cmd)), timeout or self.timeout)
+
+
+class AsyncNanoVNA:
+    """
+    Asynchronous counterpart of the high level NanoVNA functions used by AMCP.
+    """
+    segment_length = 101
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.frequencies = None
+
+    async def set_sweep(self, start, stop):
+        if start is not None:
+            self.transport.submit('sweep start %d' % start)
+        if stop is not None:
+            await self.transport.command('sweep stop %d' % stop)
+
+    async def fetch_frequencies(self):
+        self.frequencies = parse_frequencies(await self.transport.command('frequencies'))
+        return self.frequencies
+
+    async def data(self, array=0):
+        return parse_complex(await self.transport.command('data %d' % array))
+
+    async def scan(self, frequencies, callback=None):
+        """
+        Segmented scan. The commands of the next segment are queued before the replies of the current segment are
+        parsed, so the device is sweeping while the host is busy.
+        :param frequencies: array of frequencies to scan
+        :param callback: optional function called with (frequencies, array0, array1) for every segment, returning True
+                         stops the scan after the segment
+        :return: array0, array1
+        """
+        segments = [frequencies[n:n + self.segment_length] for n in range(0, len(frequencies), self.segment_length)]
+        array0 = []
+        array1 = []
+
+        def queue(freqs):
+            with timing.span('nanovna.send_command'):
+                self.transport.submit('scan %d %d %d' % (freqs[0], freqs[-1], len(freqs)))
+                return self.transport.submit('data 0'), self.transport.submit('data 1')
+
+        pending = queue(segments[0]) if segments else None
+        for n, freqs in enumerate(segments):
+            current = pending
+            pending = queue(segments[n + 1]) if n + 1 < len(segments) else None
+            with timing.span('nanovna.fetch_data'):
+                replies = [await asyncio.wait_for(reply, self.transport.timeout) for reply in current]
+            with timing.span('nanovna.parse'):
+                s0, s1 = (parse_complex(reply) for reply in replies)
+            array0.append(s0)
+            array1.append(s1)
+            if callback and callback(freqs, s0, s1):
+                break
+        if pending:
+            # drain the segment queued ahead, its replies are dropped if they do not arrive in time
+            try:
+                await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), self.transport.timeout)
+            except asyncio.TimeoutError:
+                logger.warning('no reply to the segment queued ahead')
+        await self.transport.command('resume')
+        return np.concatenate(array0) if array0 else np.array([]), np.concatenate(array1) if array1 else np.array([])
+
+
+class TransportThread:
+    """
+    Runs an AsyncTransport in an event loop of its own so it can be used from synchronous code
+    """
+
+    def __init__(self, dev=None, timeout=5.0, metrics=None):
+        self.transport = AsyncTransport(dev=dev, timeout=timeout, metrics=metrics)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='nanovna-loop', daemon=True)
+        self._thread.start()
+        self.run(self.transport.open())
+
+    @property
+    def dev(self):
+        return self.transport.dev
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine in the transport loop and wait for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, cmd):
+        """
+        Queue a command
+        :return: concurrent.futures.Future resolving to the reply
+        """
+        return asyncio.run_coroutine_threadsafe(self.transport.command(cmd), self.loop)
+
+    def command(self, cmd):
+        return self.submit(cmd).result()
+
+    def close(self):
+        self.run(self.transport.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - persistent nanoVNA session
+
+A session keeps the serial port of a nanoVNA open across measurements. The device path and serial number are cached,
+so the port list is only scanned again if the device disappeared, and the frequency grid of the current sweep is only
+read back from the device when the span has changed. After an unplug the session reconnects transparently on the next
+command.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import os
+import serial
+from serial.tools import list_ports
+from devices.nanovna.nanovna import NanoVNA, VID, PID
+from devices.nanovna.link_metrics import LinkMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class NanoVNASession:
+    """
+    Persistent connection to one nanoVNA. Use NanoVNASession.get() to share a session between wrappers.
+    """
+    _sessions = {}
+
+    def __init__(self, dev=None, pipeline=False, **options):
+        """
+        :param pipeline: talk to the device through a TransportThread, commands are queued without waiting for the
+                         replies of the previous ones
+        :param options: record, replay and replay_speed of NanoVNA
+        """
+        if pipeline and (options.get('record') or options.get('replay')):
+            raise ValueError('a pipelined session can not be recorded or replayed')
+        self.dev = dev or options.get('replay')
+        self.pipeline = pipeline
+        self.options = options
+        self.metrics = LinkMetrics()    # serial link metrics, kept across reconnects
+        self.serial_number = None
+        self.vna = None
+        self._sweep = None          # (start, stop) currently set on the device
+        self._frequencies = None    # frequency grid read back for self._sweep
+
+    @classmethod
+    def get(cls, dev=None, **options):
+        """
+        Returns the open session for dev, the first session created if dev is None
+        :param options: options of a new session, see __init__()
+        """
+        dev = dev or options.get('replay')
+        if dev is None and cls._sessions:
+            return next(iter(cls._sessions.values()))
+        session = cls._sessions.get(dev)
+        if session is None:
+            session = cls(dev, **options)
+            session.connect()
+            cls._sessions[session.dev] = session
+        return session
+
+    def _discover(self):
+        # prefer the device with the known serial number, it may come back on another path after an unplug
+        candidates = [port for port in list_ports.comports() if port.vid == VID and port.pid == PID]
+        for port in candidates:
+            if self.serial_number and port.serial_number == self.serial_number:
+                return port
+        for port in candidates:
+            if self.dev is None or port.device == self.dev:
+                return port
+        raise OSError('device not found')
+
+    def _exists(self):
+        # device nodes can only be checked on posix systems
+        return self.dev is not None and (os.name == 'nt' or os.path.exists(self.dev))
+
+    def isAlive(self):
+        """
+        Cheap check of the connection without talking to the device
+        """
+        if self.vna is None or not self.vna.is_open():
+            return False
+        return self._exists()
+
+    def connect(self):
+        if self.isAlive():
+            return
+        if not self._exists():
+            port = self._discover()
+            self.dev = port.device
+            self.serial_number = port.serial_number
+        elif self.serial_number is None:
+            # remember the serial number of an explicitly given device to find it again after an unplug
+            self.serial_number = next((port.serial_number for port in list_ports.comports()
+                                       if port.device == self.dev), None)
+        transport = None
+        if self.pipeline:
+            from devices.nanovna.nanovna_async import TransportThread
+            transport = TransportThread(self.dev, metrics=self.metrics)
+        self.vna = NanoVNA(self.dev, transport=transport, metrics=self.metrics, **self.options)
+        self.vna.open()
+        self._sweep = None
+        self._frequencies = None
+        logger.info('connected to nanoVNA at {} (serial number {})'.format(self.dev, self.serial_number))
+
+    def disconnect(self):
+        """
+        Close the port but keep the session, e.g. after the device was unplugged. The next command reconnects.
+        """
+        if self.vna:
+            try:
+                self.vna.close()
+                if self.vna.transport:
+                    self.vna.transport.close()
+            except (serial.SerialException, OSError) as e:
+                logger.debug('closing {} failed: {}'.format(self.dev, e))
+        self.vna = None
+
+    def close(self):
+        self.disconnect()
+        self._sessions.pop(self.dev, None)
+
+    def call(self, function, *args, **kwargs):
+        """
+        Run function(vna, *args, **kwargs), reconnecting once if the device was unplugged in the meantime
+        """
+        self.connect()
+        try:
+            return function(self.vna, *args, **kwargs)
+        except (serial.SerialException, OSError) as e:
+            logger.info('lost connection to {} ({}), reconnecting'.format(self.dev, e))
+            self.disconnect()
+            self.connect()
+            return function(self.vna, *args, **kwargs)
+
+    def setSweep(self, start, stop):
+        """
+        Set the sweep range, nothing is sent if it did not change
+        """
+        if self.isAlive() and self._sweep == (start, stop):
+            return
+        self.call(NanoVNA.set_sweep, start, stop)
+        self._sweep = (start, stop)
+        self._frequencies = None
+
+    def invalidate(self):
+        """
+        Forget the cached sweep, e.g. after commands changing the sweep behind the session's back
+        """
+        self._sweep = None
+        self._frequencies = None
+
+    def frequencies(self):
+        """
+        Frequency grid of the current sweep, only read from the device after the sweep has changed
+        """
+        if self._frequencies is None or not self.isAlive():
+            self.call(NanoVNA.fetch_frequencies)
+            self._frequencies = self.vna.frequencies
+        return self._frequencies
@@ -16,29 +16,65 @@ __status__ = "Developement"
 __version__ = "0.1"
 
 from devices.nanovna.nanovna import NanoVNA
+from devices.nanovna.nanovna_async import AsyncNanoVNA
+from devices.nanovna.nanovna_session import NanoVNASession
 import logging
 import numpy as np
 import pandas as pd
+from support import timing
+from support.data_management import TouchstoneWriter
 import time
 logger = logging.getLogger(__name__)
 
 class nanoVnaWrapper():
 
-    def __init__(self):
-        self.vna = NanoVNA()
+    def __init__(self, dev=None, **options):
+        """
+        :param options: pipeline, record, replay and replay_speed, see NanoVNASession and NanoVNA
+        """
+        # the session keeps the port open and is shared by all wrappers of the same device
+        self.session = NanoVNASession.get(dev, **options)
+
+    @property
+    def vna(self):
+        self.session.connect()
+        return self.session.vna
+
+    def close(self):
+        self.session.close()
+
+    def measure(self, fstart, fstop, averaging=1, points=101, estimator=None, callback=None, cancel=None):
+        """
+        Run a complete measurement. A single pass with more than 101 points or an estimator is scanned in segments,
+        see scanTrData, averaged passes are limited to 101 points.
+        :return: pandas dataframe
+        """
+        if averaging == 1 and (points > 101 or estimator):
+            return self.scanTrData(start=fstart, stop=fstop, points=points, estimator=estimator, callback=callback,
+                                   cancel=cancel)
+        self.setFrequencies(start=fstart, stop=fstop, points=min(points, 101))
+        return self.getTrData(averaging=averaging, cancel=cancel)
 
     def setFrequencies(self, start=1e6, stop=900e6, points=101):
         if 0 < points <= 101:
             self.vna.set_frequencies(start=start, stop=stop, points=points)
-            self.vna.set_sweep(start=start, stop=stop)
+            self.session.setSweep(start=start, stop=stop)
             logger.debug('start = {}, stop = {}'.format(start, stop))
         else:
             logger.info('"points" has to be: 0 < points <= 101')
 
-    def getTrData(self, averaging=1):
+    def getTrData(self, averaging=1, callback=None, cancel=None):
+        """
+        :param callback: optional function called with (pass, averaging, frequency, tr_loss, phase) after every pass
+        :param cancel: optional threading.Event, raises InterruptedError between passes once it is set
+        """
         frequency, tr_loss, phase = self._getTrData()
         if averaging != 1:
             for n in range(averaging):
+                if cancel and cancel.is_set():
+                    raise InterruptedError('measurement cancelled')
+                if callback:
+                    callback(n, averaging, frequency, tr_loss, phase)
                 f, t, p = self._getTrData()
                 tr_loss = np.average([t, tr_loss], axis=0)
                 phase = np.average([p, phase], axis=0)
@@ -46,13 +82,68 @@ class nanoVnaWrapper():
         logger.debug('created data')
         return data
 
+    def scanTrData(self, start=1e6, stop=900e6, points=101, estimator=None, touchstone=None, callback=None,
+                   cancel=None):
+        """
+        Segmented scan supporting more than 101 points. Each segment is handed to the estimator as soon as it arrives
+        and the scan is stopped early once the estimator has bracketed all features.
+        :param estimator: optional OnlineResonanceEstimator
+        :param touchstone: optional .s2p file the S11 and S21 of every segment are written to as it arrives
+        :param callback: optional function called with (frequency, tr_loss, phase) of the points scanned so far after
+                         every segment
+        :param cancel: optional threading.Event, raises InterruptedError between segments once it is set
+        :return: pandas dataframe with the points scanned so far
+        """
+        segments = []
+
+        def segment(frequency, array0, array1):
+            if writer:
+                writer.write(frequency, array0, array1)
+            segments.append(self._toTrData(frequency, np.array(array1)))
+            stop = estimator.update(*segments[-1]) if estimator else False
+            if callback:
+                callback(*(np.concatenate(column) for column in zip(*segments)))
+            return stop or bool(cancel and cancel.is_set())
+
+        def scan(vna):
+            # started again from the first segment after a reconnect
+            segments.clear()
+            if estimator:
+                estimator.reset()
+            vna.set_frequencies(start=start, stop=stop, points=points)
+            if vna.transport:
+                # the next segment is already sweeping while the current one is handed on
+                return vna.transport.run(AsyncNanoVNA(vna.transport.transport).scan(
+                    vna.frequencies, callback=segment if estimator or writer or callback or cancel else None))
+            return vna.scan(callback=segment if estimator or writer or callback or cancel else None)
+
+        writer = TouchstoneWriter(touchstone) if touchstone else None
+        # the scan command leaves the device with the range of the last segment
+        self.session.invalidate()
+        try:
+            array0, array1 = self.session.call(scan)
+        finally:
+            if writer:
+                writer.close()
+        if cancel and cancel.is_set():
+            raise InterruptedError('measurement cancelled')
+        frequency, tr_loss, phase = self._toTrData(self.vna.frequencies[:len(array1)], np.array(array1))
+        data = pd.DataFrame({'Frequency(Hz)': frequency, 'Transmission Loss(dB)': tr_loss, 'Phase(deg)': phase})
+        logger.debug('scanned {} of {} points'.format(len(frequency), points))
+        return data
+
     def _getTrData(self):
-        self.vna.fetch_frequencies()
+        frequency = self.session.frequencies()
         #self.vna.scan()
-        time.sleep(1.5)
-        data = self.vna.data(1)
+        with timing.span('nanovna.sweep_wait'):
+            time.sleep(1.5)
+        data = self.session.call(NanoVNA.data, 1)
+
+        with timing.span('nanovna.convert'):
+            return self._toTrData(frequency, data)
 
-        frequency = self.vna.frequencies
+    @staticmethod
+    def _toTrData(frequency, data):
         tr_loss = 20 * np.log10(np.abs(data))
         phase = np.angle(data)*180/np.pi
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - serial session recording and replay
+
+SerialRecorder sits between the nanoVNA driver and its serial port and logs every command and reply with timestamps to
+a binary file. SerialReplay plays such a file back to the driver instead of a device, at the recorded speed or as fast
+as possible. Replays are bit-identical, so a slow bench run can be reproduced and profiled without the instrument and
+the driver overhead can be told apart from the latency of the instrument.
+
+File format: a header (MAGIC, start time as unix time f8) followed by records (direction u1, time of the first and of
+the last byte f8 relative to the header, length u4, bytes). The bytes read between two commands are one record, a reply
+is written as soon as its prompt arrived. A reconnect appends a new header, the times of the following records are
+relative to it. Records are written unbuffered, a session which was killed leaves at most its last record incomplete,
+which is dropped when the file is read.
+
+>> python -m devices.nanovna.serial_log session.bin
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'AMCPSER\x01'
+HEADER = struct.Struct('<d')
+RECORD = struct.Struct('<BddI')
+
+WRITE = 0
+READ = 1
+
+PROMPT = b'ch> '    # end of a reply of the nanoVNA shell
+
+
+def readLog(file):
+    """
+    :return: list of the records (direction, first, last, data), the times relative to the first header. An
+             incomplete record at the end, e.g. of a session which was killed, is dropped.
+    """
+    records = []
+    offset = 0.0
+    start = None
+    with open(file, 'rb') as f:
+        while True:
+            head = f.read(len(MAGIC))
+            if not head:
+                break
+            if head == MAGIC:
+                data = f.read(HEADER.size)
+                if len(data) < HEADER.size:
+                    logger.warning('{}: incomplete header at the end, {} records read'.format(file, len(records)))
+                    break
+                t, = HEADER.unpack(data)
+                start = t if start is None else start
+                offset = t - start
+                continue
+            head += f.read(RECORD.size - len(head))
+            if len(head) < RECORD.size:
+                logger.warning('{}: incomplete record at the end, {} records read'.format(file, len(records)))
+                break
+            direction, first, last, length = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                logger.warning('{}: record {} cut after {} of {} bytes, dropped'.format(
+                    file, len(records), len(data), length))
+                break
+            records.append((direction, first + offset, last + offset, data))
+    return records
+
+
+class SerialRecorder:
+    """
+    Serial port logging everything written and read
+    """
+
+    def __init__(self, port, file):
+        """
+        :param port: open serial.Serial
+        :param file: recording, appended to if it exists
+        """
+        self.port = port
+        # unbuffered, every record is written at once
+        self.file = open(file, 'ab', buffering=0)
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+        self._start = time.perf_counter()
+        self._read = bytearray()
+        self._first = 0.0
+        self._last = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def _record(self, direction, first, last, data):
+        self.file.write(RECORD.pack(direction, first, last, len(data)) + bytes(data))
+
+    def _flush(self):
+        if self._read:
+            self._record(READ, self._first, self._last, self._read)
+            self._read = bytearray()
+
+    def _received(self, data):
+        now = time.perf_counter() - self._start
+        if not self._read:
+            self._first = now
+        self._last = now
+        self._read += data
+        if self._read.endswith(PROMPT):
+            self._flush()
+        return data
+
+    def write(self, data):
+        self._flush()
+        now = time.perf_counter() - self._start
+        self._record(WRITE, now, now, data)
+        return self.port.write(data)
+
+    def read(self, size=1):
+        return self._received(self.port.read(size))
+
+    def readline(self):
+        return self._received(self.port.readline())
+
+    def close(self):
+        self._flush()
+        self.file.close()
+        self.port.close()
+
+
+class SerialReplay:
+    """
+    Serial port playing back a recording. The replies are released relative to the command they answer, so the
+    recorded latency of the instrument is kept however fast the driver runs.
+    """
+
+    def __init__(self, file, speed=1.0):
+        """
+        :param speed: factor on the recorded timing, None replays without waiting
+        """
+        self.records = readLog(file)
+        self.speed = speed
+        self.is_open = True
+        self._next = 0
+        self._queue = []            # [data, position, available times] of the replies not yet read
+        self._anchor(time.perf_counter(), 0.0)
+
+    def _anchor(self, now, recorded):
+        # queue the replies up to the next command, timed relative to now
+        while self._next < len(self.records) and self.records[self._next][0] == READ:
+            _, first, last, data = self.records[self._next]
+            n = len(data)
+            times = [first + (last - first) * i / max(n - 1, 1) for i in range(n)]
+            if self.speed:
+                times = [now + (t - recorded) / self.speed for t in times]
+            self._queue.append([data, 0, times])
+            self._next += 1
+
+    def write(self, data):
+        if self._next >= len(self.records):
+            raise EOFError('replay: command {!r} after the end of the recording'.format(bytes(data)))
+        direction, first, _, recorded = self.records[self._next]
+        if bytes(data) != recorded:
+            raise ValueError('replay diverged at record {}: sent {!r}, recorded {!r}'.format(
+                self._next, bytes(data), recorded))
+        self._next += 1
+        self._anchor(time.perf_counter(), first)
+        return len(data)
+
+    def _byte(self):
+        while self._queue and self._queue[0][1] >= len(self._queue[0][0]):
+            self._queue.pop(0)
+        if not self._queue:
+            raise EOFError('replay: read after the end of the recorded reply')
+        reply = self._queue[0]
+        if self.speed:
+            wait = reply[2][reply[1]] - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        reply[1] += 1
+        return reply[0][reply[1] - 1:reply[1]]
+
+    def read(self, size=1):
+        return b''.join(self._byte() for _ in range(size))
+
+    def readline(self):
+        line = b''
+        while not line.endswith(b'\n'):
+            line += self._byte()
+        return line
+
+    def close(self):
+        self.is_open = False
+
+
+def summary(file):
+    """
+    Latency of every command: time from the command to the last byte of its reply
+    :return: list of (command, reply bytes, latency [s])
+    """
+    commands = []
+    for direction, first, last, data in readLog(file):
+        if direction == WRITE:
+            commands.append([data.decode('ascii', 'replace').strip(), 0, 0.0, first])
+        elif commands:
+            commands[-1][1] += len(data)
+            commands[-1][2] = last - commands[-1][3]
+    return [tuple(command[:3]) for command in commands]
+
+
+if __name__ == '__main__':
+    import sys
+    for command, length, latency in summary(sys.argv[1]):
+        print('{:<40} {:>8d} bytes {:>10.1f} ms'.format(command, length, latency * 1e3))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Serial Port Monitor
+
+Background watcher of the serial ports of the host. On Linux udev events wake the watcher as soon as a tty is added
+or removed (pyudev is used if it is installed), otherwise the port list is polled. Every change is reported once as
+an add or remove event with the port information (device, VID/PID, serial number), so listeners can update their
+port lists incrementally and reconnect known instruments.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import threading
+from serial.tools import list_ports
+
+logger = logging.getLogger(__name__)
+
+
+class PortMonitor:
+    """
+    Watches the serial ports in a thread of its own and calls on_add(port) / on_remove(port) for every change
+    """
+
+    def __init__(self, on_add=None, on_remove=None, interval=1.0):
+        """
+        :param on_add: function called with the ListPortInfo of a new port, from the monitor thread
+        :param on_remove: function called with the ListPortInfo of a removed port, from the monitor thread
+        :param interval: polling interval if udev is not available [s]
+        """
+        self.on_add = on_add
+        self.on_remove = on_remove
+        self.interval = interval
+        self.ports = {}         # device: ListPortInfo
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='port-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2 * self.interval)
+
+    def scan(self):
+        """
+        Compare the current port list with the last one and report the changes
+        """
+        with self._lock:
+            current = {port.device: port for port in list_ports.comports()}
+            added = [current[dev] for dev in sorted(current.keys() - self.ports.keys())]
+            removed = [self.ports[dev] for dev in sorted(self.ports.keys() - current.keys())]
+            self.ports = current
+
+        for port in removed:
+            logger.info('serial port removed: {}'.format(port.device))
+            if self.on_remove:
+                self.on_remove(port)
+        for port in added:
+            logger.info('serial port added: {} ({})'.format(port.device, port.description))
+            if self.on_add:
+                self.on_add(port)
+
+    def _udev(self):
+        try:
+            import pyudev
+        except ImportError:
+            return None
+        try:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by(subsystem='tty')
+            monitor.start()
+        except Exception as e:
+            logger.debug('udev not available, polling the serial ports: {}'.format(e))
+            return None
+        return monitor
+
+    def _run(self):
+        monitor = self._udev()
+        self.scan()
+        while not self._stop.is_set():
+            try:
+                if monitor:
+                    # the port information is read from sysfs after any tty event
+                    if monitor.poll(timeout=self.interval) is not None:
+                        self.scan()
+                elif not self._stop.wait(self.interval):
+                    self.scan()
+            except Exception as e:
+                logger.debug('error: port scan failed: {}'.format(e))
+                self._stop.wait(self.interval)
@@ -96,6 +96,10 @@ class Ui_MainWindow(object):
         self.label_35 = QtWidgets.QLabel(self.groupBox)
         self.label_35.setObjectName("label_35")
         self.gridLayout_4.addWidget(self.label_35, 8, 5, 1, 1)
+        self.screening = QtWidgets.QCheckBox(self.groupBox)
+        self.screening.setChecked(True)
+        self.screening.setObjectName("screening")
+        self.gridLayout_4.addWidget(self.screening, 9, 0, 1, 6)
         self.f_max = QtWidgets.QLineEdit(self.groupBox)
         self.f_max.setMaximumSize(QtCore.QSize(16777215, 16777215))
         self.f_max.setObjectName("f_max")
@@ -146,6 +150,14 @@ class Ui_MainWindow(object):
         self.btn_run_measurement = QtWidgets.QPushButton(self.tab)
         self.btn_run_measurement.setObjectName("btn_run_measurement")
         self.gridLayout_2.addWidget(self.btn_run_measurement, 6, 1, 1, 1)
+        self.btn_track = QtWidgets.QPushButton(self.tab)
+        self.btn_track.setCheckable(True)
+        self.btn_track.setObjectName("btn_track")
+        self.gridLayout_2.addWidget(self.btn_track, 7, 0, 1, 1)
+        self.btn_cancel = QtWidgets.QPushButton(self.tab)
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.setObjectName("btn_cancel")
+        self.gridLayout_2.addWidget(self.btn_cancel, 7, 1, 1, 1)
         self.groupBox_2 = QtWidgets.QGroupBox(self.tab)
         self.groupBox_2.setObjectName("groupBox_2")
         self.gridLayout = QtWidgets.QGridLayout(self.groupBox_2)
@@ -360,6 +372,109 @@ class Ui_MainWindow(object):
         self.gridLayout_9.addItem(spacerItem5, 0, 2, 1, 2)
         self.gridLayout_10.addWidget(self.groupBox_9, 3, 0, 1, 2)
         self.tabWidget.addTab(self.tab_3, "")
+        self.tab_production = QtWidgets.QWidget()
+        self.tab_production.setObjectName("tab_production")
+        self.gridLayout_11 = QtWidgets.QGridLayout(self.tab_production)
+        self.gridLayout_11.setObjectName("gridLayout_11")
+        self.label_part_id = QtWidgets.QLabel(self.tab_production)
+        self.label_part_id.setObjectName("label_part_id")
+        self.gridLayout_11.addWidget(self.label_part_id, 0, 0, 1, 1)
+        self.part_id = QtWidgets.QLineEdit(self.tab_production)
+        self.part_id.setObjectName("part_id")
+        self.gridLayout_11.addWidget(self.part_id, 0, 1, 1, 1)
+        self.btn_add_part = QtWidgets.QPushButton(self.tab_production)
+        self.btn_add_part.setObjectName("btn_add_part")
+        self.gridLayout_11.addWidget(self.btn_add_part, 0, 2, 1, 1)
+        self.auto_trigger = QtWidgets.QCheckBox(self.tab_production)
+        self.auto_trigger.setObjectName("auto_trigger")
+        self.gridLayout_11.addWidget(self.auto_trigger, 1, 0, 1, 1)
+        self.btn_production = QtWidgets.QPushButton(self.tab_production)
+        self.btn_production.setCheckable(True)
+        self.btn_production.setObjectName("btn_production")
+        self.gridLayout_11.addWidget(self.btn_production, 1, 1, 1, 1)
+        self.btn_next_part = QtWidgets.QPushButton(self.tab_production)
+        self.btn_next_part.setEnabled(False)
+        self.btn_next_part.setObjectName("btn_next_part")
+        self.gridLayout_11.addWidget(self.btn_next_part, 1, 2, 1, 1)
+        self.part_queue = QtWidgets.QListWidget(self.tab_production)
+        self.part_queue.setMaximumSize(QtCore.QSize(250, 16777215))
+        self.part_queue.setObjectName("part_queue")
+        self.gridLayout_11.addWidget(self.part_queue, 2, 0, 1, 1)
+        self.results_table = QtWidgets.QTableView(self.tab_production)
+        self.results_table.setAlternatingRowColors(True)
+        self.results_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.results_table.setObjectName("results_table")
+        self.gridLayout_11.addWidget(self.results_table, 2, 1, 1, 2)
+        self.results_filter = QtWidgets.QLineEdit(self.tab_production)
+        self.results_filter.setClearButtonEnabled(True)
+        self.results_filter.setObjectName("results_filter")
+        self.gridLayout_11.addWidget(self.results_filter, 3, 0, 1, 3)
+        self.all_vnas = QtWidgets.QCheckBox(self.tab_production)
+        self.all_vnas.setObjectName("all_vnas")
+        self.gridLayout_11.addWidget(self.all_vnas, 4, 0, 1, 1)
+        self.throughput = QtWidgets.QLabel(self.tab_production)
+        self.throughput.setObjectName("throughput")
+        self.gridLayout_11.addWidget(self.throughput, 4, 1, 1, 2)
+        self.tabWidget.addTab(self.tab_production, "")
+        self.tab_timing = QtWidgets.QWidget()
+        self.tab_timing.setObjectName("tab_timing")
+        self.gridLayout_12 = QtWidgets.QGridLayout(self.tab_timing)
+        self.gridLayout_12.setObjectName("gridLayout_12")
+        self.timing_enabled = QtWidgets.QCheckBox(self.tab_timing)
+        self.timing_enabled.setObjectName("timing_enabled")
+        self.gridLayout_12.addWidget(self.timing_enabled, 0, 0, 1, 1)
+        self.btn_timing_reset = QtWidgets.QPushButton(self.tab_timing)
+        self.btn_timing_reset.setObjectName("btn_timing_reset")
+        self.gridLayout_12.addWidget(self.btn_timing_reset, 0, 1, 1, 1)
+        self.btn_timing_export = QtWidgets.QPushButton(self.tab_timing)
+        self.btn_timing_export.setObjectName("btn_timing_export")
+        self.gridLayout_12.addWidget(self.btn_timing_export, 0, 2, 1, 1)
+        self.timing_table = QtWidgets.QTableWidget(self.tab_timing)
+        self.timing_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.timing_table.setAlternatingRowColors(True)
+        self.timing_table.setObjectName("timing_table")
+        self.timing_table.setColumnCount(6)
+        self.timing_table.setRowCount(0)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(0, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(1, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(2, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(3, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(4, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.timing_table.setHorizontalHeaderItem(5, item)
+        self.gridLayout_12.addWidget(self.timing_table, 1, 0, 1, 3)
+        self.label_link = QtWidgets.QLabel(self.tab_timing)
+        self.label_link.setObjectName("label_link")
+        self.gridLayout_12.addWidget(self.label_link, 2, 0, 1, 3)
+        self.link_table = QtWidgets.QTableWidget(self.tab_timing)
+        self.link_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.link_table.setAlternatingRowColors(True)
+        self.link_table.setObjectName("link_table")
+        self.link_table.setColumnCount(8)
+        self.link_table.setRowCount(0)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(0, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(1, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(2, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(3, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(4, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(5, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(6, item)
+        item = QtWidgets.QTableWidgetItem()
+        self.link_table.setHorizontalHeaderItem(7, item)
+        self.gridLayout_12.addWidget(self.link_table, 3, 0, 1, 3)
+        self.tabWidget.addTab(self.tab_timing, "")
         self.tab_2 = QtWidgets.QWidget()
         self.tab_2.setObjectName("tab_2")
         self.gridLayout_3 = QtWidgets.QGridLayout(self.tab_2)
@@ -415,6 +530,8 @@ class Ui_MainWindow(object):
         self.actionSave.setObjectName("actionSave")
         self.actionLoad = QtWidgets.QAction(MainWindow)
         self.actionLoad.setObjectName("actionLoad")
+        self.actionLoad_results = QtWidgets.QAction(MainWindow)
+        self.actionLoad_results.setObjectName("actionLoad_results")
         self.actionHelp = QtWidgets.QAction(MainWindow)
         self.actionHelp.setObjectName("actionHelp")
         self.actionExport_Spectre = QtWidgets.QAction(MainWindow)
@@ -423,10 +540,18 @@ class Ui_MainWindow(object):
         self.actionas_SPICE_model.setObjectName("actionas_SPICE_model")
         self.actionas_Spectre_model = QtWidgets.QAction(MainWindow)
         self.actionas_Spectre_model.setObjectName("actionas_Spectre_model")
+        self.actionresults_as_SPICE_library = QtWidgets.QAction(MainWindow)
+        self.actionresults_as_SPICE_library.setObjectName("actionresults_as_SPICE_library")
+        self.actionresults_as_Spectre_library = QtWidgets.QAction(MainWindow)
+        self.actionresults_as_Spectre_library.setObjectName("actionresults_as_Spectre_library")
         self.menuExport.addAction(self.actionas_SPICE_model)
         self.menuExport.addAction(self.actionas_Spectre_model)
+        self.menuExport.addSeparator()
+        self.menuExport.addAction(self.actionresults_as_SPICE_library)
+        self.menuExport.addAction(self.actionresults_as_Spectre_library)
         self.menuFile.addAction(self.actionSave)
         self.menuFile.addAction(self.actionLoad)
+        self.menuFile.addAction(self.actionLoad_results)
         self.menuFile.addAction(self.menuExport.menuAction())
         self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionClose)
@@ -438,6 +563,8 @@ class Ui_MainWindow(object):
 
         self.retranslateUi(MainWindow)
         self.tabWidget.setCurrentIndex(0)
+        self.btn_track.toggled['bool'].connect(MainWindow.toggle_tracking)
+        self.btn_cancel.clicked.connect(MainWindow.cancel_measurement)
         self.btn_run_measurement.clicked.connect(MainWindow.run_measurement)
         self.btn_recompute.clicked.connect(MainWindow.recompute)
         self.sel_minivna_port.activated['QString'].connect(MainWindow.update_comports)
@@ -452,6 +579,14 @@ class Ui_MainWindow(object):
         self.btn_minivna_cal_loc.clicked.connect(MainWindow.open_minivna_cal_loc)
         self.btn_nanovna_wrapper_loc.clicked.connect(MainWindow.open_nanovna_wrapper_loc)
         self.btn_nanovna_cal_loc.clicked.connect(MainWindow.open_nanovna_cal_loc)
+        self.btn_add_part.clicked.connect(MainWindow.add_part)
+        self.part_id.returnPressed.connect(MainWindow.add_part)
+        self.btn_production.toggled['bool'].connect(MainWindow.toggle_production)
+        self.btn_next_part.clicked.connect(MainWindow.trigger_part)
+        self.results_filter.textChanged['QString'].connect(MainWindow.filter_results)
+        self.timing_enabled.toggled['bool'].connect(MainWindow.toggle_timing)
+        self.btn_timing_reset.clicked.connect(MainWindow.reset_timing)
+        self.btn_timing_export.clicked.connect(MainWindow.export_timing)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
     def retranslateUi(self, MainWindow):
@@ -485,6 +620,8 @@ class Ui_MainWindow(object):
         self.ext_cl.setText(_translate("MainWindow", "0"))
         self.r_setup.setText(_translate("MainWindow", "12.5"))
         self.label_35.setText(_translate("MainWindow", "pF"))
+        self.screening.setToolTip(_translate("MainWindow", "Run a short coarse sweep first and abort if no usable resonance is found"))
+        self.screening.setText(_translate("MainWindow", "Pre-screen crystal"))
         self.f_max.setText(_translate("MainWindow", "26050000"))
         self.label_3.setText(_translate("MainWindow", "<html><head/><body><p align=\"right\">F<span style=\" vertical-align:sub;\">max</span></p></body></html>"))
         self.label_34.setText(_translate("MainWindow", "<html><head/><body><p align=\"right\">External Load-Capacitance:</p></body></html>"))
@@ -497,6 +634,9 @@ class Ui_MainWindow(object):
         self.f_min.setText(_translate("MainWindow", "25990000"))
         self.label_2.setText(_translate("MainWindow", "<html><head/><body><p align=\"right\">F<span style=\" vertical-align:sub;\">min</span></p></body></html>"))
         self.btn_run_measurement.setText(_translate("MainWindow", "Run Measurement"))
+        self.btn_track.setToolTip(_translate("MainWindow", "Continuously follow fs and R1 of the crystal in a narrow window"))
+        self.btn_track.setText(_translate("MainWindow", "Track Resonance"))
+        self.btn_cancel.setText(_translate("MainWindow", "Cancel"))
         self.groupBox_2.setTitle(_translate("MainWindow", "Results"))
         self.fp_res.setText(_translate("MainWindow", "-"))
         self.label_9.setText(_translate("MainWindow", "<html><head/><body><p>L<span style=\" vertical-align:sub;\">1</span>:</p></body></html>"))
@@ -548,6 +688,55 @@ class Ui_MainWindow(object):
         self.label_25.setText(_translate("MainWindow", "Refresh COM Ports:"))
         self.btn_refresh_ports.setText(_translate("MainWindow", "Refresh"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_3), _translate("MainWindow", "Setup"))
+        self.label_part_id.setText(_translate("MainWindow", "Part ID / Lot"))
+        self.part_id.setToolTip(_translate("MainWindow", "Part ID or lot number, press enter to add it to the queue"))
+        self.btn_add_part.setText(_translate("MainWindow", "Add to Queue"))
+        self.auto_trigger.setToolTip(_translate("MainWindow", "Start the measurement as soon as a crystal is detected in the fixture"))
+        self.auto_trigger.setText(_translate("MainWindow", "Start on contact"))
+        self.btn_production.setText(_translate("MainWindow", "Start Production"))
+        self.btn_next_part.setToolTip(_translate("MainWindow", "Measure the next part in the queue"))
+        self.btn_next_part.setText(_translate("MainWindow", "Measure Next (F5)"))
+        self.results_filter.setPlaceholderText(_translate("MainWindow", "Filter by part ID or status"))
+        self.all_vnas.setToolTip(_translate("MainWindow", "Measure on every attached nanoVNA and the connected VNA, one part per fixture"))
+        self.all_vnas.setText(_translate("MainWindow", "Use all VNAs"))
+        self.throughput.setText(_translate("MainWindow", "-"))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_production), _translate("MainWindow", "Production"))
+        self.timing_enabled.setToolTip(_translate("MainWindow", "Time the stages of every measurement"))
+        self.timing_enabled.setText(_translate("MainWindow", "Enable timing"))
+        self.btn_timing_reset.setText(_translate("MainWindow", "Reset"))
+        self.btn_timing_export.setToolTip(_translate("MainWindow", "Export as json, or in the Prometheus text format for files ending in .prom"))
+        self.btn_timing_export.setText(_translate("MainWindow", "Export"))
+        item = self.timing_table.horizontalHeaderItem(0)
+        item.setText(_translate("MainWindow", "Stage"))
+        item = self.timing_table.horizontalHeaderItem(1)
+        item.setText(_translate("MainWindow", "Count"))
+        item = self.timing_table.horizontalHeaderItem(2)
+        item.setText(_translate("MainWindow", "Total [s]"))
+        item = self.timing_table.horizontalHeaderItem(3)
+        item.setText(_translate("MainWindow", "Mean [ms]"))
+        item = self.timing_table.horizontalHeaderItem(4)
+        item.setText(_translate("MainWindow", "p95 [ms]"))
+        item = self.timing_table.horizontalHeaderItem(5)
+        item.setText(_translate("MainWindow", "Max [ms]"))
+        self.label_link.setText(_translate("MainWindow", "Serial link of the nanoVNA"))
+        self.link_table.setToolTip(_translate("MainWindow", "Latency: command to echo, throughput and stalls (gaps over 50 ms) of the replies"))
+        item = self.link_table.horizontalHeaderItem(0)
+        item.setText(_translate("MainWindow", "Verb"))
+        item = self.link_table.horizontalHeaderItem(1)
+        item.setText(_translate("MainWindow", "Commands"))
+        item = self.link_table.horizontalHeaderItem(2)
+        item.setText(_translate("MainWindow", "Sent [B]"))
+        item = self.link_table.horizontalHeaderItem(3)
+        item.setText(_translate("MainWindow", "Received [B]"))
+        item = self.link_table.horizontalHeaderItem(4)
+        item.setText(_translate("MainWindow", "Latency p50 [ms]"))
+        item = self.link_table.horizontalHeaderItem(5)
+        item.setText(_translate("MainWindow", "Latency p95 [ms]"))
+        item = self.link_table.horizontalHeaderItem(6)
+        item.setText(_translate("MainWindow", "Throughput [kB/s]"))
+        item = self.link_table.horizontalHeaderItem(7)
+        item.setText(_translate("MainWindow", "Stalls"))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_timing), _translate("MainWindow", "Timing"))
         self.btn_send.setText(_translate("MainWindow", "Send"))
         self.label_21.setText(_translate("MainWindow", "Console:"))
         self.logfile.setPlainText(_translate("MainWindow", "start log:\n"
@@ -562,9 +751,12 @@ class Ui_MainWindow(object):
         self.actionAbout.setText(_translate("MainWindow", "About"))
         self.actionSave.setText(_translate("MainWindow", "Save"))
         self.actionLoad.setText(_translate("MainWindow", "Load"))
+        self.actionLoad_results.setText(_translate("MainWindow", "Load Results"))
         self.actionHelp.setText(_translate("MainWindow", "Help"))
         self.actionExport_Spectre.setText(_translate("MainWindow", "Export Spectre"))
         self.actionas_SPICE_model.setText(_translate("MainWindow", "as SPICE model"))
         self.actionas_Spectre_model.setText(_translate("MainWindow", "as Spectre model"))
+        self.actionresults_as_SPICE_library.setText(_translate("MainWindow", "results as SPICE library"))
+        self.actionresults_as_Spectre_library.setText(_translate("MainWindow", "results as Spectre library"))
 from pyqtgraph import PlotWidget
 import gui.resource_rc
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Measurement Worker
+
+The acquisition and the analysis of a measurement run as jobs in a QThreadPool so the Qt event loop never blocks. The
+jobs talk to the gui only through the signals in WorkerSignals. Acquisition and analysis are separate jobs, so the
+next crystal can already be acquired while the previous one is analysed.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import importlib
+import queue
+import threading
+import time
+from PyQt5 import QtCore
+from methods.analysis import analyse
+from methods.online_estimator import OnlineResonanceEstimator
+from methods.screening import PASSED
+import support.data_management as dm
+from support.archive import toRecord, scanId
+from support.production import ProductionPipeline
+from support import timing
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int)       # progress in percent
+    log = QtCore.pyqtSignal(str)            # message for the log window
+    port_added = QtCore.pyqtSignal(object)      # ListPortInfo of a new serial port
+    port_removed = QtCore.pyqtSignal(object)    # ListPortInfo of a removed serial port
+    partial = QtCore.pyqtSignal(object)     # intermediate data, e.g. after each averaging pass
+    estimate = QtCore.pyqtSignal(object)    # provisional (fs, fp, Q) while the sweep is acquired, None if not yet known
+    screened = QtCore.pyqtSignal(object)    # ScreeningResult
+    data = QtCore.pyqtSignal(object)        # final measurement data
+    result = QtCore.pyqtSignal(object)      # calculated crystal parameters
+    error = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+
+
+class MeasurementJob(QtCore.QRunnable):
+    """
+    Screening and acquisition of one measurement.
+    """
+
+    def __init__(self, vna, vna_type, fmin, fmax, averaging=1, points=101, screener=None, export_file=None,
+                 test_file=None):
+        """
+        :param vna: connected vnajWrapper or nanoVnaWrapper
+        :param vna_type: 'MiniVNA' or 'NanoVNA'
+        :param points: number of points of a single nanoVNA sweep, averaged sweeps have 101 points
+        :param screener: optional CrystalScreening run before the measurement
+        :param export_file: csv file written by vnaJ
+        :param test_file: data loaded if vnaJ cannot be run, the error is raised if None
+        """
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.cancelled = threading.Event()
+        self.vna = vna
+        self.vna_type = vna_type
+        self.fmin = int(float(fmin))
+        self.fmax = int(float(fmax))
+        self.averaging = int(averaging)
+        self.points = int(points)
+        self.screener = screener
+        self.export_file = export_file
+        self.test_file = test_file
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _check(self):
+        if self.cancelled.is_set():
+            raise InterruptedError('measurement cancelled')
+
+    def _load(self, file):
+        data = dm.DataManagement()
+        e = data.loadData(file=file)
+        if e:
+            raise IOError(e)
+        return data.data
+
+    def _coarseScan(self):
+        if self.vna_type == 'MiniVNA':
+            e = self.vna.run_vnaJ(fstart=self.fmin, fstop=self.fmax, average=1, exports='csv',
+                                  steps=self.screener.points, cancel=self.cancelled)
+            if e:
+                raise e
+            return self._load(self.export_file)
+        return self.vna.scanTrData(start=self.fmin, stop=self.fmax, points=self.screener.points)
+
+    @timing.timed('measurement.screening')
+    def _screen(self):
+        try:
+            data = self._coarseScan()
+        except InterruptedError:
+            raise
+        except Exception as e:
+            logger.debug('error: screening not completed:\n{}'.format(e))
+            self.signals.log.emit('could not run screening, continuing with measurement')
+            return None
+
+        result = self.screener.screen(data)
+        self.signals.log.emit('screening: {} (peak {:.1f} dB, floor {:.1f} dB, phase swing {:.0f} deg)'.format(
+            result.reason, result.peak_loss or 0, result.noise_floor or 0, result.phase_swing or 0))
+        self.signals.partial.emit(data)
+        self.signals.screened.emit(result)
+        return result
+
+    @timing.timed('measurement.acquisition')
+    def _acquire(self):
+        if self.vna_type == 'MiniVNA':
+            try:
+                e = self.vna.run_vnaJ(fstart=self.fmin, fstop=self.fmax, average=self.averaging, exports='csv',
+                                      cancel=self.cancelled)
+                if e:
+                    raise e
+                self.signals.progress.emit(50)
+                return self._load(self.export_file)
+            except InterruptedError:
+                raise
+            except Exception as e:
+                logger.debug('error: measurement not completed:\n{}'.format(e))
+                if not self.test_file:
+                    # e.g. in production, where example data must not be taken for a measured part
+                    raise
+                self.signals.log.emit('could not run vnaJ, loading example data')
+                self.signals.log.emit('{}'.format(e))
+                return self._load(self.test_file)
+
+        elif self.vna_type == 'NanoVNA':
+            import pandas as pd
+
+            def partial(progress, frequency, tr_loss, phase):
+                self.signals.progress.emit(20 + int(60 * progress))
+                self.signals.partial.emit(pd.DataFrame({'Frequency(Hz)': frequency,
+                                                        'Transmission Loss(dB)': tr_loss,
+                                                        'Phase(deg)': phase}))
+
+            def averaged(n, averaging, *data):
+                partial((n + 1) / (averaging + 1), *data)
+
+            def scanned(frequency, *data):
+                partial(len(frequency) / self.points, frequency, *data)
+
+            if self.averaging == 1:
+                # a single sweep is scanned in segments, stopped once the resonances are bracketed
+                estimator = OnlineResonanceEstimator(callback=lambda *estimate: self.signals.estimate.emit(estimate))
+                return self.vna.scanTrData(start=self.fmin, stop=self.fmax, points=self.points, estimator=estimator,
+                                           callback=scanned, cancel=self.cancelled)
+            self.vna.setFrequencies(start=float(self.fmin), stop=float(self.fmax))
+            return self.vna.getTrData(averaging=self.averaging, callback=averaged, cancel=self.cancelled)
+
+    @timing.timed('measurement')
+    def run(self):
+        try:
+            self.signals.progress.emit(10)
+
+            # abort early if there is no usable crystal in the fixture
+            if self.screener:
+                result = self._screen()
+                self._check()
+                if result and not result.passed:
+                    self.signals.log.emit('crystal rejected: {}'.format(result.reason))
+                    self.signals.progress.emit(100)
+                    return
+                self.signals.progress.emit(20)
+
+            data = self._acquire()
+            self._check()
+            self.signals.progress.emit(80)
+            self.signals.data.emit(data)
+        except InterruptedError:
+            self.signals.log.emit('measurement cancelled')
+            self.signals.progress.emit(0)
+        except Exception as e:
+            logger.debug('error: measurement not completed:\n{}'.format(e))
+            self.signals.error.emit('measurement failed: {}'.format(e))
+        finally:
+            self.signals.finished.emit()
+
+
+class AnalysisJob(QtCore.QRunnable):
+    """
+    Calculation of the crystal parameters of one measurement.
+    """
+
+    def __init__(self, data, method, r_setup=12.5, cl=0):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.data = data
+        self.method = method
+        self.r_setup = r_setup
+        self.cl = cl
+
+    def run(self):
+        try:
+            self.signals.result.emit(analyse(self.data, self.method, r_setup=self.r_setup, cl=self.cl))
+        except Exception as e:
+            logger.debug('error: could not calculate parameters:\n{}'.format(e))
+            self.signals.error.emit('could not calculate parameters\n{}'.format(e))
+        finally:
+            self.signals.finished.emit()
+
+
+class TrackingJob(QtCore.QRunnable):
+    """
+    Continuous resonance tracking until the job is cancelled.
+    """
+
+    def __init__(self, tracker):
+        """
+        :param tracker: ResonanceTracker
+        """
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.cancelled = threading.Event()
+        self.tracker = tracker
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _sample(self, record, data):
+        self.signals.partial.emit(data)
+        self.signals.result.emit(record)
+
+    def run(self):
+        try:
+            self.tracker.run(self.cancelled, callback=self._sample)
+        except Exception as e:
+            logger.debug('error: tracking stopped:\n{}'.format(e))
+            self.signals.error.emit('tracking stopped: {}'.format(e))
+        finally:
+            self.signals.finished.emit()
+
+
+class ProductionLine:
+    """
+    Production mode: acquisition, analysis and archiving of queued parts as overlapping pipeline stages. A part is
+    acquired when trigger() is called, or as soon as a crystal is detected in the fixture if auto_trigger is set.
+    """
+    poll_interval = 0.5     # time between two contact detection sweeps [s]
+
+    def __init__(self, vna, vna_type, fmin, fmax, archive, method, averaging=1, points=101, r_setup=12.5, cl=0,
+                 screener=None, auto_trigger=False, export_file=None, name=None, signals=None, parts=None):
+        """
+        :param archive: ResultArchive the scans and results are stored in
+        :param screener: CrystalScreening used for the contact detection and to reject bad parts
+        :param name: name of the instrument in the log, e.g. the port of one of several VNAs
+        :param signals, parts: WorkerSignals and queue of the parts shared with other lines, see ProductionBench
+        """
+        self.signals = signals or WorkerSignals()
+        self.name = name
+        self.archive = archive
+        self.method = method
+        self.r_setup = r_setup
+        self.cl = cl
+        self.screener = screener
+        self.auto_trigger = auto_trigger
+        self.next_part = threading.Event()
+        self.waiting = False        # a part waits for trigger()
+        self.contact = False
+        self.pipeline = ProductionPipeline([('acquire', self._acquire),
+                                            ('analyse', self._analyse),
+                                            ('store', self._store)],
+                                           trigger=self._trigger,
+                                           callback=self.signals.result.emit,
+                                           finished=self.signals.finished.emit,
+                                           parts=parts)
+
+        # the acquisition of a part is done by a measurement job sharing the signals and the stop event of the line
+        self.job = MeasurementJob(vna, vna_type, fmin, fmax, averaging=averaging, points=points, screener=screener,
+                                  export_file=export_file)
+        self.job.signals = self.signals
+        self.job.cancelled = self.pipeline.stopped
+
+    def start(self):
+        self.pipeline.start()
+
+    def stop(self):
+        self.pipeline.stop()
+
+    def submit(self, part_id):
+        self.pipeline.submit(part_id)
+
+    def trigger(self):
+        self.next_part.set()
+
+    def join(self, timeout=None):
+        self.pipeline.join(timeout)
+
+    def throughput(self):
+        return self.pipeline.throughput()
+
+    def stageTimes(self):
+        return self.pipeline.stageTimes()
+
+    def _trigger(self, item, stop):
+        if self.name:
+            self.signals.log.emit('next part on {}: {}'.format(self.name, item.part_id))
+        else:
+            self.signals.log.emit('next part: {}'.format(item.part_id))
+        if self.auto_trigger and self.screener:
+            # the previous part has to be removed from the fixture before the next one is detected
+            while not stop.is_set():
+                try:
+                    data = self.job._coarseScan()
+                except InterruptedError:
+                    return False
+                except Exception as e:
+                    logger.debug('error: contact detection failed:\n{}'.format(e))
+                    data = None
+                if data is not None and self.screener.screen(data).passed:
+                    if not self.contact:
+                        self.contact = True
+                        item.status = PASSED
+                        return True
+                else:
+                    self.contact = False
+                stop.wait(self.poll_interval)
+            return False
+
+        self.waiting = True
+        try:
+            while not stop.is_set():
+                if self.next_part.wait(0.1):
+                    self.next_part.clear()
+                    return True
+            return False
+        finally:
+            self.waiting = False
+
+    def _acquire(self, item):
+        # with the contact detection the part was already screened
+        if self.screener and not item.status:
+            result = self.job._screen()
+            if result and not result.passed:
+                item.status = result.reason
+                return
+        try:
+            item.data = self.job._acquire()
+        except InterruptedError:
+            raise
+        except Exception as e:
+            logger.debug('acquisition failed for part {}: {}'.format(item.part_id, e))
+            self.signals.log.emit('part {}: acquisition failed: {}'.format(item.part_id, e))
+            item.error = e
+        if item.data is None:
+            item.status = 'acquisition failed'
+
+    def _analyse(self, item):
+        if item.data is None:
+            return
+        item.results = analyse(item.data, self.method, r_setup=self.r_setup, cl=self.cl, scan_id=scanId(item.time))
+        item.status = 'passed'
+
+    def _store(self, item):
+        if item.status == 'cancelled':
+            return
+        record = toRecord(item.results, part_id=item.part_id, status=item.status, time=item.time)
+        if item.data is not None:
+            self.archive.storeScan(item.part_id, scanId(item.time), item.data)
+        self.archive.storeResult(record)
+        # the gui shows the archived record
+        item.results = record
+
+
+class ProductionBench:
+    """
+    Production on several instruments at once, e.g. all VNAs of a DevicePool. Every instrument runs a ProductionLine of
+    its own, the lines take their parts from one queue, archive into one archive and share the signals. With the
+    contact detection every fixture starts on its own, trigger() starts all instruments waiting for their part.
+    """
+
+    def __init__(self, vnas, fmin, fmax, archive, method, **options):
+        """
+        :param vnas: list of (name, vna, vna_type)
+        :param options: averaging, points, r_setup, cl, screener, auto_trigger and export_file of ProductionLine
+        """
+        self.signals = WorkerSignals()
+        self.archive = archive
+        self.auto_trigger = options.get('auto_trigger', False)
+        parts = queue.Queue()
+        self.lines = [ProductionLine(vna, vna_type, fmin, fmax, archive, method, name=name, signals=self.signals,
+                                     parts=parts, **options)
+                      for name, vna, vna_type in vnas]
+        self._lock = threading.Lock()
+        self._running = 0
+        for line in self.lines:
+            line.pipeline.finished = self._finished
+
+    def _finished(self):
+        with self._lock:
+            self._running -= 1
+            last = not self._running
+        if last:
+            self.signals.finished.emit()
+
+    def start(self):
+        self._running = len(self.lines)
+        for line in self.lines:
+            line.start()
+
+    def stop(self):
+        for line in self.lines:
+            line.stop()
+
+    def submit(self, part_id):
+        # every line takes the next part once it is ready
+        self.lines[0].submit(part_id)
+
+    def trigger(self):
+        for line in self.lines:
+            if line.waiting:
+                line.trigger()
+
+    def join(self, timeout=None):
+        for line in self.lines:
+            line.join(timeout)
+
+    def throughput(self):
+        return sum(line.throughput() for line in self.lines)
+
+    def stageTimes(self):
+        """
+        :return: mean time of the recent parts per stage over the instruments measuring [s]
+        """
+        times = {}
+        for line in self.lines:
+            for name, t in line.stageTimes().items():
+                times.setdefault(name, []).append(t)
+        return {name: sum(t) / max(len([x for x in t if x]), 1) for name, t in times.items()}
+
+
+class StartupJob(QtCore.QRunnable):
+    """
+    Start up work done in the background once the main window is shown: import of the measurement and device modules
+    and loading of the data of the last session.
+    """
+    # modules not needed to show the window, imported ahead of their first use
+    modules = ('methods.analysis', 'devices.nanovna.nanovna_wrapper', 'devices.minivna_tiny.vnaj_wrapper')
+
+    def __init__(self, export_file=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.export_file = export_file
+        self.timing = {}        # step name: duration [s]
+
+    def _step(self, name, function):
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            self.timing[name] = time.perf_counter() - start
+
+    def _modules(self):
+        for module in self.modules:
+            importlib.import_module(module)
+
+    def _data(self):
+        data = dm.DataManagement()
+        if data.loadData(file=self.export_file):
+            return None
+        return data.data
+
+    def run(self):
+        try:
+            self._step('modules', self._modules)
+            data = self._step('last session', self._data)
+            if data is not None:
+                self.signals.data.emit(data)
+        except Exception as e:
+            logger.debug('error: start up not completed:\n{}'.format(e))
+            self.signals.error.emit('start up not completed: {}'.format(e))
+        finally:
+            self.signals.finished.emit()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Results Table Model
+
+Table model of all results of a session for a QTableView. The results stay in a columnar ResultStore, the model only
+keeps an index array of the visible rows for sorting and filtering, and the view only asks for the cells it displays.
+So the table stays fast however many parts have been measured.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import time
+import numpy as np
+from PyQt5 import QtCore
+from methods.crystal_result import METHOD_NAMES
+from support.result_store import ResultStore
+
+
+class ResultsTableModel(QtCore.QAbstractTableModel):
+    # header, RESULT_DTYPE field, display format
+    columns = [('Time', 'time', lambda x: time.strftime('%H:%M:%S', time.localtime(x))),
+               ('Part', 'part_id', str),
+               ('Status', 'status', str),
+               ('fs [kHz]', 'fs', lambda x: '%.3f' % (x/1e3)),
+               ('fp [kHz]', 'fp', lambda x: '%.3f' % (x/1e3)),
+               ('Q', 'Q', lambda x: '%.0f' % x),
+               ('C0 [fF]', 'C0', lambda x: '%.1f' % (x*1e15)),
+               ('C1 [fF]', 'C1', lambda x: '%.3f' % (x*1e15)),
+               ('L1 [mH]', 'L1', lambda x: '%.3f' % (x*1e3)),
+               ('R1 [Ohm]', 'R1', lambda x: '%.1f' % x),
+               ('ESR [Ohm]', 'ESR', lambda x: '-' if x == -1 else '%.1f' % x),
+               ('Method', 'method', lambda x: METHOD_NAMES[x])]
+
+    # fields searched by the filter text
+    filter_fields = ('part_id', 'status')
+
+    def __init__(self, store=None, parent=None):
+        super(ResultsTableModel, self).__init__(parent)
+        self.store = store if store is not None else ResultStore()
+        self.rows = None            # store indices of the visible rows, None shows all rows in store order
+        self._keys = None           # sort keys of the visible rows in ascending order
+        self._sort = None           # (field, Qt.SortOrder)
+        self._filter = ''
+
+    def setStore(self, store):
+        self.beginResetModel()
+        self.store = store
+        self._update()
+        self.endResetModel()
+
+    def _matches(self, records):
+        """
+        :param records: structured array or dict of columns
+        :return: boolean mask of the records containing the filter text
+        """
+        matches = False
+        for field in self.filter_fields:
+            matches = matches | (np.char.find(np.char.lower(records[field]), self._filter) >= 0)
+        return matches
+
+    def _update(self):
+        # index of the visible rows from the filter and the sort order
+        if not self._filter and not self._sort:
+            self.rows = None
+            self._keys = None
+            return
+
+        rows = np.arange(len(self.store))
+        if self._filter:
+            rows = rows[self._matches({field: self.store.column(field) for field in self.filter_fields})]
+        if self._sort:
+            field, order = self._sort
+            keys = self.store.column(field)[rows]
+            ascending = np.argsort(keys, kind='stable')
+            self._keys = keys[ascending]
+            rows = rows[ascending]
+            if order == QtCore.Qt.DescendingOrder:
+                rows = rows[::-1]
+        else:
+            self._keys = None
+        self.rows = rows
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.store) if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        _, field, fmt = self.columns[index.column()]
+        return fmt(self.store[row][field])
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.columns[section][0]
+        return str(section + 1)
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        # column -1 restores the insertion order
+        self._sort = (self.columns[column][1], order) if column >= 0 else None
+        self._update()
+        self.layoutChanged.emit()
+
+    def setFilterText(self, text):
+        self.beginResetModel()
+        self._filter = text.strip().lower()
+        self._update()
+        self.endResetModel()
+
+    def appendRecord(self, record):
+        """
+        Add a result, only the new row is inserted into the view
+        """
+        index = len(self.store)
+        if self.rows is None:
+            self.beginInsertRows(QtCore.QModelIndex(), index, index)
+            self.store.append(record)
+            self.endInsertRows()
+            return
+
+        self.store.append(record)
+        if self._filter and not self._matches(np.atleast_1d(record))[0]:
+            return
+
+        position = len(self.rows)
+        if self._sort:
+            field, order = self._sort
+            key = record[field]
+            ascending = int(np.searchsorted(self._keys, key, side='right'))
+            if order == QtCore.Qt.DescendingOrder:
+                position = len(self.rows) - ascending
+            else:
+                position = ascending
+            self._keys = np.insert(self._keys, ascending, key)
+        self.beginInsertRows(QtCore.QModelIndex(), position, position)
+        self.rows = np.insert(self.rows, position, index)
+        self.endInsertRows()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Analysis
+
+Selection of the measurement method by name, shared by the gui and the command line interface.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+from methods.phaseshift_method import PhaseShiftMethod
+from methods.threedb_method import ThreedbMethod
+
+METHODS = {method.name: method for method in (PhaseShiftMethod, ThreedbMethod)}
+
+
+def analyse(data, method, r_setup=12.5, cl=0, scan_id=0):
+    """
+    Calculate the crystal parameters from data
+    :param method: 'Phase-Shift Method' or '-3dB Method'
+    :param scan_id: id of the scan the data was taken from
+    :return: CrystalResult
+    """
+    if method not in METHODS:
+        raise ValueError('invalid calculation method: {}'.format(method))
+
+    calc = METHODS[method]()
+    calc.updateData(data=data)
+    e = calc.calcParameters(r_setup=r_setup, cl=cl)
+    if e:
+        raise ValueError(e)
+    return calc.getResults(scan_id=scan_id)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Crystal Result
+
+Result record of the measurement methods. A CrystalResult holds the parameters of one crystal with the method and
+the scan they were calculated from. For statistics over many crystals the results are converted in bulk to a numpy
+structured array, which needs about a fifth of the memory of the same results as python objects.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import numpy as np
+
+# crystal parameters and their units, in the order of the tuple returned by getResults() in the past
+PARAMETERS = (('C0', 'F'),      # package capacitance
+              ('C1', 'F'),      # motional capacitance
+              ('L1', 'H'),      # motional inductance
+              ('R1', 'Ohm'),    # motional resistance
+              ('Q', ''),        # quality factor
+              ('fs', 'Hz'),     # series resonance frequency
+              ('fp', 'Hz'),     # parallel resonance frequency
+              ('ESR', 'Ohm'))   # ESR at the load capacitance, -1 without load capacitance
+
+# the method is stored as its index in this list
+METHOD_NAMES = ('', 'Phase-Shift Method', '-3dB Method')
+
+PARAMETER_DTYPE = np.dtype([(name, '<f8') for name, _ in PARAMETERS] +
+                           [('method', 'u1'),       # index in METHOD_NAMES
+                            ('scan_id', '<u8')])    # id of the scan the parameters were calculated from
+
+
+class CrystalResult:
+    """
+    Parameters of one crystal
+    """
+    __slots__ = tuple(name for name, _ in PARAMETERS) + ('method', 'scan_id')
+    units = dict(PARAMETERS)
+
+    def __init__(self, C0=0.0, C1=0.0, L1=0.0, R1=0.0, Q=0.0, fs=0.0, fp=0.0, ESR=-1.0, method='', scan_id=0):
+        """
+        :param method: name of the method, one of METHOD_NAMES
+        :param scan_id: id of the scan, 0 if the scan was not stored
+        """
+        self.C0 = C0
+        self.C1 = C1
+        self.L1 = L1
+        self.R1 = R1
+        self.Q = Q
+        self.fs = fs
+        self.fp = fp
+        self.ESR = ESR
+        self.method = method
+        self.scan_id = scan_id
+
+    def __iter__(self):
+        # unpacks like the former tuple: C0, C1, L1, R1, Q, fs, fp, ESR = result
+        return (getattr(self, name) for name, _ in PARAMETERS)
+
+    def __repr__(self):
+        return 'CrystalResult({}, method={!r}, scan_id={})'.format(
+            ', '.join('{}={:.6g} {}'.format(name, getattr(self, name), unit).rstrip() for name, unit in PARAMETERS),
+            self.method, self.scan_id)
+
+    @classmethod
+    def fromRecord(cls, record):
+        """
+        :param record: structured array record containing the PARAMETER_DTYPE fields
+        """
+        return cls(*(float(record[name]) for name, _ in PARAMETERS),
+                   method=METHOD_NAMES[record['method']], scan_id=int(record['scan_id']))
+
+
+def toStructured(results, dtype=PARAMETER_DTYPE):
+    """
+    Convert results in bulk
+    :param results: iterable of CrystalResult
+    :param dtype: structured dtype containing the PARAMETER_DTYPE fields, further fields are set to zero
+    :return: numpy structured array
+    """
+    results = list(results)
+    array = np.zeros(len(results), dtype=dtype)
+    for name, _ in PARAMETERS:
+        array[name] = [getattr(result, name) for result in results]
+    array['method'] = [METHOD_NAMES.index(result.method) if result.method in METHOD_NAMES else 0
+                       for result in results]
+    array['scan_id'] = [result.scan_id for result in results]
+    return array
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Online Resonance Estimator
+
+The online estimator consumes the sweep segment by segment while it is still being acquired. It keeps a running state
+of the transmission peak (fs), the +/-45° phase crossings, the -3dB points and the antiresonance minimum (fp) and
+publishes provisional values for fs, fp and Q after every segment. As soon as all features are bracketed the
+acquisition can be stopped early.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import numpy as np
+import logging
+
+
+class OnlineResonanceEstimator:
+    """
+    Incremental estimator for fs, fp and Q. Segments have to be fed in ascending frequency order using update().
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, db3=3.0, phase=45.0, fp_margin=6.0, callback=None):
+        """
+        :param db3: drop below the peak used for the bandwidth points [dB]
+        :param phase: phase used for the phase-shift bandwidth points [deg]
+        :param fp_margin: rise above the antiresonance minimum required to consider fp bracketed [dB]
+        :param callback: optional function called with (fs, fp, Q) after every segment
+        """
+        self.db3 = db3
+        self.phase = phase
+        self.fp_margin = fp_margin
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self._freq = np.empty(0)
+        self._loss = np.empty(0)
+        self._phase = np.empty(0)
+        self.n = 0                  # number of points consumed
+        self.segments = 0           # number of segments consumed
+        self.i_peak = None          # running peak (minimum transmission loss)
+        self.i_db3 = [None, None]   # -3dB points below and above the peak
+        self.i_ph = [None, None]    # +45° and -45° crossings around the peak
+        self.i_min = None           # antiresonance minimum above the peak
+        self.fs = None
+        self.fp = None
+        self.Q = None
+
+    def _append(self, frequency, tr_loss, phase):
+        # the buffers grow by doubling so appending a segment is amortised O(segment length)
+        n = self.n + len(tr_loss)
+        if n > len(self._loss):
+            size = max(n, 2 * len(self._loss), 1024)
+            for name in ('_freq', '_loss', '_phase'):
+                buf = np.empty(size)
+                buf[:self.n] = getattr(self, name)[:self.n]
+                setattr(self, name, buf)
+        self._freq[self.n:n] = frequency
+        self._loss[self.n:n] = tr_loss
+        self._phase[self.n:n] = phase
+        self.n = n
+
+    def update(self, frequency, tr_loss, phase):
+        """
+        Consume the next segment of the sweep
+        :param frequency: frequencies of the segment [Hz]
+        :param tr_loss: transmission loss of the segment [dB]
+        :param phase: phase of the segment [deg]
+        :return: bool: True if all features are bracketed and the sweep may be stopped
+        """
+        if not len(tr_loss):
+            return self.isBracketed()
+
+        offset = self.n
+        self._append(frequency, tr_loss, phase)
+        self.segments += 1
+
+        # a new peak invalidates everything that depends on its position, otherwise only the new segment (plus the
+        # last point of the previous one) needs to be searched
+        i = offset + int(np.argmax(self._loss[offset:self.n]))
+        if self.i_peak is None or self._loss[i] > self._loss[self.i_peak]:
+            self.i_peak = i
+            self.i_db3 = [None, None]
+            self.i_ph = [None, None]
+            self.i_min = None
+            self._searchBelowPeak()
+            self._searchAbovePeak(start=self.i_peak)
+        else:
+            self._searchAbovePeak(start=max(offset - 1, self.i_peak))
+
+        self._publish()
+        return self.isBracketed()
+
+    def _searchBelowPeak(self):
+        p = self.i_peak
+        loss = self._loss[:p + 1]
+        ph = self._phase[:p + 1]
+
+        # lower -3dB point: last point below the level before the peak
+        below = np.flatnonzero(loss <= loss[p] - self.db3)
+        if len(below):
+            self.i_db3[0] = int(below[-1])
+
+        # +45° crossing with decreasing phase before the peak
+        cross = np.flatnonzero((ph[1:] <= self.phase) & (ph[:-1] >= self.phase))
+        if len(cross):
+            self.i_ph[0] = int(cross[-1]) + 1
+
+    def _searchAbovePeak(self, start):
+        loss = self._loss[:self.n]
+        ph = self._phase[:self.n]
+
+        # upper -3dB point: first point below the level after the peak
+        if self.i_db3[1] is None:
+            below = np.flatnonzero(loss[start:] <= loss[self.i_peak] - self.db3)
+            if len(below):
+                self.i_db3[1] = start + int(below[0])
+
+        # -45° crossing with decreasing phase after the +45° crossing
+        if self.i_ph[0] is not None and self.i_ph[1] is None:
+            lo = max(start, self.i_ph[0], 1)
+            cross = np.flatnonzero((ph[lo:] <= -self.phase) & (ph[lo - 1:-1] >= -self.phase))
+            if len(cross):
+                self.i_ph[1] = lo + int(cross[0])
+
+        # antiresonance: running minimum above the peak
+        if self.n > start:
+            i = start + int(np.argmin(loss[start:]))
+            if self.i_min is None or loss[i] < loss[self.i_min]:
+                self.i_min = i
+
+    def _publish(self):
+        freq = self._freq
+        self.fs = freq[self.i_peak]
+        self.fp = freq[self.i_min] if self.i_min is not None and self.i_min != self.i_peak else None
+
+        if None not in self.i_db3:
+            bandwidth = freq[self.i_db3[1]] - freq[self.i_db3[0]]
+        elif None not in self.i_ph:
+            bandwidth = (freq[self.i_ph[1]] + freq[self.i_ph[1] - 1] - freq[self.i_ph[0]] - freq[self.i_ph[0] - 1]) / 2
+        else:
+            bandwidth = 0
+        self.Q = self.fs / bandwidth if bandwidth > 0 else None
+
+        self.logger.debug('segment {}: fs = {}, fp = {}, Q = {}'.format(self.segments, self.fs, self.fp, self.Q))
+        if self.callback:
+            self.callback(self.fs, self.fp, self.Q)
+
+    def isBracketed(self):
+        """
+        All features are bracketed once both -3dB points, both phase crossings and a minimum followed by a rise of at
+        least fp_margin have been seen
+        :return: bool
+        """
+        if self.i_peak is None or None in self.i_db3 or None in self.i_ph or self.i_min is None:
+            return False
+        return bool(self._loss[self.n - 1] - self._loss[self.i_min] >= self.fp_margin)
+
+    def getResults(self):
+        """
+        Returns the provisional resonance frequencies and Q factor, None if not yet available
+        :return: float: fs, fp, Q
+        """
+        return self.fs, self.fp, self.Q
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Crystal Screening
+
+The screening runs on a short coarse sweep before the actual measurement. Missing, cracked or badly seated crystals
+are rejected early so the full sweep and averaging do not have to be run for them.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import numpy as np
+import logging
+
+# reject reasons
+PASSED = 'passed'
+NO_DATA = 'no data'
+NO_RESONANCE = 'no resonance'               # peak does not rise above the noise floor, e.g. missing crystal
+RESONANCE_AT_EDGE = 'resonance at edge'     # peak at the border of the span, crystal out of range
+NO_PHASE_SWING = 'no phase swing'           # resonance too damped, e.g. cracked or badly seated crystal
+
+
+class ScreeningResult:
+    """
+    Outcome of the screening. reason is one of the reject reasons defined in this module, the measured figures are
+    kept for logging.
+    """
+    __slots__ = ('reason', 'peak_loss', 'noise_floor', 'phase_swing', 'fs')
+
+    def __init__(self, reason, peak_loss=None, noise_floor=None, phase_swing=None, fs=None):
+        self.reason = reason
+        self.peak_loss = peak_loss
+        self.noise_floor = noise_floor
+        self.phase_swing = phase_swing
+        self.fs = fs
+
+    @property
+    def passed(self):
+        return self.reason == PASSED
+
+    def __repr__(self):
+        return 'ScreeningResult(reason={!r}, peak_loss={}, noise_floor={}, phase_swing={}, fs={})'.format(
+            self.reason, self.peak_loss, self.noise_floor, self.phase_swing, self.fs)
+
+
+class CrystalScreening:
+    """
+    Checks a coarse sweep for the presence of a usable series resonance.
+    """
+    logger = logging.getLogger(__name__)
+
+    min_peak = 6.0          # minimum rise of the peak above the noise floor [dB]
+    min_phase_swing = 45.0  # minimum phase swing around the peak [deg]
+    window = 5              # number of points on either side of the peak used for the phase swing
+    points = 101            # number of points used for the coarse sweep
+
+    def __init__(self, min_peak=None, min_phase_swing=None):
+        if min_peak is not None:
+            self.min_peak = min_peak
+        if min_phase_swing is not None:
+            self.min_phase_swing = min_phase_swing
+
+    def screen(self, data):
+        """
+        Screen a coarse sweep
+        :param data: pandas dataframe with the columns "Frequency(Hz)", "Transmission Loss(dB)" and "Phase(deg)"
+        :return: ScreeningResult
+        """
+        if data is None or len(data) < 3:
+            return ScreeningResult(NO_DATA)
+
+        freq = np.asarray(data['Frequency(Hz)'], dtype=float)
+        loss = np.asarray(data['Transmission Loss(dB)'], dtype=float)
+        phase = np.asarray(data['Phase(deg)'], dtype=float)
+
+        i = int(np.argmax(loss))
+        peak_loss = loss[i]
+        noise_floor = float(np.median(loss))
+        phase_swing = float(np.ptp(phase[max(i - self.window, 0):i + self.window + 1]))
+        result = ScreeningResult(PASSED, peak_loss=peak_loss, noise_floor=noise_floor, phase_swing=phase_swing,
+                                 fs=freq[i])
+
+        if peak_loss - noise_floor < self.min_peak:
+            result.reason = NO_RESONANCE
+        elif i == 0 or i == len(loss) - 1:
+            result.reason = RESONANCE_AT_EDGE
+        elif phase_swing < self.min_phase_swing:
+            result.reason = NO_PHASE_SWING
+
+        self.logger.debug('screening: {}'.format(result))
+        return result
@@ -19,7 +19,8 @@ __version__ = "0.1"
 
 import numpy as np
 import logging
-import support.data_management as dm
+from methods.crystal_result import CrystalResult
+from support import timing
 
 # This class is used to analyse the measurement data and calculate the crystal parameters
 class ThreedbMethod:
@@ -29,25 +30,27 @@ class ThreedbMethod:
     """
     logger = logging.getLogger(__name__)
 
-    # crystal model data
-    Rl = 12.5                 # Source and load resistance seen by the crystal (12.5Ohm)
-    C0 = 0.0                # package capacitance
-    R1 = None               # Motional Resistance R1
-    C1 = None               # Motional Capacitance C1
-    L1 = None               # Motional Inductance L1
-    Q = None                # Quality factor
-    fs = None               # frequency at minimum transmission loss (series resonacne frequency)
-    fp = None               # parallel resonant frequency
-    ESR = None              # ESR of crystal
-    Cl = None               # Load Capacitance
-    reff = None             # effective resistance
-    loss_min = None         # minimum transmission loss
-    db3_bandwidth = None    # -3dB bandwidth of series resonance
+    name = '-3dB Method'
 
     def __init__(self):
         super().__init__()
         self.data = None
 
+        # crystal model data
+        self.Rl = 12.5              # Source and load resistance seen by the crystal (12.5Ohm)
+        self.C0 = 0.0               # package capacitance
+        self.R1 = None              # Motional Resistance R1
+        self.C1 = None              # Motional Capacitance C1
+        self.L1 = None              # Motional Inductance L1
+        self.Q = None               # Quality factor
+        self.fs = None              # frequency at minimum transmission loss (series resonacne frequency)
+        self.fp = None              # parallel resonant frequency
+        self.ESR = None             # ESR of crystal
+        self.Cl = None              # Load Capacitance
+        self.reff = None            # effective resistance
+        self.loss_min = None        # minimum transmission loss
+        self.db3_bandwidth = None   # -3dB bandwidth of series resonance
+
     def _analyseData(self):
         self.loss_min = max(self.data['Transmission Loss(dB)'])
         self.logger.debug('Finding minimum loss: {}'.format(self.loss_min))
@@ -91,6 +94,7 @@ class ThreedbMethod:
         else:
             self.ESR = self.R1*(1+self.C0/self.Cl)**2
 
+    @timing.timed('analysis.3db')
     def calcParameters(self, r_setup=12.5, cl=0):
         """
         Calculate the crystal parameters from the data given in self.data
@@ -132,21 +136,26 @@ class ThreedbMethod:
         """
         self.data = data
 
-    def getResults(self):
+    def getResults(self, scan_id=0):
         """
-        Returns the crystal parameters C0, C1, L1, R1, Q, fs, fp
-        :return: float: C0, C1, L1, R1, Q, fs, fp
+        Returns the crystal parameters, the result unpacks like the former tuple (C0, C1, L1, R1, Q, fs, fp, ESR)
+        :param scan_id: id of the scan the data was taken from
+        :return: CrystalResult
         """
-        return self.C0, self.C1, self.L1, self.R1, self.Q, self.fs, self.fp, self.ESR
+        return CrystalResult(C0=self.C0, C1=self.C1, L1=self.L1, R1=self.R1, Q=self.Q, fs=self.fs, fp=self.fp,
+                             ESR=self.ESR, method=self.name, scan_id=scan_id)
 
 
 def verify():
-    file = '../../vnaJ/export/example_data.csv'
-    data = dm.DataManagement()
-    data.loadData(file=file)
+    # synthetic scan of the ideal model in vnaJ/export/ideal_model.txt
+    from support.synthetic import IDEAL_MODEL, ScanGenerator
+    scan = ScanGenerator(noise=1e-4, seed=0)
     test = ThreedbMethod()
-    test.updateData(data=data.data)
+    test.updateData(data=scan.dataframe(points=20001))
     test.calcParameters()
+    result = test.getResults()
+    for name, value in IDEAL_MODEL.items():
+        test.logger.info('%s: %.4g (model %.4g)', name, getattr(result, name), value)
 
     #show(test.data)
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Result Archive
+
+Archive of a production run. The sweep of every part is stored as a compressed numpy file of its own and the
+calculated parameters of all parts are appended as fixed size binary records to one results file, which can be mapped
+into memory again without parsing.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import os
+import re
+import numpy as np
+from methods.crystal_result import CrystalResult, PARAMETER_DTYPE, toStructured
+from support.resonance_tracking import BinaryLog
+
+logger = logging.getLogger(__name__)
+
+# record of one measured part, also the record format of the results file
+RESULT_DTYPE = np.dtype([('time', '<f8'),       # unix time of the acquisition [s]
+                         ('part_id', '<U32'),
+                         ('status', '<U24')]    # 'passed' or the reason the part failed
+                        + PARAMETER_DTYPE.descr)
+
+
+def scanId(time):
+    """
+    :return: id of a scan taken at time, the acquisition time in ms
+    """
+    return int(round(time * 1000))
+
+
+def toRecords(results, part_ids='', status='passed', time=0.0):
+    """
+    Result records of many parts
+    :param results: list of CrystalResult, None for parts without results
+    :param part_ids, status, time: one value for all parts or a sequence with a value per part
+    """
+    records = toStructured([result or CrystalResult(ESR=0.0) for result in results], dtype=RESULT_DTYPE)
+    records['time'] = time
+    records['part_id'] = part_ids
+    records['status'] = status
+    return records
+
+
+def toRecord(result=None, part_id='', status='passed', time=0.0):
+    """
+    Result record of one part
+    :param result: CrystalResult, all parameters are zero if None
+    """
+    return toRecords([result], part_ids=part_id, status=status, time=time)[0]
+
+
+class ResultArchive:
+    """
+    Folder holding the scans and the results of a production run
+    """
+
+    def __init__(self, folder, results='results.bin'):
+        self.folder = folder
+        self.scans = os.path.join(folder, 'scans')
+        os.makedirs(self.scans, exist_ok=True)
+        self.results_file = os.path.join(folder, results)
+        self._log = BinaryLog(self.results_file, dtype=RESULT_DTYPE)
+
+    def _scanFile(self, part_id, scan_id):
+        # part ids are typed in by the operator, keep them usable as file names
+        name = re.sub(r'[^\w.-]', '_', part_id) or 'part'
+        return os.path.join(self.scans, '{}_{}.npz'.format(name, scan_id))
+
+    def storeScan(self, part_id, scan_id, data):
+        """
+        Store the sweep of one part
+        :param scan_id: id of the scan, see scanId()
+        :param data: DataFrame with the frequency, transmission loss and phase columns
+        :return: path of the scan file
+        """
+        file = self._scanFile(part_id, scan_id)
+        np.savez_compressed(file,
+                            frequency=np.asarray(data['Frequency(Hz)'], dtype=float),
+                            tr_loss=np.asarray(data['Transmission Loss(dB)'], dtype=float),
+                            phase=np.asarray(data['Phase(deg)'], dtype=float))
+        return file
+
+    def storeResult(self, record):
+        """
+        Append the results of one or many parts
+        :param record: RESULT_DTYPE record or array of records
+        """
+        self._log.append(record)
+
+    def loadResults(self):
+        """
+        :return: all stored results, mapped from the results file
+        """
+        return BinaryLog.read(self.results_file, dtype=RESULT_DTYPE)
+
+    @staticmethod
+    def loadScan(file):
+        """
+        :return: frequency, tr_loss, phase of a stored scan
+        """
+        with np.load(file) as scan:
+            return scan['frequency'], scan['tr_loss'], scan['phase']
+
+    def close(self):
+        self._log.close()
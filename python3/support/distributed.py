@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Distributed Re-Analysis
+
+Re-analysis of archived scans by workers on several machines sharing a job folder, without a broker:
+
+    job/queue.sqlite            WorkQueue with a task per shard of scans and the settings of the job
+    job/shards/task_<id>.bin    results of one task, RESULT_DTYPE records
+    job/results.bin             all results after the merge, sorted by part and scan
+    job/index.json              summary of the merge
+
+Every scan belongs to exactly one task. A worker analyses its tasks with a process pool like support/reanalysis.py and
+writes the results of a task to a temporary file renamed to its shard, so a shard is complete or missing. A task run
+twice, e.g. after a lost lease, writes the same shard again. The merge only reads the shards, it can be run any time
+and again after more tasks are done.
+
+>> python cli.py cluster submit /mnt/job ../vnaJ/export/production --method 3db --r-setup 12.5
+>> python cli.py cluster work /mnt/job --workers 8                   (on every machine)
+>> python cli.py cluster merge /mnt/job
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import time
+import numpy as np
+from support.archive import RESULT_DTYPE
+from support.reanalysis import Shard, findScans, shardRecords, _analyseShard
+from support.resonance_tracking import BinaryLog
+from support.work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+QUEUE = 'queue.sqlite'
+SHARDS = 'shards'
+RESULTS = 'results.bin'
+INDEX = 'index.json'
+
+
+def openQueue(root, **options):
+    """
+    :param options: lease, retries of the WorkQueue, the values stored by submit() if not given
+    """
+    queue = WorkQueue(os.path.join(root, QUEUE))
+    settings = queue.settings()
+    queue.lease_time = options.get('lease') or settings.get('lease', queue.lease_time)
+    queue.retries = options.get('retries') or settings.get('retries', queue.retries)
+    return queue
+
+
+def shardFile(root, task_id):
+    return os.path.join(root, SHARDS, 'task_{}.bin'.format(task_id))
+
+
+def submit(root, sources, method=None, r_setup=None, cl=None, shard=32, lease=300.0, retries=3):
+    """
+    Create a job or add scans to it, scans already in a task are skipped
+    :param sources: scan files and folders, as seen by all machines
+    :param method, r_setup, cl: settings of a new job, must match the settings of an existing job if given
+    :param shard: number of scans per task
+    :return: number of tasks added
+    """
+    os.makedirs(os.path.join(root, SHARDS), exist_ok=True)
+    queue = WorkQueue(os.path.join(root, QUEUE))
+    try:
+        settings = queue.settings()
+        given = {'method': method, 'r_setup': r_setup, 'cl': cl}
+        if settings:
+            for name, value in given.items():
+                if value is not None and value != settings[name]:
+                    raise ValueError('job in {} has {}={}'.format(root, name, settings[name]))
+        else:
+            if method is None:
+                raise ValueError('the method of a new job is required')
+            queue.setSettings(method=method, r_setup=12.5 if r_setup is None else r_setup, cl=cl or 0,
+                              lease=lease, retries=retries)
+        queued = set()
+        for _, payload, _, _, _, _ in queue.tasks():
+            queued.update(json.loads(payload))
+        files = [file for file in findScans(sources) if file not in queued]
+        # the first scan of a task is its key, as every scan is in one task only
+        tasks = [files[i:i + shard] for i in range(0, len(files), shard)]
+        added = queue.add((task[0], json.dumps(task)) for task in tasks)
+        logger.info('{} tasks with {} scans added to {}'.format(added, len(files), root))
+        return added
+    finally:
+        queue.close()
+
+
+class Worker:
+    """
+    Works on the tasks of a job until all are done or failed
+    """
+
+    def __init__(self, root, workers=None, owner=None, lease=None, retries=None, poll=5.0):
+        """
+        :param root: job folder
+        :param workers: number of processes, one per core if None
+        :param owner: unique name of the worker, host and process id if None
+        :param lease, retries: override the settings of the job
+        :param poll: time between two looks for tasks left by other workers [s]
+        """
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+        self.owner = owner or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.queue = openQueue(root, lease=lease, retries=retries)
+        settings = self.queue.settings()
+        if not settings:
+            raise ValueError('no job in {}'.format(root))
+        self.method = settings['method']
+        self.r_setup = settings['r_setup']
+        self.cl = settings['cl']
+        self.poll = poll
+        self._held = set()          # ids of the leased tasks
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _renew(self):
+        # renew well before the leases expire, also while a shard is still being read
+        while not self._stop.wait(self.queue.lease_time / 3):
+            with self._held_lock:
+                held = list(self._held)
+            renewed = self.queue.renew(self.owner, held) if held else 0
+            if renewed < len(held):
+                logger.warning('{}: {} leases lost'.format(self.owner, len(held) - renewed))
+
+    def _store(self, task_id, records):
+        """
+        Write the shard of a task, replacing the shard of an earlier attempt
+        """
+        file = shardFile(self.root, task_id)
+        temporary = '{}.{}.tmp'.format(file, self.owner)
+        with open(temporary, 'wb') as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, file)
+
+    def _lease(self, count):
+        tasks = self.queue.lease(self.owner, count)
+        with self._held_lock:
+            self._held.update(task_id for task_id, _ in tasks)
+        return tasks
+
+    def _done(self, task_id):
+        with self._held_lock:
+            self._held.discard(task_id)
+
+    def run(self, progress=None):
+        """
+        :param progress: optional function called with the counts of the queue after every task
+        :return: dict with the number of tasks and scans done by this worker, the time and the throughput
+        """
+        os.makedirs(os.path.join(self.root, SHARDS), exist_ok=True)
+        renewal = threading.Thread(target=self._renew, name='lease-renewal', daemon=True)
+        start = time.perf_counter()
+        tasks = scans = lost = 0
+        context = multiprocessing.get_context('spawn' if os.name == 'nt' else 'fork')
+        if os.name != 'nt':
+            # see Reanalysis.run()
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        pending = []
+        try:
+            with context.Pool(self.workers) as pool:
+                # started after the fork of the processes
+                renewal.start()
+                while True:
+                    # keep a task per process and one in reserve
+                    leased = self._lease(self.workers + 1 - len(pending)) if len(pending) <= self.workers else []
+                    for task_id, payload in leased:
+                        try:
+                            shard = Shard(json.loads(payload))
+                        except Exception as e:
+                            logger.warning('task {} failed: {}'.format(task_id, e))
+                            self.queue.fail(self.owner, task_id, e)
+                            self._done(task_id)
+                            continue
+                        result = pool.apply_async(_analyseShard, (shard.block.name, shard.size, shard.offsets,
+                                                                  [scan_id for _, scan_id, _ in shard.info],
+                                                                  self.method, self.r_setup, self.cl))
+                        pending.append((task_id, shard, result))
+                    if not pending:
+                        counts = self.queue.counts()
+                        if not counts['pending'] and not counts['leased']:
+                            break
+                        # tasks of other workers, leased again if their lease expires
+                        time.sleep(self.poll)
+                        continue
+                    task_id, shard, result = pending.pop(0)
+                    try:
+                        self._store(task_id, shardRecords(shard, result.get()))
+                    except Exception as e:
+                        logger.warning('task {} failed: {}'.format(task_id, e))
+                        self.queue.fail(self.owner, task_id, e)
+                    else:
+                        if not self.queue.complete(self.owner, task_id):
+                            # the shard is the same whoever finishes the task
+                            lost += 1
+                        tasks += 1
+                        scans += len(shard.files) + len(shard.errors)
+                    finally:
+                        shard.release()
+                        self._done(task_id)
+                    if progress:
+                        progress(self.queue.counts())
+        finally:
+            for task_id, shard, _ in pending:
+                shard.release()
+            self.queue.release(self.owner, [task_id for task_id, _, _ in pending])
+            self._stop.set()
+            if renewal.is_alive():
+                renewal.join()
+
+        elapsed = time.perf_counter() - start
+        return {'tasks': tasks, 'scans': scans, 'lost': lost, 'time': elapsed,
+                'throughput': scans / elapsed if elapsed else 0.0}
+
+    def close(self):
+        self.queue.close()
+
+
+def merge(root):
+    """
+    Merge the shards into the results file of the job, sorted by part and scan, and write the index
+    :return: index, dict with the number of results, of results by status, the tasks by state and missing shards
+    """
+    queue = openQueue(root)
+    try:
+        counts = queue.counts()
+        done = [task_id for task_id, *_ in queue.tasks('done')]
+    finally:
+        queue.close()
+    folder = os.path.join(root, SHARDS)
+    shards = [int(m.group(1)) for m in (re.match(r'task_(\d+)\.bin$', name) for name in os.listdir(folder)) if m]
+    parts = [np.array(BinaryLog.read(shardFile(root, task_id), dtype=RESULT_DTYPE)) for task_id in sorted(shards)]
+    records = np.concatenate(parts) if parts else np.zeros(0, dtype=RESULT_DTYPE)
+    records = records[np.lexsort((records['scan_id'], records['part_id']))]
+
+    results = os.path.join(root, RESULTS)
+    with open(results + '.tmp', 'wb') as f:
+        f.write(records.tobytes())
+    os.replace(results + '.tmp', results)
+
+    status, n = np.unique(records['status'], return_counts=True)
+    index = {'results': len(records), 'status': dict(zip(status.tolist(), n.tolist())), 'tasks': counts,
+             'missing': sorted(set(done) - set(shards)), 'time': time.time()}
+    with open(os.path.join(root, INDEX), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Log Sink
+
+Messages for the log windows are collected from any thread in a queue and handed out in batches, so the gui only has
+to touch its widgets once per flush. The most recent messages are kept in a ring buffer and all messages are written
+to a rotating log file.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import collections
+import logging
+import logging.handlers
+import queue
+import time
+
+
+class LogSink:
+    """
+    Thread-safe, batching log sink
+    """
+
+    def __init__(self, history=1000, file=None, max_bytes=1000000, backup_count=3):
+        """
+        :param history: number of messages kept in the ring buffer
+        :param file: rotating log file, no file is written if None
+        :param max_bytes: size of the log file before it is rotated
+        :param backup_count: number of rotated log files kept
+        """
+        self._queue = queue.SimpleQueue()
+        self.history = collections.deque(maxlen=history)
+        self._handler = None
+        if file:
+            self._handler = logging.handlers.RotatingFileHandler(file, maxBytes=max_bytes, backupCount=backup_count,
+                                                                 encoding='utf-8', delay=True)
+            self._handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+
+    def write(self, text):
+        """
+        Queue a message, can be called from any thread
+        """
+        self._queue.put((time.time(), text))
+
+    def flush(self):
+        """
+        Take all queued messages, store them in the history and the log file
+        :return: list of the messages queued since the last flush
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        messages = [text for _, text in batch]
+        self.history.extend(messages)
+        if self._handler:
+            for created, text in batch:
+                record = logging.LogRecord('amcp', logging.INFO, __file__, 0, text, None, None)
+                record.created = created
+                self._handler.emit(record)
+            self._handler.flush()
+        return messages
+
+    def close(self):
+        self.flush()
+        if self._handler:
+            self._handler.close()
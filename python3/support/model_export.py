@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Model Export
+
+Equivalent circuit models of measured crystals as SPICE or Spectre subcircuits, for one crystal or for all results of
+a lot in one library. The results are read in chunks from a results file or an array of records and written as they
+are formatted, the memory needed only grows with the set of subcircuit names already used.
+
+The subcircuits of a library are named after the part ids. The names are reduced to letters, digits and _ and start
+with a letter, a part id occurring more than once gets a suffix _2, _3, ... Simulators compare names without case,
+so the uniqueness is checked in lower case.
+
+>> python cli.py export reanalysis/results.bin -o lot42.lib
+>> python cli.py export reanalysis/results.bin --format spectre -o lot42.scs
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import re
+import numpy as np
+from support.archive import RESULT_DTYPE
+from support.resonance_tracking import BinaryLog
+
+logger = logging.getLogger(__name__)
+
+# header: once per file, description: once per single model, subckt: per model with the fields name, part_id, fs, Q,
+# R1, C1, C0, L1; name and title of the file type, extension of a single model and of a library
+FORMATS = {
+    'spice': {
+        'name': 'SPICE',
+        'extension': 'cir',
+        'library': 'lib',
+        'header': '',
+        'description': '* XTAL Model\n'
+                       '* Description: equivalent cirquit model of a crystal resonator\n'
+                       '* Generated by AMCP\n'
+                       '*\n'
+                       '* Node Assignments:\n'
+                       '*            input\n'
+                       '*            |  output\n'
+                       '*            |  |\n',
+        'subckt': '.SUBCKT {name} xi xo\n'
+                  'R1 net0 xi {R1}\n'
+                  'C1 net1 net0 {C1}\n'
+                  'C0 xo xi {C0}\n'
+                  'L1 xo net1 {L1}\n'
+                  '.ENDS',
+        'comment': '* part {part_id}, fs={fs} Hz, Q={Q}\n'},
+    'spectre': {
+        'name': 'Spectre',
+        'extension': 'spectre',
+        'library': 'scs',
+        'header': 'simulator lang=spectre\n',
+        'description': '#\n'
+                       '# XTAL Model\n'
+                       '# Description: equivalent cirquit model of a crystal resonator\n'
+                       '# Generated by AMCP\n'
+                       '#\n'
+                       '# Node Assignments:\n'
+                       '#           input\n'
+                       '#           |  output\n'
+                       '#           |  |\n',
+        'subckt': 'subckt {name} xi xo\n'
+                  'R1 (net0 xi) r={R1}\n'
+                  'C1 (net1 net0) c={C1}\n'
+                  'C0 (xo xi) c={C0}\n'
+                  'L1 (xo net1) l={L1}\n'
+                  'ends',
+        'comment': '// part {part_id}, fs={fs} Hz, Q={Q}\n'},
+}
+
+# the templates of a model in a library, formatted with a bound method of the template
+_LIBRARY = {model: (f['comment'] + f['subckt'] + '\n\n').format for model, f in FORMATS.items()}
+
+_INVALID = re.compile(r'\W+', re.ASCII)
+
+
+def subcircuit(model='spice', C0=0, C1=0, R1=0, L1=0, name='xtal'):
+    """
+    :param model: 'spice' or 'spectre'
+    :return: text of a model file with the subcircuit of one crystal
+    """
+    try:
+        f = FORMATS[model]
+    except KeyError:
+        raise ValueError('invalid export format {} [{}]'.format(model, ', '.join(FORMATS)))
+    return f['header'] + f['description'] + f['subckt'].format(name=name, R1=R1, C1=C1, C0=C0, L1=L1)
+
+
+class SubcktNames:
+    """
+    Unique subcircuit names built from part ids
+    """
+
+    def __init__(self, prefix='xtal'):
+        """
+        :param prefix: start of the names of part ids not starting with a letter
+        """
+        self.prefix = prefix
+        self._used = set()          # lower case names
+        self._next = {}             # lower case base name: next suffix
+
+    def name(self, part_id):
+        base = _INVALID.sub('_', part_id).strip('_') or self.prefix
+        if not base[0].isalpha():
+            base = '{}_{}'.format(self.prefix, base)
+        key = base.lower()
+        n = self._next.get(key, 1)
+        name = base if n == 1 else '{}_{}'.format(base, n)
+        # a suffixed name can also be the id of another part
+        while name.lower() in self._used:
+            n += 1
+            name = '{}_{}'.format(base, n)
+        self._next[key] = n + 1
+        self._used.add(name.lower())
+        return name
+
+
+class LibraryWriter:
+    """
+    Writes the subcircuits of many crystals to one library file
+    """
+
+    def __init__(self, file, model='spice', names=None):
+        """
+        :param file: path of the library
+        :param model: 'spice' or 'spectre'
+        :param names: SubcktNames, e.g. shared by several libraries of a design, new if None
+        """
+        if model not in FORMATS:
+            raise ValueError('invalid export format {} [{}]'.format(model, ', '.join(FORMATS)))
+        self.model = model
+        self.names = names or SubcktNames()
+        self.count = 0
+        self._format = _LIBRARY[model]
+        self._fh = open(file, 'w', newline='')
+        f = FORMATS[model]
+        self._fh.write(f['header'] + f['description'].replace('XTAL Model', 'XTAL Model Library') + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, records):
+        """
+        Append the models of result records
+        :param records: array of RESULT_DTYPE records
+        :return: subcircuit names of the records
+        """
+        columns = [records[field].tolist() for field in ('part_id', 'fs', 'Q', 'R1', 'C1', 'C0', 'L1')]
+        names = [self.names.name(part_id) for part_id in columns[0]]
+        model = self._format
+        self._fh.write(''.join([model(name=name, part_id=part_id, fs=fs, Q=Q, R1=R1, C1=C1, C0=C0, L1=L1)
+                                for name, part_id, fs, Q, R1, C1, C0, L1 in zip(names, *columns)]))
+        self.count += len(names)
+        return names
+
+    def close(self):
+        self._fh.close()
+
+
+def exportLibrary(sources, file, model='spice', status=('passed',), chunk=8192):
+    """
+    Write the models of archived results to one library
+    :param sources: results files (RESULT_DTYPE records) or arrays of records
+    :param status: status of the results exported, all results if None
+    :param chunk: number of records formatted at once
+    :return: number of models written
+    """
+    with LibraryWriter(file, model) as writer:
+        for source in sources:
+            records = BinaryLog.read(source, dtype=RESULT_DTYPE) if isinstance(source, str) else source
+            for start in range(0, len(records), chunk):
+                part = records[start:start + chunk]
+                if status is not None:
+                    part = part[np.isin(part['status'], status)]
+                writer.write(part)
+        logger.info('{} models written to {}'.format(writer.count, file))
+        return writer.count
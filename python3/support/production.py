@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Production Pipeline
+
+The production pipeline measures a queue of parts. Every stage (acquisition, analysis, storage, ...) runs in a thread
+of its own and hands the parts on through a short queue, so the next part is already acquired while the previous one
+is analysed and stored. The pipeline keeps the time every part spent in every stage and the completion times for the
+throughput.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ProductionItem:
+    """
+    One part travelling through the pipeline
+    """
+    __slots__ = ('part_id', 'time', 'data', 'results', 'status', 'error', 'timing')
+
+    def __init__(self, part_id):
+        self.part_id = part_id
+        self.time = None        # start of the acquisition
+        self.data = None        # measured sweep
+        self.results = None     # calculated parameters
+        self.status = ''        # 'passed', 'cancelled' or the reason the part failed
+        self.error = None
+        self.timing = {}        # stage name: time spent in the stage [s]
+
+
+class ProductionPipeline:
+    """
+    Threaded pipeline running every queued part through a list of stages
+    """
+
+    def __init__(self, stages, trigger=None, callback=None, finished=None, depth=2, window=600, parts=None):
+        """
+        :param stages: list of (name, function) run in this order, function(item) updates the item
+        :param trigger: optional function(item, stop) blocking until the part may be acquired, returns False if the
+                        pipeline was stopped in the meantime. The waiting time is not counted as stage time.
+        :param callback: function(item) called from the last stage for every finished part
+        :param finished: function() called when the pipeline has stopped
+        :param depth: number of parts waiting between two stages
+        :param window: time window of the throughput [s]
+        :param parts: queue.Queue of the parts, e.g. shared by the pipelines of several instruments, new if None
+        """
+        self.stages = stages
+        self.trigger = trigger
+        self.callback = callback
+        self.finished = finished
+        self.window = window
+        self.stopped = threading.Event()
+        self.parts = queue.Queue() if parts is None else parts
+        self._queues = [self.parts] + [queue.Queue(maxsize=depth) for _ in stages[1:]]
+        self._threads = []
+        self._done = collections.deque()
+        self._stage_times = {name: collections.deque(maxlen=50) for name, _ in stages}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._started = None
+
+    def start(self):
+        self.stopped.clear()
+        self._started = time.time()
+        self._running = len(self.stages)
+        for n, (name, function) in enumerate(self.stages):
+            thread = threading.Thread(target=self._stage, name='production-{}'.format(name), args=(n, name, function),
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, part_id):
+        self.parts.put(ProductionItem(part_id))
+
+    def stop(self):
+        """
+        Stop after the current part. Parts not yet acquired stay unmeasured, parts already acquired are finished.
+        """
+        self.stopped.set()
+        self.parts.put(_STOP)
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _stage(self, n, name, function):
+        inbox = self._queues[n]
+        outbox = self._queues[n + 1] if n + 1 < len(self._queues) else None
+        try:
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    break
+
+                if n == 0:
+                    if self.stopped.is_set():
+                        break
+                    if self.trigger:
+                        start = time.perf_counter()
+                        triggered = self.trigger(item, self.stopped)
+                        item.timing['trigger'] = time.perf_counter() - start
+                        if not triggered:
+                            break
+                    item.time = time.time()
+
+                if item.status != 'cancelled':
+                    start = time.perf_counter()
+                    try:
+                        function(item)
+                    except InterruptedError:
+                        item.status = 'cancelled'
+                    except Exception as e:
+                        logger.debug('{} failed for part {}: {}'.format(name, item.part_id, e))
+                        item.status = '{} failed'.format(name)
+                        item.error = e
+                    item.timing[name] = time.perf_counter() - start
+                    self._stage_times[name].append(item.timing[name])
+
+                if outbox is not None:
+                    outbox.put(item)
+                else:
+                    self._complete(item)
+        finally:
+            if outbox is not None:
+                outbox.put(_STOP)
+            with self._lock:
+                self._running -= 1
+                last = not self._running
+            if last and self.finished:
+                self.finished()
+
+    def _complete(self, item):
+        with self._lock:
+            now = time.time()
+            self._done.append(now)
+            while self._done and self._done[0] < now - self.window:
+                self._done.popleft()
+        if self.callback:
+            self.callback(item)
+
+    def throughput(self):
+        """
+        :return: parts per hour finished within the last window
+        """
+        if not self._started:
+            return 0.0
+        with self._lock:
+            elapsed = min(self.window, time.time() - self._started)
+            return 3600 * len(self._done) / elapsed if elapsed > 0 else 0.0
+
+    def stageTimes(self):
+        """
+        :return: mean time of the recent parts per stage [s]
+        """
+        return {name: sum(times) / len(times) if times else 0.0 for name, times in self._stage_times.items()}
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Bulk Re-Analysis
+
+Re-analysis of archived scans, e.g. after a change of the fixture, of r_setup or of a method. The scans (vnaJ csv
+exports, .s2p Touchstone files and the npz scans of a ResultArchive) are read in shards. The arrays of a shard are
+copied into one shared memory block, so the worker processes only receive its name and the offsets of the scans
+instead of pickled DataFrames. While the pool analyses a shard the next ones are already read.
+
+The results are appended shard by shard to the results file of a ResultArchive and the analysed scans are recorded in
+a checkpoint file. An interrupted run continues after the last complete shard. The results already in an archive are
+kept, also by a restart.
+
+>> python cli.py reanalyze ../vnaJ/export/production -o reanalysis --method 3db --r-setup 12.5 --workers 8
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import multiprocessing
+import os
+import re
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from support.archive import ResultArchive, RESULT_DTYPE, scanId, toRecords
+from support.data_management import readTrData
+
+logger = logging.getLogger(__name__)
+
+SCAN_EXTENSIONS = ('.csv', '.npz', '.s2p')
+
+CHECKPOINT = 'checkpoint.txt'
+
+# first line of the checkpoint, followed by the size of the results file before the first run
+CHECKPOINT_HEADER = '# results from byte '
+
+
+def findScans(sources):
+    """
+    :param sources: scan files and folders searched recursively
+    :return: sorted list of the scan files
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            for folder, _, names in os.walk(source):
+                files += [os.path.join(folder, name) for name in names if name.endswith(SCAN_EXTENSIONS)]
+        else:
+            files.append(source)
+    return sorted(files)
+
+
+def scanInfo(file):
+    """
+    :return: part_id, scan_id and acquisition time of a scan file
+    """
+    name = os.path.basename(file)
+    match = re.match(r'(.+)_(\d+)\.npz$', name)
+    if match:
+        # scans stored by ResultArchive.storeScan()
+        scan_id = int(match.group(2))
+        return match.group(1), scan_id, scan_id / 1000
+    mtime = os.path.getmtime(file)
+    return os.path.splitext(name)[0], scanId(mtime), mtime
+
+
+def loadScan(file):
+    """
+    :return: frequency, tr_loss, phase of a vnaJ csv export, a Touchstone file or an archived scan
+    """
+    if file.endswith('.npz'):
+        return ResultArchive.loadScan(file)
+    if file.endswith('.s2p'):
+        return readTrData(file)
+    import pandas as pd
+    data = pd.read_csv(file, usecols=['Frequency(Hz)', 'Transmission Loss(dB)', 'Phase(deg)'])
+    return (data['Frequency(Hz)'].to_numpy(dtype=float), data['Transmission Loss(dB)'].to_numpy(dtype=float),
+            data['Phase(deg)'].to_numpy(dtype=float))
+
+
+def _analyseShard(name, size, offsets, scan_ids, method, r_setup, cl):
+    """
+    Worker: analyse the scans of a shard in shared memory
+    :param size: number of points of all scans
+    :param offsets: (start, stop) of every scan
+    :return: list of (CrystalResult or None, error)
+    """
+    import pandas as pd
+    from methods.analysis import analyse
+
+    # the workers share the resource tracker of the parent, which unlinks the block
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = np.ndarray((3, size), dtype=float, buffer=block.buf)
+        results = []
+        for (start, stop), scan_id in zip(offsets, scan_ids):
+            data = pd.DataFrame({'Frequency(Hz)': arrays[0, start:stop].copy(),
+                                 'Transmission Loss(dB)': arrays[1, start:stop].copy(),
+                                 'Phase(deg)': arrays[2, start:stop].copy()})
+            try:
+                results.append((analyse(data, method, r_setup=r_setup, cl=cl, scan_id=scan_id), ''))
+            except Exception as e:
+                results.append((None, str(e)))
+        del arrays
+        return results
+    finally:
+        block.close()
+
+
+class Shard:
+    """
+    Scans of one task, their arrays are kept in a shared memory block until the results are written
+    """
+
+    def __init__(self, files):
+        self.files = []
+        self.info = []
+        self.errors = {}
+        scans = []
+        for file in files:
+            try:
+                scans.append(loadScan(file))
+            except Exception as e:
+                logger.debug('could not load {}: {}'.format(file, e))
+                self.errors[file] = 'unreadable'
+                continue
+            self.files.append(file)
+            self.info.append(scanInfo(file))
+        self.size = sum(len(scan[0]) for scan in scans)
+        self.offsets = []
+        self.block = shared_memory.SharedMemory(create=True, size=max(1, 3 * self.size * 8))
+        arrays = np.ndarray((3, self.size), dtype=float, buffer=self.block.buf)
+        start = 0
+        for scan in scans:
+            stop = start + len(scan[0])
+            arrays[:, start:stop] = scan
+            self.offsets.append((start, stop))
+            start = stop
+        del arrays
+
+    def release(self):
+        self.block.close()
+        self.block.unlink()
+
+
+def shardRecords(shard, results):
+    """
+    :param results: results of _analyseShard() for the shard
+    :return: RESULT_DTYPE records of the scans of a shard, the unreadable ones last
+    """
+    info = shard.info + [scanInfo(file) for file in shard.errors]
+    status = []
+    for file, (result, e) in zip(shard.files, results):
+        if e:
+            logger.debug('{}: {}'.format(file, e))
+        status.append('passed' if result else 'failed')
+    status += list(shard.errors.values())
+    if not info:
+        return np.zeros(0, dtype=RESULT_DTYPE)
+    records = toRecords([result for result, _ in results] + [None] * len(shard.errors),
+                        part_ids=[part for part, _, _ in info], status=status, time=[t for _, _, t in info])
+    records['scan_id'] = [scan_id for _, scan_id, _ in info]
+    return records
+
+
+class Reanalysis:
+    """
+    Re-analysis of many scans with a process pool
+    """
+
+    def __init__(self, sources, output, method, r_setup=12.5, cl=0, workers=None, shard=32):
+        """
+        :param sources: scan files and folders
+        :param output: folder of the ResultArchive the results are written to
+        :param method: 'Phase-Shift Method' or '-3dB Method'
+        :param workers: number of processes, one per core if None
+        :param shard: number of scans per task
+        """
+        self.files = findScans(sources)
+        self.output = output
+        self.method = method
+        self.r_setup = r_setup
+        self.cl = cl
+        self.workers = workers or os.cpu_count() or 1
+        self.shard = shard
+        self.checkpoint = os.path.join(output, CHECKPOINT)
+
+    def _readCheckpoint(self):
+        """
+        :return: size of the results file before the first run, scans done, (None, []) without checkpoint
+        """
+        if not os.path.exists(self.checkpoint):
+            return None, []
+        with open(self.checkpoint) as f:
+            # an incomplete last line is dropped
+            lines = [line.rstrip('\n') for line in f if line.endswith('\n')]
+        if lines and lines[0].startswith(CHECKPOINT_HEADER):
+            return int(lines[0][len(CHECKPOINT_HEADER):]), lines[1:]
+        # checkpoint without header, the run started with an empty results file
+        return 0, lines
+
+    def _resume(self, results_file):
+        """
+        :return: scans done according to the checkpoint, results of an unfinished shard are cut off. The results
+                 which were in the file before the first run, e.g. of an archive, are kept
+        """
+        size = os.path.getsize(results_file) if os.path.exists(results_file) else 0
+        base, done = self._readCheckpoint()
+        if base is None:
+            base = size
+        with open(self.checkpoint, 'w') as f:
+            f.write('{}{}\n'.format(CHECKPOINT_HEADER, base) + ''.join(file + '\n' for file in done))
+        # every scan has exactly one result, written before its checkpoint entry
+        end = base + len(done) * RESULT_DTYPE.itemsize
+        if size < end:
+            raise ValueError('{} is shorter than recorded in {}'.format(results_file, self.checkpoint))
+        if size > end:
+            with open(results_file, 'r+b') as f:
+                f.truncate(end)
+        return done
+
+    def _restart(self, results_file):
+        """
+        Remove the results and the checkpoint of a previous run, the results from before it are kept
+        """
+        base, _ = self._readCheckpoint()
+        if base is None:
+            return
+        if os.path.exists(results_file) and os.path.getsize(results_file) > base:
+            with open(results_file, 'r+b') as f:
+                f.truncate(base)
+        os.remove(self.checkpoint)
+
+    def _write(self, archive, checkpoint, shard, results):
+        """
+        Append the results of a shard and its checkpoint entries
+        :return: number of failed scans
+        """
+        records = shardRecords(shard, results)
+        if not len(records):
+            return 0
+        archive.storeResult(records)
+        checkpoint.write(''.join(file + '\n' for file in shard.files + list(shard.errors)))
+        checkpoint.flush()
+        return int(np.count_nonzero(records['status'] != 'passed'))
+
+    def run(self, resume=True, progress=None):
+        """
+        :param resume: skip the scans in the checkpoint of a previous run, start over otherwise
+        :param progress: optional function called with (done, total) after every shard
+        :return: dict with the number of scans analysed, failed and skipped, the time and the throughput
+        """
+        os.makedirs(self.output, exist_ok=True)
+        archive = ResultArchive(self.output)
+        if not resume:
+            self._restart(archive.results_file)
+        done = set(self._resume(archive.results_file))
+        files = [file for file in self.files if file not in done]
+        shards = [files[i:i + self.shard] for i in range(0, len(files), self.shard)]
+
+        start = time.perf_counter()
+        analysed = failed = 0
+        context = multiprocessing.get_context('spawn' if os.name == 'nt' else 'fork')
+        if os.name != 'nt':
+            # started before the pool, so the workers share it and the blocks are only tracked by the parent
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        with context.Pool(self.workers) as pool, open(self.checkpoint, 'a') as checkpoint:
+            pending = []
+            shards.reverse()
+            try:
+                while shards or pending:
+                    # keep a shard per worker and one in reserve loaded
+                    while shards and len(pending) <= self.workers:
+                        shard = Shard(shards.pop())
+                        task = pool.apply_async(_analyseShard, (shard.block.name, shard.size, shard.offsets,
+                                                                [scan_id for _, scan_id, _ in shard.info],
+                                                                self.method, self.r_setup, self.cl))
+                        pending.append((shard, task))
+                    shard, task = pending.pop(0)
+                    try:
+                        failed += self._write(archive, checkpoint, shard, task.get())
+                    finally:
+                        shard.release()
+                    analysed += len(shard.files) + len(shard.errors)
+                    if progress:
+                        progress(analysed, len(files))
+            finally:
+                for shard, _ in pending:
+                    shard.release()
+                archive.close()
+
+        elapsed = time.perf_counter() - start
+        return {'analysed': analysed, 'failed': failed, 'skipped': len(done), 'time': elapsed,
+                'throughput': analysed / elapsed if elapsed else 0.0}
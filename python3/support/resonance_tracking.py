@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Resonance Tracking
+
+Continuous tracking of the series resonance of one crystal, e.g. for aging or temperature characterisation. A narrow
+window is swept around the last fs, the measured fs is smoothed by an alpha-beta tracking filter which also recentres
+the window. Every sample goes into a fixed size ring buffer for display and into an append-only binary log, so memory
+and CPU use per sweep stay constant however long the tracking runs.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# record of one tracking sample, also the record format of the binary log
+TRACK_DTYPE = np.dtype([('time', '<f8'),        # unix time [s]
+                        ('fs', '<f8'),          # measured series resonance [Hz]
+                        ('fs_track', '<f8'),    # filtered series resonance [Hz]
+                        ('drift', '<f8'),       # filtered drift [Hz/s]
+                        ('R1', '<f8'),          # motional resistance [Ohm]
+                        ('loss', '<f8')])       # minimum transmission loss [dB]
+
+
+class AlphaBetaFilter:
+    """
+    Alpha-beta tracking filter estimating a value and its rate of change
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.value = None
+        self.rate = 0.0
+
+    def predict(self, dt):
+        return self.value + self.rate * dt
+
+    def update(self, measured, dt):
+        if self.value is None:
+            self.value = measured
+            return self.value
+        predicted = self.predict(dt)
+        residual = measured - predicted
+        self.value = predicted + self.alpha * residual
+        if dt > 0:
+            self.rate += self.beta * residual / dt
+        return self.value
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of structured records, the oldest records are overwritten
+    """
+
+    def __init__(self, capacity, dtype=TRACK_DTYPE):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0          # total number of records appended
+
+    def append(self, record):
+        self._data[self.count % self.capacity] = record
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def view(self):
+        """
+        :return: the buffered records in chronological order
+        """
+        if self.count <= self.capacity:
+            return self._data[:self.count]
+        i = self.count % self.capacity
+        return np.concatenate((self._data[i:], self._data[:i]))
+
+
+class BinaryLog:
+    """
+    Append-only log of fixed size binary records
+    """
+
+    def __init__(self, file, dtype=TRACK_DTYPE):
+        self.file = file
+        self.dtype = np.dtype(dtype)
+        self._fh = open(file, 'ab')
+
+    def append(self, record):
+        self._fh.write(np.asarray(record, dtype=self.dtype).tobytes())
+        self._fh.flush()
+
+    def close(self):
+        self._fh.close()
+
+    @staticmethod
+    def read(file, dtype=TRACK_DTYPE):
+        """
+        Map a log file into memory, an incomplete last record of a log still being written is ignored
+        """
+        dtype = np.dtype(dtype)
+        count = os.path.getsize(file) // dtype.itemsize
+        if not count:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode='r', shape=(count,))
+
+
+class ResonanceTracker:
+    """
+    Follows fs and R1 of a crystal with repeated narrow sweeps
+    """
+
+    def __init__(self, vna, fs, span=2000.0, history=10000, log_file=None, r_setup=12.5, alpha=0.5, beta=0.1):
+        """
+        :param vna: vnajWrapper or nanoVnaWrapper
+        :param fs: initial series resonance frequency [Hz]
+        :param span: width of the tracking window [Hz]
+        :param history: number of samples kept in memory
+        :param log_file: binary log the samples are appended to
+        :param r_setup: source and load resistance seen by the crystal [Ohm]
+        """
+        self.vna = vna
+        self.span = span
+        self.r_setup = r_setup
+        self.filter = AlphaBetaFilter(alpha=alpha, beta=beta)
+        self.filter.value = fs
+        self.buffer = RingBuffer(history)
+        self.log = BinaryLog(log_file) if log_file else None
+        self._last = None
+
+    @property
+    def center(self):
+        # centre of the next sweep, predicted from the filtered drift
+        dt = time.time() - self._last if self._last else 0
+        return self.filter.predict(dt)
+
+    @staticmethod
+    def _peak(frequency, loss):
+        # parabolic interpolation of the peak gives a resolution better than the point spacing
+        i = int(np.argmax(loss))
+        if 0 < i < len(loss) - 1:
+            a, b, c = loss[i - 1], loss[i], loss[i + 1]
+            d = a - 2 * b + c
+            offset = 0.5 * (a - c) / d if d else 0
+            return frequency[i] + offset * (frequency[i + 1] - frequency[i - 1]) / 2, b
+        return frequency[i], loss[i]
+
+    def step(self):
+        """
+        Run one sweep around the current centre and update the track
+        :return: (record, data) of the sweep
+        """
+        center = self.center
+        data = self.vna.measure(center - self.span / 2, center + self.span / 2, averaging=1)
+        now = time.time()
+
+        fs, loss = self._peak(np.asarray(data['Frequency(Hz)'], dtype=float),
+                              np.asarray(data['Transmission Loss(dB)'], dtype=float))
+        R1 = 2 * self.r_setup * (10 ** (abs(loss) / 20) - 1)
+        fs_track = self.filter.update(fs, now - self._last if self._last else 0)
+        self._last = now
+
+        record = np.array((now, fs, fs_track, self.filter.rate, R1, loss), dtype=TRACK_DTYPE)
+        self.buffer.append(record)
+        if self.log:
+            self.log.append(record)
+        logger.debug('tracking: fs = {:.1f} Hz, R1 = {:.2f} Ohm'.format(fs, R1))
+        return record, data
+
+    def run(self, stop, callback=None):
+        """
+        Track until the stop event is set
+        :param stop: threading.Event
+        :param callback: optional function called with (record, data) after every sweep
+        """
+        try:
+            while not stop.is_set():
+                record, data = self.step()
+                if callback:
+                    callback(record, data)
+        finally:
+            if self.log:
+                self.log.close()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Result Store
+
+Columnar store of all results of a session. The records are kept in one numpy structured array which grows by
+doubling, so appending a result does not copy the other ones. A store opened from an archive maps the results file
+into memory and only reads the pages actually accessed, the results of the running session are kept behind it.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import numpy as np
+from support.archive import RESULT_DTYPE
+from support.resonance_tracking import BinaryLog
+
+
+class ResultStore:
+    """
+    Growable structured array of RESULT_DTYPE records, optionally behind the records of an archive
+    """
+
+    def __init__(self, base=None, capacity=1024, dtype=RESULT_DTYPE):
+        """
+        :param base: read-only records in front of the store, e.g. an archive mapped into memory
+        :param capacity: initial capacity of the store
+        """
+        self.dtype = np.dtype(dtype)
+        self._base = base if base is not None else np.zeros(0, dtype=self.dtype)
+        self._data = np.zeros(capacity, dtype=self.dtype)
+        self._count = 0
+
+    @classmethod
+    def open(cls, file, capacity=1024):
+        """
+        Store showing the results of an archive, nothing is read until the records are accessed
+        """
+        return cls(base=BinaryLog.read(file, dtype=RESULT_DTYPE), capacity=capacity)
+
+    def __len__(self):
+        return len(self._base) + self._count
+
+    def __getitem__(self, i):
+        n = len(self._base)
+        return self._base[i] if i < n else self._data[i - n]
+
+    def _grow(self, size):
+        capacity = len(self._data)
+        if size > capacity:
+            data = np.zeros(max(size, 2 * capacity), dtype=self.dtype)
+            data[:self._count] = self._data[:self._count]
+            self._data = data
+
+    def append(self, record):
+        self._grow(self._count + 1)
+        self._data[self._count] = record
+        self._count += 1
+
+    def extend(self, records):
+        records = np.asarray(records, dtype=self.dtype)
+        self._grow(self._count + len(records))
+        self._data[self._count:self._count + len(records)] = records
+        self._count += len(records)
+
+    def column(self, field):
+        """
+        :return: one field of all records
+        """
+        if not len(self._base):
+            return self._data[field][:self._count]
+        return np.concatenate((self._base[field], self._data[field][:self._count]))
+
+    def records(self):
+        """
+        :return: copy of all records
+        """
+        return np.concatenate((self._base, self._data[:self._count]))
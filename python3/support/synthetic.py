@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Synthetic Scans
+
+Generator of synthetic transmission scans for tests and benchmarks without hardware. The crystal is modelled by its
+Butterworth-Van Dyke equivalent circuit (R1, L1, C1 in series, C0 in parallel) in an IEC-444 pi-network fixture, which
+terminates the crystal at Rl = 12.5 Ohm on both sides:
+
+    S21 = 2*Rl / (2*Rl + Z_crystal)
+
+Everything is computed on numpy arrays, so millions of points (or many crystals at once, by passing the parameters as
+column vectors) are generated per second. The scans can be returned as arrays or DataFrames, or written as vnaJ csv
+files, Touchstone files or in the binary scan format of the archive.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import numpy as np
+
+# parameters of vnaJ/export/ideal_model.txt
+IDEAL_MODEL = {'C0': 550e-15, 'C1': 1.52e-15, 'L1': 24.71e-3, 'R1': 20.0}
+
+CSV_HEADER = 'Frequency(Hz),Transmission Loss(dB),Phase(deg),Rs,SWR,Xs,|Z|,Theta'
+
+
+def impedance(frequency, C0, C1, L1, R1):
+    """
+    Impedance of the BVD model, the parameters may be arrays broadcasting against frequency
+    """
+    w = 2 * np.pi * np.asarray(frequency, dtype=float)
+    Zm = R1 + 1j * (w * L1 - 1 / (w * C1))
+    return Zm / (1 + 1j * w * C0 * Zm)
+
+
+def s21(frequency, C0, C1, L1, R1, Rl=12.5):
+    """
+    Transmission of the crystal in the fixture
+    :param Rl: source and load resistance seen by the crystal [Ohm]
+    :return: complex S21
+    """
+    return 2 * Rl / (2 * Rl + impedance(frequency, C0, C1, L1, R1))
+
+
+def seriesResonance(C1, L1):
+    return 1 / (2 * np.pi * np.sqrt(L1 * C1))
+
+
+def parallelResonance(C0, C1, L1):
+    return seriesResonance(C1, L1) * np.sqrt(1 + C1 / C0)
+
+
+class ScanGenerator:
+    """
+    Synthetic scans of one crystal with optional measurement noise
+    """
+
+    def __init__(self, C0=IDEAL_MODEL['C0'], C1=IDEAL_MODEL['C1'], L1=IDEAL_MODEL['L1'], R1=IDEAL_MODEL['R1'],
+                 Rl=12.5, noise=0.0, phase_noise=0.0, seed=None):
+        """
+        :param noise: standard deviation of the complex noise added to S21 (linear), e.g. 1e-3 for a -60dB floor
+        :param phase_noise: standard deviation of the phase noise [deg]
+        :param seed: seed of the random generator for reproducible scans
+        """
+        self.C0 = C0
+        self.C1 = C1
+        self.L1 = L1
+        self.R1 = R1
+        self.Rl = Rl
+        self.noise = noise
+        self.phase_noise = phase_noise
+        self.random = np.random.RandomState(seed)
+
+    @property
+    def fs(self):
+        return seriesResonance(self.C1, self.L1)
+
+    @property
+    def fp(self):
+        return parallelResonance(self.C0, self.C1, self.L1)
+
+    def frequencies(self, points=1001, span=None):
+        """
+        Frequency grid around the resonances
+        :param span: width of the grid [Hz], by default 1.5 times the distance of fs and fp. The methods need a few points
+                     within the bandwidth of the series resonance, use a narrow span or many points for high Q crystals
+        """
+        fs, fp = self.fs, self.fp
+        span = span or 1.5 * (fp - fs)
+        center = (fs + fp) / 2
+        return np.linspace(center - span / 2, center + span / 2, points)
+
+    def s21(self, frequency):
+        """
+        :return: complex S21 including the noise
+        """
+        s = s21(frequency, self.C0, self.C1, self.L1, self.R1, Rl=self.Rl)
+        if self.noise:
+            s = s + self.noise * (self.random.standard_normal(s.shape) + 1j * self.random.standard_normal(s.shape))
+        if self.phase_noise:
+            s = s * np.exp(1j * np.deg2rad(self.phase_noise) * self.random.standard_normal(s.shape))
+        return s
+
+    def scan(self, frequency=None, points=1001):
+        """
+        :param frequency: frequency grid, see frequencies() if None
+        :return: frequency, transmission loss [dB], phase [deg]
+        """
+        if frequency is None:
+            frequency = self.frequencies(points)
+        frequency = np.asarray(frequency, dtype=float)
+        s = self.s21(frequency)
+        return frequency, 20 * np.log10(np.abs(s)), np.angle(s, deg=True)
+
+    def dataframe(self, frequency=None, points=1001):
+        """
+        :return: pandas dataframe with the columns of a vnaJ export as used by the methods
+        """
+        import pandas as pd
+        frequency, tr_loss, phase = self.scan(frequency, points)
+        return pd.DataFrame({'Frequency(Hz)': frequency, 'Transmission Loss(dB)': tr_loss, 'Phase(deg)': phase})
+
+    def writeCsv(self, file, frequency=None, points=1001):
+        """
+        Write a scan in the csv format exported by vnaJ
+        """
+        frequency, tr_loss, phase = self.scan(frequency, points)
+        z = impedance(frequency, self.C0, self.C1, self.L1, self.R1)
+        zeros = np.zeros(len(frequency))
+        np.savetxt(file, np.column_stack((frequency, tr_loss, phase, z.real, zeros, z.imag, np.abs(z), zeros)),
+                   fmt=('%.3f', '%.2f', '%.2f', '%.1f', '%.2f', '%.1f', '%.1f', '%.1f'), delimiter=',',
+                   header=CSV_HEADER, comments='')
+        return file
+
+    def writeTouchstone(self, file, frequency=None, points=1001):
+        """
+        Write a scan as 2 port Touchstone file referenced to Rl, with S11 = 1 - S21 of the crystal in series between
+        the ports
+        """
+        from support.data_management import writeTouchstone
+        if frequency is None:
+            frequency = self.frequencies(points)
+        s21 = self.s21(np.asarray(frequency, dtype=float))
+        writeTouchstone(file, frequency, 1 - s21, s21, s21, 1 - s21, z0=self.Rl)
+        return file
+
+    def writeBinary(self, file, frequency=None, points=1001):
+        """
+        Write a scan in the binary format of the archive, see ResultArchive.loadScan()
+        """
+        frequency, tr_loss, phase = self.scan(frequency, points)
+        np.savez(file, frequency=frequency, tr_loss=tr_loss, phase=phase)
+        return file
+
+
+def lot(count, spread=0.01, seed=None, **parameters):
+    """
+    Parameters of a lot of crystals scattered around the given (or ideal) model, as column vectors which broadcast
+    against a frequency grid in s21()
+    :param spread: relative standard deviation of the parameters
+    :return: dict of the parameters C0, C1, L1, R1 with shape (count, 1)
+    """
+    random = np.random.RandomState(seed)
+    model = dict(IDEAL_MODEL, **parameters)
+    return {name: value * (1 + spread * random.standard_normal((count, 1))) for name, value in model.items()}
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Timing
+
+Timing of the stages of a measurement (vnaJ, sweep, serial transfer, parsing, file I/O, analysis, plotting). A stage
+is timed with a span or a decorated function and every duration is added to a histogram of its stage:
+
+    with timing.span('nanovna.sweep'):
+        ...
+
+    @timing.timed('data.load')
+    def loadData(...):
+
+Timing is disabled by default, a disabled span costs one check of a global flag. The histograms can be shown as a
+breakdown, or exported as json or in the Prometheus text format.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import bisect
+import functools
+import json
+import threading
+import time
+
+# upper bounds of the histogram buckets [s], from 100 us to 1 min
+BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+           60.0)
+
+enabled = False
+_lock = threading.Lock()
+_stages = {}
+
+
+class Histogram:
+    """
+    Durations of one stage in fixed buckets, with count, sum, minimum and maximum
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # the last bucket counts everything above buckets[-1]
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """
+        :return: upper bound of the bucket holding the quantile q, the maximum for the last bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.total, 'min': self.min if self.count else 0.0, 'max': self.max,
+                'mean': self.mean, 'p50': self.quantile(0.5), 'p95': self.quantile(0.95),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def record(stage, duration):
+    """
+    Add a duration [s] to the histogram of a stage
+    """
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.add(duration)
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record(self.stage, time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def span(stage):
+    """
+    Context manager timing a stage
+    """
+    return _Span(stage) if enabled else _no_span
+
+
+def timed(stage):
+    """
+    Decorator timing every call of a function as a stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def stages():
+    """
+    :return: copy of the histograms by stage
+    """
+    with _lock:
+        return {name: _copy(histogram) for name, histogram in _stages.items()}
+
+
+def _copy(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.count, copy.total, copy.min, copy.max = histogram.count, histogram.total, histogram.min, histogram.max
+    return copy
+
+
+def breakdown():
+    """
+    :return: list of (stage, count, total [s], mean [s], p95 [s], max [s]), the stage with the most time first
+    """
+    rows = [(name, h.count, h.total, h.mean, h.quantile(0.95), h.max) for name, h in stages().items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def toJson(file=None):
+    """
+    :param file: written if given
+    :return: json text of all stages
+    """
+    text = json.dumps({name: h.toDict() for name, h in sorted(stages().items())}, indent=2)
+    if file:
+        with open(file, 'w') as f:
+            f.write(text)
+    return text
+
+
+def toPrometheus(file=None, metric='amcp_stage_seconds'):
+    """
+    :param file: written if given
+    :return: all stages as one histogram metric in the Prometheus text format
+    """
+    lines = ['# HELP {} Duration of the measurement stages.'.format(metric),
+             '# TYPE {} histogram'.format(metric)]
+    for name, h in sorted(stages().items()):
+        cumulative = 0
+        for bound, n in zip([repr(b) for b in h.buckets] + ['+Inf'], h.counts):
+            cumulative += n
+            lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(metric, name, bound, cumulative))
+        lines.append('{}_sum{{stage="{}"}} {!r}'.format(metric, name, h.total))
+        lines.append('{}_count{{stage="{}"}} {}'.format(metric, name, h.count))
+    text = '\n'.join(lines) + '\n'
+    if file:
+        with open(file, 'w') as f:
+            f.write(text)
+    return text
+
+
+def export(file):
+    """
+    Export in the Prometheus text format if the file ends in .prom or .txt, as json otherwise
+    """
+    if file.endswith(('.prom', '.txt')):
+        return toPrometheus(file)
+    return toJson(file)
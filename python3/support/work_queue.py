@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Automated Crystal Parameter Measurement - Work Queue
+
+Queue of tasks in a SQLite database on a shared folder, for jobs running on several machines without a broker. A task
+is leased by one worker for a limited time, the lease is renewed while the worker is busy. The task of a worker which
+crashed or lost the folder is leased again once its lease expired, until it failed retries times.
+
+Every change is a short transaction started with BEGIN IMMEDIATE, so the workers are serialised by the file lock of
+SQLite. The journal stays in the default rollback mode, WAL needs shared memory and does not work on network file
+systems. The file system must support POSIX locks (NFSv4, SMB), the leases assume clocks synchronised within a small
+part of the lease time.
+
+The payload of a task is text, e.g. json. The queue also holds the settings of the job.
+"""
+
+__author__ = "S.Blatter"
+__maintainer__ = "S.Blatter"
+__email__ = "maveric-@gmx.ch"
+__copyright__ = "Copyright 2019"
+__credits__ = ""
+__license__ = "GPL 3.0"
+__status__ = "Developement"
+__version__ = "0.1"
+
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class WorkQueue:
+    """
+    Tasks with leases and retries in a SQLite file, thread-safe
+    """
+
+    def __init__(self, file, lease=300.0, retries=3, timeout=60.0):
+        """
+        :param file: database file, created if it does not exist
+        :param lease: time a task stays leased without renewal [s]
+        :param retries: number of attempts before a task is failed
+        :param timeout: time to wait for the lock of the database [s]
+        """
+        self.file = file
+        self.lease_time = lease
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.executescript('BEGIN IMMEDIATE;' + SCHEMA + 'COMMIT;')
+
+    def close(self):
+        self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def add(self, tasks):
+        """
+        Add tasks, a task with a key already in the queue is ignored
+        :param tasks: iterable of (key, payload)
+        :return: number of tasks added
+        """
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO tasks (key, payload) VALUES (?, ?)', tasks)
+            return db.total_changes - before
+
+    def lease(self, owner, count=1):
+        """
+        Lease pending tasks and the tasks with an expired lease
+        :param owner: unique name of the worker
+        :return: list of (id, payload)
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # expired leases out of attempts are given up
+            db.execute("UPDATE tasks SET state = 'failed', owner = NULL, error = 'lease expired' "
+                       "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, self.retries))
+            tasks = db.execute("SELECT id, payload FROM tasks WHERE state = 'pending' "
+                               "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT ?",
+                               (now, count)).fetchall()
+            db.executemany("UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", [(owner, now + self.lease_time, task_id) for task_id, _ in tasks])
+        return tasks
+
+    def renew(self, owner, ids):
+        """
+        Extend the leases of tasks still held by owner
+        :return: number of leases renewed
+        """
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany("UPDATE tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                           [(time.time() + self.lease_time, task_id, owner) for task_id in ids])
+            return db.total_changes - before
+
+    def complete(self, owner, task_id):
+        """
+        :return: False if the lease was lost, e.g. expired and taken by another worker
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET state = 'done', error = NULL "
+                                "WHERE id = ? AND owner = ? AND state = 'leased'", (task_id, owner))
+            return cursor.rowcount > 0
+
+    def fail(self, owner, task_id, error):
+        """
+        Return a task to the queue, or fail it after the last attempt
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "owner = NULL, lease_until = 0, error = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                       (self.retries, str(error), task_id, owner))
+
+    def release(self, owner, ids):
+        """
+        Return tasks which were not worked on, e.g. on a shutdown, without counting an attempt
+        """
+        with self._transaction() as db:
+            db.executemany("UPDATE tasks SET state = 'pending', owner = NULL, lease_until = 0, "
+                           "attempts = attempts - 1 WHERE id = ? AND owner = ? AND state = 'leased'",
+                           [(task_id, owner) for task_id in ids])
+
+    def retryFailed(self):
+        """
+        Return the failed tasks to the queue with all attempts
+        :return: number of tasks
+        """
+        with self._transaction() as db:
+            return db.execute("UPDATE tasks SET state = 'pending', attempts = 0 WHERE state = 'failed'").rowcount
+
+    def counts(self):
+        """
+        :return: dict of state: number of tasks, expired leases are counted as pending
+        """
+        counts = dict.fromkeys(STATES, 0)
+        with self._lock:
+            rows = self._db.execute("SELECT CASE WHEN state = 'leased' AND lease_until < ? THEN 'pending' "
+                                    "ELSE state END, COUNT(*) FROM tasks GROUP BY 1", (time.time(),)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def tasks(self, state=None):
+        """
+        :return: list of (id, payload, state, owner, attempts, error), of all tasks or of one state
+        """
+        query = 'SELECT id, payload, state, owner, attempts, error FROM tasks'
+        with self._lock:
+            if state:
+                return self._db.execute(query + ' WHERE state = ? ORDER BY id', (state,)).fetchall()
+            return self._db.execute(query + ' ORDER BY id').fetchall()
+
+    def setSettings(self, **settings):
+        """
+        Store settings of the job, the values must be json serialisable
+        """
+        with self._transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+                           [(name, json.dumps(value)) for name, value in settings.items()])
+
+    def settings(self):
+        with self._lock:
+            return {name: json.loads(value) for name, value in self._db.execute('SELECT name, value FROM settings')}